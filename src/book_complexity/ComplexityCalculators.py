@@ -1,9 +1,23 @@
+from collections.abc import Generator
 from dataclasses import dataclass
-from functools import reduce
-from typing import Any, OrderedDict
-
-from line_profiler import profile
-from spacy.tokens import Doc, Token, Span
+from functools import cached_property, reduce
+from typing import Any, ClassVar, OrderedDict
+
+import numpy as np
+from spacy.attrs import (  # type: ignore
+    HEAD,
+    IS_DIGIT,
+    IS_PUNCT,
+    IS_SPACE,
+    LENGTH,
+    LOWER,
+    ORTH,
+    SENT_START,
+)
+from spacy.strings import hash_string  # type: ignore
+from spacy.tokens import Doc, Span, Token
+
+from book_complexity.profiling import profile
 
 
 @dataclass
@@ -39,6 +53,88 @@ class ComplexityCalculator:
         return 0
 
 
+class DocColumns:
+    """The token attributes of a whole Doc as NumPy columns, fetched with a single
+    Doc.to_array call. Anything derived from them is only worked out when first
+    asked for, and is then shared between all the calculators"""
+
+    attrs: ClassVar = [
+        IS_PUNCT,
+        IS_DIGIT,
+        IS_SPACE,
+        LENGTH,
+        HEAD,
+        LOWER,
+        ORTH,
+        SENT_START,
+    ]
+
+    def __init__(self, doc: Doc):
+        self.doc = doc
+        array = doc.to_array(self.attrs)
+        is_punct, is_digit, is_space, length, head, lower, orth, sent_start = array.T
+        self.is_punct = is_punct.astype(bool)
+        self.is_digit = is_digit.astype(bool)
+        self.is_space = is_space.astype(bool)
+        self.length = length.astype(np.int64)
+        # Spacy stores the head as an offset from the token, and to_array hands
+        # negative offsets back as wrapped around uint64s
+        self.head = np.arange(len(doc)) + head.astype(np.int64)
+        self.lower = lower
+        self.orth = orth
+        self.sent_start = sent_start
+        # Without a parser (just a sentencizer, say) every token is its own head,
+        # so the tree columns below only mean anything if this is set
+        self.has_dep = doc.has_annotation("DEP")
+
+    @cached_property
+    def is_word(self) -> np.ndarray:
+        return ~(self.is_punct | self.is_digit | self.is_space)
+
+    @cached_property
+    def is_sentence_start(self) -> np.ndarray:
+        return sentence_starts(self.sent_start)
+
+    @cached_property
+    def __tree(self) -> tuple[np.ndarray, np.ndarray]:
+        """Walk every token up the tree to the root of its sentence at the same time,
+        counting the steps. Returns (depth, root) for each token,
+        with the root itself at depth 1"""
+        depth = np.ones(len(self.doc), dtype=np.int64)
+        node = np.arange(len(self.doc))
+        for _ in range(len(self.doc)):
+            parent = self.head[node]
+            moving = parent != node
+            if not moving.any():
+                break
+            depth += moving
+            node = parent
+        return depth, node
+
+    @property
+    def depth(self) -> np.ndarray:
+        return self.__tree[0]
+
+    @property
+    def sentence_root(self) -> np.ndarray:
+        return self.__tree[1]
+
+
+@dataclass
+class ColumnComplexityCalculator(ComplexityCalculator):
+    """A calculator that can also process a whole doc in one go from its DocColumns,
+    rather than one token or sentence at a time.
+    process_columns should return the same as combining the results of
+    process_sentence and process_token over every sentence and token in the doc,
+    for any doc that can_process_columns says it can handle"""
+
+    def can_process_columns(self, columns: DocColumns) -> bool:
+        return True
+
+    def process_columns(self, columns: DocColumns):
+        return self.null_value()
+
+
 @dataclass
 class ComplexityRatio:
     """The names of the two complexity calculator objects whose values
@@ -63,10 +159,14 @@ class ComplexityCalculators:
     down into sentences and tokens as appropriate to the calculator)
     Calculate all the ratios at the end and return all the results, in the same order as
     the original calculators and ratios were provided.
+    If vectorised, calculators that support it process each doc in bulk from its
+    DocColumns, and the rest fall back to going sentence by sentence and token by token.
     """
 
-    calculators = OrderedDict[str, ComplexityCalculator]()
-    ratios = OrderedDict[str, ComplexityRatio]()
+    def __init__(self, vectorised: bool = True):
+        self.calculators = OrderedDict[str, ComplexityCalculator]()
+        self.ratios = OrderedDict[str, ComplexityRatio]()
+        self.vectorised = vectorised
 
     def add(self, name: str, c: ComplexityCalculator):
         self.calculators[name] = c
@@ -82,55 +182,91 @@ class ComplexityCalculators:
         else:
             raise Exception(f"No calculator or ratio: {key}")
 
+    def __split_calculators(self):
+        """Separate the calculators that can process a whole doc from its DocColumns
+        from the ones that have to fall back to going token by token"""
+        column_calculators = OrderedDict[str, ComplexityCalculator]()
+        fallback_calculators = OrderedDict[str, ComplexityCalculator]()
+        for name, c in self.calculators.items():
+            if self.vectorised and isinstance(c, ColumnComplexityCalculator):
+                column_calculators[name] = c
+            else:
+                fallback_calculators[name] = c
+        return column_calculators, fallback_calculators
+
     @profile
-    def __get_token_values(self, token: Token) -> ComplexityResults:
+    def __get_token_values(self, token: Token, calculators) -> ComplexityResults:
         """Apply all the calculators to this token"""
         return ComplexityResults(
-            [(name, c.process_token(token)) for name, c in self.calculators.items()]
+            [(name, c.process_token(token)) for name, c in calculators.items()]
         )
 
     @profile
-    def __get_sentence_values(self, sent: Span) -> ComplexityResults:
+    def __get_sentence_values(self, sent: Span, calculators) -> ComplexityResults:
         """Apply all the sentence calculators to this sentence,
         and the token calculators to its tokens"""
 
         sentence_results = ComplexityResults(
-            [(name, c.process_sentence(sent)) for name, c in self.calculators.items()]
+            [(name, c.process_sentence(sent)) for name, c in calculators.items()]
         )
 
         token_results = reduce(
-            self.__merge, map(lambda token: self.__get_token_values(token), sent)
+            lambda x, y: self.__merge(x, y, calculators),
+            map(lambda token: self.__get_token_values(token, calculators), sent),
         )
-        return self.__merge(sentence_results, token_results)
+        return self.__merge(sentence_results, token_results, calculators)
 
     @profile
-    def __get_values(self, doc: Doc) -> ComplexityResults:
+    def __get_values(
+        self, doc: Doc, column_calculators, fallback_calculators
+    ) -> ComplexityResults:
         """Apply all the calculators to this document and return the results"""
-        return reduce(
-            self.__merge,
-            map(lambda sent: self.__get_sentence_values(sent), doc.sents),
-            self.__get_initial_values(),
-        )
+        results = self.__get_initial_values()
+
+        if column_calculators:
+            columns = DocColumns(doc)
+            for name, c in column_calculators.items():
+                if c.can_process_columns(columns):
+                    results[name] = c.process_columns(columns)
+                else:
+                    # this doc hasn't got what it needs, so go token by token
+                    fallback_calculators = fallback_calculators.copy()
+                    fallback_calculators[name] = c
+
+        if fallback_calculators:
+            fallback_results = reduce(
+                lambda x, y: self.__merge(x, y, fallback_calculators),
+                map(
+                    lambda sent: self.__get_sentence_values(sent, fallback_calculators),
+                    doc.sents,
+                ),
+                self.__get_initial_values(fallback_calculators),
+            )
+            results.update(fallback_results)
+
+        return results
 
-    def __get_initial_values(self) -> ComplexityResults:
+    def __get_initial_values(self, calculators=None) -> ComplexityResults:
         """Null results that we would expect from an empty document"""
-        return OrderedDict(
-            (name, c.null_value()) for name, c in self.calculators.items()
-        )
+        calculators = self.calculators if calculators is None else calculators
+        return OrderedDict((name, c.null_value()) for name, c in calculators.items())
 
     @profile
-    def __merge(self, x: ComplexityResults, y: ComplexityResults) -> ComplexityResults:
+    def __merge(
+        self, x: ComplexityResults, y: ComplexityResults, calculators=None
+    ) -> ComplexityResults:
         """Call the combine_values function from each calculator on the corresponding values
         in two Results objects, resulting in one Results object
         with an accumulated result for each calculator
         """
+        calculators = self.calculators if calculators is None else calculators
         return ComplexityResults(
             [
                 (
                     name,
                     c.combine_values(x[name], y[name]),
                 )
-                for name, c, in self.calculators.items()
+                for name, c, in calculators.items()
             ]
         )
 
@@ -150,16 +286,66 @@ class ComplexityCalculators:
     def get_results(self, docs) -> ComplexityResults:
         """Apply all the calculators and ratios to this doc
         and return the results"""
+        column_calculators, fallback_calculators = self.__split_calculators()
         results = reduce(
             lambda a, b: self.__merge(a, b),
-            map(lambda doc: self.__get_values(doc), docs),
+            map(
+                lambda doc: self.__get_values(
+                    doc, column_calculators, fallback_calculators
+                ),
+                docs,
+            ),
             self.__get_initial_values(),
         )
-        results = self.__and_finally(results)
+        return self.__finish(results)
 
+    @profile
+    def get_window_results(
+        self, windowed_docs
+    ) -> Generator[tuple[Any, ComplexityResults], Any, ComplexityResults]:
+        """Like get_results, for docs that come in windows, as (window, doc) pairs
+        with the docs of each window together. Yields (window, results) for each
+        window as soon as it is finished, then returns the results for all the docs.
+        Only the running totals are kept, so memory doesn't grow with the docs"""
+        total = self.__get_initial_values()
+        for window, window_results, total in self.__windows(windowed_docs):
+            yield window, self.__finish(window_results)
+        return self.__finish(total)
+
+    @profile
+    def get_running_results(
+        self, windowed_docs
+    ) -> Generator[tuple[Any, ComplexityResults], Any, Any]:
+        """Like get_window_results, but yields the results for all the docs so far
+        as each window is finished, so the caller can stop once it has seen enough"""
+        for window, _, total in self.__windows(windowed_docs):
+            yield window, self.__finish(total)
+
+    def __windows(self, windowed_docs):
+        """The combined values of each window, and of everything up to the end of
+        it, as each window is finished"""
+        column_calculators, fallback_calculators = self.__split_calculators()
+        total = self.__get_initial_values()
+        window_results = self.__get_initial_values()
+        window: Any = None
+        started = False
+        for doc_window, doc in windowed_docs:
+            if started and doc_window is not window:
+                yield window, window_results, total
+                window_results = self.__get_initial_values()
+            window = doc_window
+            started = True
+            values = self.__get_values(doc, column_calculators, fallback_calculators)
+            window_results = self.__merge(window_results, values)
+            total = self.__merge(total, values)
+        if started:
+            yield window, window_results, total
+
+    def __finish(self, results: ComplexityResults) -> ComplexityResults:
+        """Post-process the combined values, and work out the ratios from them"""
+        results = self.__and_finally(results)
         for k, v in self.__get_ratios(results):
             results[k] = v
-
         return results
 
     def __and_finally(self, results: ComplexityResults):
@@ -183,23 +369,102 @@ def __grammar_depth(root_token: Token):
 
 @profile
 def sentence_grammar_depth(sent: Span) -> int:
+    if not sent.doc.has_annotation("DEP"):
+        return 0  # there's no grammatical tree without a parser
     roots = [token for token in sent if token.dep_ == "ROOT"]
     assert len(roots) == 1
     return __grammar_depth(roots[0])
 
 
+def sentence_starts(sent_start: np.ndarray) -> np.ndarray:
+    """Which tokens start a sentence, from a SENT_START column (1 for the first
+    token of a sentence). Whatever set the sentences, the first token starts one"""
+    starts = sent_start == 1
+    starts[:1] = True
+    return starts
+
+
 def words_known(token: Token, vocabulary: set[str]) -> int:
     return 1 if ((token.text in vocabulary) or token.is_digit) else 0
 
 
-@profile
-def vocabulary_level(
-    token: Token, frequency: dict[str, int], levels: list[range]
-) -> int:
-    "Return the correct vocabulary level that reflects the frequency of this token"
-
-    token_frequency = frequency.get(token.text.lower(), 0)
+def frequency_level(word_frequency: int, levels: list[range]) -> int:
     return next(
-        (i for i, range in enumerate(levels) if token_frequency in range),
+        (i for i, range in enumerate(levels) if word_frequency in range),
         0,
     )
+
+
+class VocabLevelTable:
+    """The vocabulary level of every word in a frequency list, worked out once.
+    Words are keyed by the hash spacy gives their lower case text (the LOWER
+    attribute of a token), so looking tokens up doesn't need their strings.
+    It is just two NumPy arrays, so it is cheap to pickle for worker processes."""
+
+    # part of the key for cached tables, so change it whenever the attributes change
+    version = 1
+
+    def __init__(self, frequency: dict[str, int], levels: list[range]):
+        hashes = np.fromiter(
+            (hash_string(word) for word in frequency),
+            dtype=np.uint64,
+            count=len(frequency),
+        )
+        word_levels = np.fromiter(
+            (frequency_level(rank, levels) for rank in frequency.values()),
+            dtype=np.int64,
+            count=len(frequency),
+        )
+        order = np.argsort(hashes)
+        self.hashes = hashes[order]
+        self.word_levels = word_levels[order]
+        self.num_levels = len(levels)
+        # words that aren't in the frequency list at all
+        self.unknown_level = frequency_level(0, levels)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def levels(self, lower: np.ndarray) -> np.ndarray:
+        """The vocabulary level of each of these LOWER hashes"""
+        if not len(self.hashes):
+            return np.full(len(lower), self.unknown_level, dtype=np.int64)
+        found = np.searchsorted(self.hashes, lower)
+        found[found == len(self.hashes)] = 0
+        return np.where(
+            self.hashes[found] == lower, self.word_levels[found], self.unknown_level
+        )
+
+    def histogram(self, lower: np.ndarray) -> np.ndarray:
+        """How many of these LOWER hashes there are at each vocabulary level"""
+        return np.bincount(self.levels(lower), minlength=self.num_levels)
+
+
+@profile
+def columns_grammar_depth(columns: DocColumns) -> int:
+    """The total grammar depth of all the sentences in a doc"""
+    sentence_depths = np.zeros(len(columns.doc), dtype=np.int64)
+    np.maximum.at(sentence_depths, columns.sentence_root, columns.depth)
+    return int(sentence_depths.sum())
+
+
+@profile
+def columns_words_known(columns: DocColumns, vocabulary: set[str]) -> int:
+    """How many tokens in a doc are in the vocabulary (or are digits).
+    Each distinct word is only looked up once"""
+    orth_ids, token_orth = np.unique(columns.orth, return_inverse=True)
+    strings = columns.doc.vocab.strings
+    known = np.fromiter(
+        (strings[int(orth)] in vocabulary for orth in orth_ids),
+        dtype=bool,
+        count=len(orth_ids),
+    )
+    return int(np.count_nonzero(known[token_orth] | columns.is_digit))
+
+
+@profile
+def columns_vocabulary_levels(
+    columns: DocColumns, table: VocabLevelTable
+) -> np.ndarray:
+    """How many tokens in a doc there are at each vocabulary level"""
+    return table.histogram(columns.lower)
@@ -1,2 +1,18 @@
-# ruff: noqa: F401
-from .book_complexity import get_book_complexity, make_nlp, get_books_complexity
+"""Calculate various complexity metrics for texts in human language.
+The functions are imported when first used, because they need spacy"""
+
+import importlib
+
+__lazy_exports = {
+    "get_book_complexity": ".book_complexity",
+    "get_books_complexity": ".book_complexity",
+    "make_nlp": ".book_complexity",
+}
+
+
+def __getattr__(name: str):
+    if name not in __lazy_exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(__lazy_exports[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -1,52 +1,68 @@
 """Calculate various complexity metrics for texts in human language"""
 
+from __future__ import annotations
+
 import glob
+import multiprocessing
+import os
+import re
+from collections import deque
+from collections.abc import Generator
+from dataclasses import dataclass
 from pathlib import Path
-from line_profiler import profile
-from typing import Any, Optional, OrderedDict, TextIO, cast
-import orjsonl as jsonl
-from spacy.tokens import Token, Span
-
+from typing import Any, OrderedDict, TextIO, cast
 
-# from line_profiler import profile
+import alive_progress  # type: ignore
+import numpy as np
+import orjsonl as jsonl
+import unicodecsv  # type: ignore
+from spacy.attrs import SENT_START  # type: ignore
+from spacy.tokens import Doc, Span, Token
 
 from book_complexity.ComplexityCalculators import (
-    ComplexityCalculator,
+    ColumnComplexityCalculator,
     ComplexityCalculators,
     ComplexityRatio,
+    DocColumns,
+    VocabLevelTable,
+    columns_grammar_depth,
+    columns_vocabulary_levels,
+    columns_words_known,
     sentence_grammar_depth,
-    vocabulary_level,
+    sentence_starts,
     words_known,
 )
-import spacy
-import click
-import alive_progress  # type: ignore
-
-import unicodecsv  # type: ignore
-
-from tabulate import tabulate
+from book_complexity.profiling import profile
+from book_complexity.resource_cache import ResourceCache
+from split_sentences.spacy_wrapper import load_nlp
 
 
 def make_nlp(pipeline: str):
-    """Create a Spacy pipeline set up for complexity analysis"""
-    return spacy.load(pipeline, exclude=["lemmatizer", "ner", "attribute_ruler"])
+    """Get the (shared) Spacy pipeline set up for complexity analysis"""
+    return load_nlp(pipeline)
 
 
-class WordCountCalculator(ComplexityCalculator):
+class WordCountCalculator(ColumnComplexityCalculator):
     name = "Word Count"
 
     def process_token(self, token: Token) -> int:
         return 0 if token.is_punct or token.is_digit or token.is_space else 1
 
+    def process_columns(self, columns: DocColumns) -> int:
+        return int(np.count_nonzero(columns.is_word))
+
 
-class SentenceCountCalculator(ComplexityCalculator):
+class SentenceCountCalculator(ColumnComplexityCalculator):
     name = "Sentence Count"
 
     def process_sentence(self, sentence: Span) -> int:
         return 1
 
+    def process_columns(self, columns: DocColumns) -> int:
+        return int(np.count_nonzero(columns.is_sentence_start))
+
 
-class CumulativeWordLengthCalculator(ComplexityCalculator):
+class CumulativeWordLengthCalculator(ColumnComplexityCalculator):
     name = "Cumulative Word Length"
 
     def process_token(self, token: Token):
@@ -54,15 +70,24 @@ class CumulativeWordLengthCalculator(ComplexityCalculator):
             0 if token.is_punct or token.is_digit or token.is_space else len(token.text)
         )
 
+    def process_columns(self, columns: DocColumns) -> int:
+        return int(columns.length[columns.is_word].sum())
 
-class GrammarDepthCalculator(ComplexityCalculator):
+
+class GrammarDepthCalculator(ColumnComplexityCalculator):
     name = "Cumulative Grammar Depth"
 
     def process_sentence(self, sentence: Span):
         return sentence_grammar_depth(sentence)
 
+    def can_process_columns(self, columns: DocColumns) -> bool:
+        return columns.has_dep
+
+    def process_columns(self, columns: DocColumns) -> int:
+        return columns_grammar_depth(columns)
 
-class WordsKnownCalculator(ComplexityCalculator):
+
+class WordsKnownCalculator(ColumnComplexityCalculator):
     name = "Words Known"
 
     def __init__(self, vocabulary):
@@ -71,64 +96,60 @@ class WordsKnownCalculator(ComplexityCalculator):
     def process_token(self, token: Token):
         return words_known(token, cast(set[str], self.vocabulary))
 
+    def process_columns(self, columns: DocColumns) -> int:
+        return columns_words_known(columns, cast(set[str], self.vocabulary))
 
-class VocabLevelCalculator(ComplexityCalculator):
-    name = "Vocabulary Level"
-
-    def __init__(self, frequency, levels):
-        self.frequency = frequency
-        self.levels = levels
 
-    # A "bar chart" is a dictionary telling us how many items there are with each value
-    # We want to know the value of the Nth percentile item
-    def percentile(self, bar_chart: dict[int, int], percent):
-        total_words = sum(bar_chart.values())
-        words_at_percentile = total_words * (percent / 100)
-        running_total = 0
-        sorted_keys = sorted(bar_chart.keys())
-        for number in sorted_keys:
-            running_total = running_total + bar_chart[number]
-            if running_total > words_at_percentile:
-                return number
+class VocabLevelCalculator(ColumnComplexityCalculator):
+    name = "Vocabulary Level"
 
-        return bar_chart[sorted_keys[-1]] if len(sorted_keys) > 0 else 0
+    def __init__(self, frequency, levels=None):
+        """frequency is either a dict of word -> frequency rank, to be sorted
+        into levels, or a VocabLevelTable that has already done that"""
+        if isinstance(frequency, VocabLevelTable):
+            self.table = frequency
+        else:
+            self.table = VocabLevelTable(frequency, levels)
+
+    # A "bar chart" is an array telling us how many items there are at each level
+    # We want to know the level of the Nth percentile item
+    def percentile(self, bar_chart: np.ndarray, percent) -> int:
+        words_at_percentile = bar_chart.sum() * (percent / 100)
+        above = np.flatnonzero(np.cumsum(bar_chart) > words_at_percentile)
+        return int(above[0]) if len(above) else 0
 
     def process_token(self, token: Token):
-        return {vocabulary_level(token, self.frequency, self.levels): 1}
+        counts = self.null_value()
+        counts[self.table.levels(np.array([token.lower], dtype=np.uint64))] = 1
+        return counts
 
-    # Combine dicts to give total number of words at each level
-    def combine_values(self, dict1, dict2):
-        return {
-            key: dict1.get(key, 0) + dict2.get(key, 0)
-            for key in set(dict1) | set(dict2)
-        }
+    def process_columns(self, columns: DocColumns):
+        return columns_vocabulary_levels(columns, self.table)
 
-    def and_finally(self, dict):
-        return self.percentile(dict, 95)
+    def and_finally(self, bar_chart):
+        return self.percentile(bar_chart, 95)
 
     def null_value(self):
-        return {}
+        return np.zeros(self.table.num_levels, dtype=np.int64)
 
 
 @profile
-def generate_docs(nlp, inputfile):
-    for line in inputfile:
-        docs = nlp.pipe([line.strip()])
-        for doc in docs:
-            yield doc
-
-
-@profile
-def get_book_complexity(
-    inputfile,
-    nlp,
-    vocabulary: Optional[set[str]] = None,
-    frequency: Optional[dict[str, int]] = None,
-    levels: Optional[list[range]] = None,
-) -> OrderedDict[str, Any]:
-    """Calculate and return the complexity of a single file
-    (or other iterable that produces strings)"""
-    calculators = ComplexityCalculators()
+def generate_docs(nlp, inputfile, batch_size: int = 1000, n_process: int = 1):
+    """Yield one Doc per line of the input, streaming all the lines through
+    a single nlp.pipe call so that spacy can batch them.
+    The input is read lazily, so memory use doesn't grow with the file"""
+    lines = (line.strip() for line in inputfile)
+    yield from nlp.pipe(lines, batch_size=batch_size, n_process=n_process)
+
+
+def make_calculators(
+    vocabulary: set[str] | None = None,
+    frequency: dict[str, int] | VocabLevelTable | None = None,
+    levels: list[range] | None = None,
+    vectorised: bool = True,
+) -> ComplexityCalculators:
+    """The calculators and ratios for whichever metrics we have what we need for"""
+    calculators = ComplexityCalculators(vectorised=vectorised)
     calculators.add("Word Count", WordCountCalculator())
     calculators.add("Sentence Count", SentenceCountCalculator())
     calculators.add("Cumulative Grammar Depth", GrammarDepthCalculator())
@@ -136,7 +157,7 @@ def get_book_complexity(
 
     if vocabulary:
         calculators.add("Words Known", WordsKnownCalculator(vocabulary))
-    if frequency and levels:
+    if frequency and (levels or isinstance(frequency, VocabLevelTable)):
         calculators.add("Vocab Level", VocabLevelCalculator(frequency, levels))
 
     calculators.addRatio(
@@ -156,41 +177,232 @@ def get_book_complexity(
                 "Percent Words Known", "Words Known", "Word Count"
             ).as_percentage()
         )
+    return calculators
+
 
-    docs = generate_docs(nlp, inputfile)
-    results = calculators.get_results(docs)
+def without_cumulative(results: OrderedDict[str, Any]) -> OrderedDict[str, Any]:
     for k in [k for k in results.keys() if k.startswith("Cumulative")]:
         results.pop(k)  # these were just to calculate the ratios, let's lose them
     return results
 
 
-@click.command()
-@click.argument("inputfile", type=click.File(mode="r", encoding="utf-8"))
-@click.option(
-    "--pipeline", help="Name of spacy pipeline to read file"
-)  # ru_core_news_sm
-@click.option(
-    "--knownmorphs",
-    type=click.File(mode="rb", encoding="utf-8"),
-    help="Known Morphs csv from Ankimorphs",
-)
-@click.option(
-    "--frequencycsv",
-    type=click.File(mode="rb", encoding="utf-8"),
-    help="Word frequency list for the language the file is in",
-)
-def cli_book_complexity(inputfile, pipeline, knownmorphs, frequencycsv):
-    """Calculate complexity of a single text file and send it to the console"""
-    nlp = make_nlp(pipeline)
+@profile
+def get_book_complexity(
+    inputfile,
+    nlp,
+    vocabulary: set[str] | None = None,
+    frequency: dict[str, int] | VocabLevelTable | None = None,
+    levels: list[range] | None = None,
+    batch_size: int = 1000,
+    n_process: int = 1,
+    vectorised: bool = True,
+) -> OrderedDict[str, Any]:
+    """Calculate and return the complexity of a single file
+    (or other iterable that produces strings).
+    batch_size and n_process are passed through to spacy's nlp.pipe.
+    vectorised=False calculates everything token by token, which is much slower.
+    frequency can be a VocabLevelTable, to save sorting the words into levels
+    again for every book"""
+    calculators = make_calculators(vocabulary, frequency, levels, vectorised)
+    docs = generate_docs(nlp, inputfile, batch_size=batch_size, n_process=n_process)
+    return without_cumulative(calculators.get_results(docs))
+
+
+def windowed_docs(
+    docs,
+    sentences: int | None = None,
+    characters: int | None = None,
+    chapter: re.Pattern | None = None,
+) -> Generator[tuple[dict[str, Any], Doc], Any, Any]:
+    """Pair each doc (line) with the window it is in. A window ends after the line
+    that takes it to the given number of sentences or characters, and a line
+    matching the chapter pattern starts a new window, named after that line.
+    Windows only break between lines. Each window is a dict describing it,
+    the same dict for every line in the window"""
+    window: dict[str, Any] = {"window": 0, "first_line": 0, "chapter": None}
+    window_sentences = window_characters = 0
+    for line, doc in enumerate(docs):
+        new_chapter = chapter is not None and chapter.search(doc.text)
+        if line > window["first_line"] and (
+            new_chapter
+            or (sentences and window_sentences >= sentences)
+            or (characters and window_characters >= characters)
+        ):
+            window = {
+                "window": window["window"] + 1,
+                "first_line": line,
+                "chapter": window["chapter"],
+            }
+            window_sentences = window_characters = 0
+        if new_chapter:
+            window["chapter"] = doc.text
+        yield window, doc
+        # counted the same way as the Sentence Count metric
+        sent_start = doc.to_array(SENT_START)
+        window_sentences += int(np.count_nonzero(sentence_starts(sent_start)))
+        window_characters += len(doc.text)
 
-    known_morph_list = morphs_from_csv(knownmorphs) if knownmorphs else None
-    frequency_list = frequencies_from_csv(frequencycsv) if frequencycsv else None
 
-    complexity = get_book_complexity(
-        inputfile, nlp, known_morph_list, frequency_list, levels
+@profile
+def get_book_complexity_profile(
+    inputfile,
+    nlp,
+    vocabulary: set[str] | None = None,
+    frequency: dict[str, int] | VocabLevelTable | None = None,
+    levels: list[range] | None = None,
+    sentences: int | None = None,
+    characters: int | None = None,
+    chapter: str | None = None,
+    batch_size: int = 1000,
+    n_process: int = 1,
+) -> Generator[dict[str, Any], Any, Any]:
+    """The complexity of each window of a book (see windowed_docs), as each window
+    is finished, in one pass over the book, then the complexity of the whole book,
+    with "window": "total". chapter is a regular expression"""
+    calculators = make_calculators(vocabulary, frequency, levels)
+    docs = generate_docs(nlp, inputfile, batch_size=batch_size, n_process=n_process)
+    windows = calculators.get_window_results(
+        windowed_docs(
+            docs, sentences, characters, re.compile(chapter) if chapter else None
+        )
     )
+    while True:
+        try:
+            window, results = next(windows)
+        except StopIteration as finished:
+            # get_window_results returns the results for the whole book
+            yield {"window": "total", **without_cumulative(finished.value)}
+            return
+        yield {**window, **without_cumulative(results)}
+
+
+def spread_order(count: int) -> list[int]:
+    """0 to count - 1 in an order where every prefix is spread across the range
+    (0, then halfway, then the quarters, and so on)"""
+    bits = (count - 1).bit_length() if count > 1 else 0
+    return sorted(range(count), key=lambda i: int(f"{i:0{bits}b}"[::-1], 2))
+
+
+def sample_chunks(
+    filename, chunks: int = 200, chunk_lines: int = 20
+) -> Generator[tuple[dict[str, int], list[str]], Any, Any]:
+    """Split the file into chunks equal parts by size, and yield up to chunk_lines
+    lines from the start of each part, seeking straight to it rather than
+    reading everything before it. Parts are visited in spread_order, so however
+    many have been read so far, they come from all through the file.
+    Each chunk is a dict of its offset, lines and bytes, and the lines read.
+    A line belongs to the part it starts in, so no line is read twice"""
+    size = os.path.getsize(filename)
+    bounds = [size * i // chunks for i in range(chunks + 1)]
+    with open(filename, mode="rb") as file:
+        for part in spread_order(chunks):
+            start, end = bounds[part], bounds[part + 1]
+            if start > 0:
+                # skip to the first line that starts in this part
+                file.seek(start - 1)
+                file.readline()
+            else:
+                file.seek(0)
+            offset = file.tell()
+            lines: list[str] = []
+            while len(lines) < chunk_lines and file.tell() < end:
+                line = file.readline()
+                if not line:
+                    break
+                lines.append(line.decode("utf-8").strip())
+            if lines:
+                length = file.tell() - offset
+                yield {"offset": offset, "lines": len(lines), "bytes": length}, lines
+
+
+@dataclass
+class Sampling:
+    """How to sample a book rather than read all of it (see sample_chunks).
+    Sampling stops once none of the means, the percent words known and the
+    vocabulary level has moved by more than tolerance (as a fraction of its value)
+    over the last patience chunks, as long as at least min_chunks have been read"""
+
+    chunks: int = 200
+    chunk_lines: int = 20
+    tolerance: float = 0.02
+    min_chunks: int = 10
+    patience: int = 3
+
+
+# Metrics that grow with the amount of text, so are scaled up from a sample
+extrapolated_metrics = ["Word Count", "Sentence Count", "Words Known"]
+
+
+def has_converged(history: deque, tolerance: float) -> bool:
+    """Whether every value in the full history is within tolerance of the latest"""
+    if len(history) < cast(int, history.maxlen):
+        return False
+    return all(
+        abs(old - new) <= tolerance * abs(new)
+        for values in history
+        for old, new in zip(values, history[-1])
+    )
+
 
-    print(tabulate([[k, v] for k, v in complexity.items()]))
+@profile
+def get_sampled_book_complexity(
+    filename,
+    nlp,
+    vocabulary: set[str] | None = None,
+    frequency: dict[str, int] | VocabLevelTable | None = None,
+    levels: list[range] | None = None,
+    sampling: Sampling | None = None,
+    n_process: int = 1,
+) -> OrderedDict[str, Any]:
+    """Estimate the complexity of a file from chunks of it (see sample_chunks),
+    stopping once the results have settled down (see Sampling).
+    The counts are scaled up to the size of the whole file.
+    Adds how many lines and what percentage of the file were read,
+    and whether the results converged before the chunks ran out"""
+    sampling = sampling or Sampling()
+    calculators = make_calculators(vocabulary, frequency, levels)
+    tracked = list(calculators.ratios)
+    if "Vocab Level" in calculators.calculators:
+        tracked.append("Vocab Level")
+
+    def chunk_docs():
+        chunks = sample_chunks(filename, sampling.chunks, sampling.chunk_lines)
+        texts = ((line, chunk) for chunk, lines in chunks for line in lines)
+        # small batches, so that not much is parsed beyond where we stop
+        for doc, chunk in nlp.pipe(
+            texts,
+            as_tuples=True,
+            batch_size=sampling.chunk_lines,
+            n_process=n_process,
+        ):
+            yield chunk, doc
+
+    results = None
+    lines = sampled_bytes = 0
+    converged = False
+    history: deque = deque(maxlen=sampling.patience + 1)
+    running_results = calculators.get_running_results(chunk_docs())
+    for chunks, (chunk, results) in enumerate(running_results, start=1):
+        lines += chunk["lines"]
+        sampled_bytes += chunk["bytes"]
+        history.append([results[name] for name in tracked])
+        if chunks >= sampling.min_chunks and has_converged(
+            history, sampling.tolerance
+        ):
+            converged = True
+            break
+    if results is None:
+        results = calculators.get_results([])
+
+    results = without_cumulative(results)
+    size = os.path.getsize(filename)
+    for name in extrapolated_metrics:
+        if name in results and sampled_bytes:
+            results[name] = round(results[name] * size / sampled_bytes)
+    results["Lines Sampled"] = lines
+    results["Percent Sampled"] = round(100 * sampled_bytes / size, 1) if size else 100
+    results["Converged"] = converged
+    return results
 
 
 def morphs_from_csv(knownmorphs) -> set[str]:
@@ -221,17 +433,100 @@ levels = [
 ]
 
 
+def load_morphs(knownmorphs, cache: ResourceCache | None = None) -> set[str]:
+    """morphs_from_csv, through the cache if there is one"""
+    if cache is None:
+        return morphs_from_csv(knownmorphs)
+    return cache.get("morphs", knownmorphs, lambda: morphs_from_csv(knownmorphs))
+
+
+def load_vocab_level_table(
+    frequencycsv, levels: list[range], cache: ResourceCache | None = None
+) -> VocabLevelTable:
+    """The frequencies from frequencies_from_csv sorted into levels,
+    through the cache if there is one"""
+
+    def make():
+        return VocabLevelTable(frequencies_from_csv(frequencycsv), levels)
+
+    if cache is None:
+        return make()
+    levels_key = "_".join(f"{level.start}-{level.stop}" for level in levels)
+    kind = f"levels-v{VocabLevelTable.version}-{levels_key}"
+    return cache.get(kind, frequencycsv, make)
+
+
 def get_book_props(filename: str):
     return {"title": Path(filename).stem, "author": Path(filename).parent.stem}
 
 
-def get_complexities(files, nlp, known_morph_list=None, frequencies=None):
-    for filename in files:
+def get_file_complexity(
+    filename: str,
+    nlp,
+    known_morph_list=None,
+    frequencies=None,
+    sampling: Sampling | None = None,
+):
+    """Calculate the complexity of a single text file, labelled with the
+    language, title and author so it can be written out as a jsonl row.
+    With sampling, only enough of the file is read to estimate it"""
+    if sampling is not None:
+        complexity = get_sampled_book_complexity(
+            filename, nlp, known_morph_list, frequencies, levels, sampling
+        )
+    else:
         with open(filename, "r", encoding="utf-8") as file:
             complexity = get_book_complexity(
                 file, nlp, known_morph_list, frequencies, levels
             )
-            yield {"lang": nlp.meta["lang"]} | get_book_props(file.name) | complexity
+    return {"lang": nlp.meta["lang"]} | get_book_props(filename) | complexity
+
+
+def get_complexities(
+    files, nlp, known_morph_list=None, frequencies=None, sampling=None
+):
+    for filename in files:
+        yield get_file_complexity(
+            filename, nlp, known_morph_list, frequencies, sampling
+        )
+
+
+# Each worker process loads the spacy pipeline and the vocabulary lists once,
+# then keeps them here for every file it is given
+__worker_state: dict[str, Any] = {}
+
+
+def __init_worker(pipeline: str, known_morph_list, frequencies, sampling):
+    __worker_state["nlp"] = make_nlp(pipeline)
+    __worker_state["known_morph_list"] = known_morph_list
+    __worker_state["frequencies"] = frequencies
+    __worker_state["sampling"] = sampling
+
+
+def __worker_file_complexity(filename: str):
+    return get_file_complexity(filename, **__worker_state)
+
+
+def get_complexities_parallel(
+    files,
+    pipeline: str,
+    known_morph_list=None,
+    frequencies=None,
+    workers: int = 2,
+    ordered: bool = False,
+    sampling: Sampling | None = None,
+):
+    """Like get_complexities, but spread the files across a pool of worker processes.
+    Results are yielded as soon as each file is finished, or in the original
+    file order if ordered is set"""
+    with multiprocessing.Pool(
+        workers,
+        initializer=__init_worker,
+        initargs=(pipeline, known_morph_list, frequencies, sampling),
+    ) as pool:
+        # books vary enormously in length, so hand them out one at a time
+        mapper = pool.imap if ordered else pool.imap_unordered
+        yield from mapper(__worker_file_complexity, files, chunksize=1)
 
 
 def get_books_complexity(
@@ -240,20 +535,44 @@ def get_books_complexity(
     knownmorphs: TextIO,
     frequencycsv: TextIO,
     outputfilename: str,
+    workers: int = 1,
+    ordered: bool = False,
+    cache: ResourceCache | None = None,
+    sampling: Sampling | None = None,
 ):
     """Calculate the complexity of all text files in a folder, and
-    output a jsonl file with one line per text file"""
+    output a jsonl file with one line per text file.
+    With more than one worker, files are processed in parallel and results
+    are written as they finish unless ordered is set.
+    With a cache, the parsed CSVs are kept for next time.
+    With sampling, each file's complexity is estimated from part of it"""
     files = glob.glob(inputfolder + "/**/*.txt", recursive=True)
     with alive_progress.alive_bar(len(files), bar="bubbles", spinner="classic") as bar:
-        nlp = make_nlp(pipeline)
-        known_morph_list = morphs_from_csv(knownmorphs) if knownmorphs else None
-        frequencies = frequencies_from_csv(frequencycsv) if frequencycsv else None
-        data = get_complexities(
-            files=files,
-            nlp=nlp,
-            known_morph_list=known_morph_list,
-            frequencies=frequencies,
+        known_morph_list = load_morphs(knownmorphs, cache) if knownmorphs else None
+        # sorted into levels once, rather than for every book
+        frequencies = (
+            load_vocab_level_table(frequencycsv, levels, cache)
+            if frequencycsv
+            else None
         )
+        if workers > 1:
+            data = get_complexities_parallel(
+                files=files,
+                pipeline=pipeline,
+                known_morph_list=known_morph_list,
+                frequencies=frequencies,
+                workers=workers,
+                ordered=ordered,
+                sampling=sampling,
+            )
+        else:
+            data = get_complexities(
+                files=files,
+                nlp=make_nlp(pipeline),
+                known_morph_list=known_morph_list,
+                frequencies=frequencies,
+                sampling=sampling,
+            )
         for row in data:
             jsonl.append(outputfilename, row)
             bar()
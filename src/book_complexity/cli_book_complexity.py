@@ -0,0 +1,143 @@
+import re
+
+import click
+
+
+def check_pattern(ctx, param, value):
+    if value is not None:
+        try:
+            re.compile(value)
+        except re.error as e:
+            raise click.BadParameter(f"not a regular expression: {e}")
+    return value
+
+
+@click.command()
+@click.argument("inputfile", type=click.File(mode="r", encoding="utf-8"))
+@click.option(
+    "--pipeline", help="Name of spacy pipeline to read file"
+)  # ru_core_news_sm
+@click.option(
+    "--knownmorphs",
+    type=click.File(mode="rb", encoding="utf-8"),
+    help="Known Morphs csv from Ankimorphs",
+)
+@click.option(
+    "--frequencycsv",
+    type=click.File(mode="rb", encoding="utf-8"),
+    help="Word frequency list for the language the file is in",
+)
+@click.option(
+    "--batchsize",
+    type=click.IntRange(1),
+    default=1000,
+    show_default=True,
+    help="Number of lines spacy processes in each batch",
+)
+@click.option(
+    "--nprocess",
+    type=click.IntRange(1),
+    default=1,
+    show_default=True,
+    help="Number of processes spacy uses to parse the file",
+)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    show_default=True,
+    help="Keep the parsed CSVs for next time (in $BOOK_COMPLEXITY_CACHE, "
+    "or book_complexity in the user's cache folder)",
+)
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Also write the complexity of each window of the file to this jsonl file",
+)
+@click.option(
+    "--windowsentences",
+    type=click.IntRange(1),
+    help="Start a new profile window after this many sentences",
+)
+@click.option(
+    "--windowchars",
+    type=click.IntRange(1),
+    help="Start a new profile window after this many characters",
+)
+@click.option(
+    "--chapters",
+    callback=check_pattern,
+    help="Regular expression matching the lines that start chapters, "
+    "each of which starts a new profile window",
+)
+def cli_book_complexity(
+    inputfile,
+    pipeline,
+    knownmorphs,
+    frequencycsv,
+    batchsize,
+    nprocess,
+    cache,
+    profile,
+    windowsentences,
+    windowchars,
+    chapters,
+):
+    """Calculate complexity of a single text file and send it to the console"""
+    # imported here so that --help doesn't have to wait for spacy
+    from tabulate import tabulate
+
+    from .book_complexity import (
+        get_book_complexity,
+        get_book_complexity_profile,
+        levels,
+        load_morphs,
+        load_vocab_level_table,
+        make_nlp,
+    )
+    from .resource_cache import ResourceCache
+
+    nlp = make_nlp(pipeline)
+
+    resource_cache = ResourceCache() if cache else None
+    known_morph_list = (
+        load_morphs(knownmorphs, resource_cache) if knownmorphs else None
+    )
+    vocab_levels = (
+        load_vocab_level_table(frequencycsv, levels, resource_cache)
+        if frequencycsv
+        else None
+    )
+
+    if profile:
+        import orjson
+
+        rows = get_book_complexity_profile(
+            inputfile,
+            nlp,
+            known_morph_list,
+            vocab_levels,
+            levels,
+            sentences=windowsentences,
+            characters=windowchars,
+            chapter=chapters,
+            batch_size=batchsize,
+            n_process=nprocess,
+        )
+        with open(profile, mode="wb") as file:
+            for row in rows:
+                file.write(orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE))
+        # the last row is the whole file
+        row.pop("window")
+        complexity = row
+    else:
+        complexity = get_book_complexity(
+            inputfile,
+            nlp,
+            known_morph_list,
+            vocab_levels,
+            levels,
+            batch_size=batchsize,
+            n_process=nprocess,
+        )
+
+    print(tabulate([[k, v] for k, v in complexity.items()]))
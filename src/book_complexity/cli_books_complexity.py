@@ -1,6 +1,3 @@
-from .book_complexity import get_books_complexity
-
-
 import click
 
 
@@ -24,15 +21,85 @@ import click
     type=click.Path(dir_okay=False),
     help="Name of a jsonl file to put the results",
 )
+@click.option(
+    "--workers",
+    type=click.IntRange(1),
+    default=1,
+    show_default=True,
+    help="Number of processes to analyse files in parallel, each with its own spacy pipeline",
+)
+@click.option(
+    "--ordered/--unordered",
+    default=False,
+    show_default=True,
+    help="Write results in the original file order, rather than as each file is finished",
+)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    show_default=True,
+    help="Keep the parsed CSVs for next time (in $BOOK_COMPLEXITY_CACHE, "
+    "or book_complexity in the user's cache folder)",
+)
+@click.option(
+    "--sample",
+    is_flag=True,
+    help="Estimate each file's complexity from chunks spread through it, "
+    "stopping once the results settle down, rather than reading all of it",
+)
+@click.option(
+    "--samplechunks",
+    type=click.IntRange(1),
+    default=200,
+    show_default=True,
+    help="Number of parts each file is split into to sample a chunk from",
+)
+@click.option(
+    "--samplelines",
+    type=click.IntRange(1),
+    default=20,
+    show_default=True,
+    help="Number of lines in each sampled chunk",
+)
+@click.option(
+    "--tolerance",
+    type=click.FloatRange(0),
+    default=0.02,
+    show_default=True,
+    help="Stop sampling once the results move by less than this fraction",
+)
 def cli_books_complexity(
-    inputfolder, pipeline, knownmorphs, frequencycsv, outputfilename
+    inputfolder,
+    pipeline,
+    knownmorphs,
+    frequencycsv,
+    outputfilename,
+    workers,
+    ordered,
+    cache,
+    sample,
+    samplechunks,
+    samplelines,
+    tolerance,
 ):
     """Calculate the complexity of all text files in a folder, and
     output a CSV with one line per text file"""
+    # imported here so that --help doesn't have to wait for spacy
+    from .book_complexity import Sampling, get_books_complexity
+    from .resource_cache import ResourceCache
+
     get_books_complexity(
         inputfolder=inputfolder,
         pipeline=pipeline,
         knownmorphs=knownmorphs,
         frequencycsv=frequencycsv,
         outputfilename=outputfilename,
+        workers=workers,
+        ordered=ordered,
+        cache=ResourceCache() if cache else None,
+        sampling=(
+            Sampling(chunks=samplechunks, chunk_lines=samplelines, tolerance=tolerance)
+            if sample
+            else None
+        ),
     )
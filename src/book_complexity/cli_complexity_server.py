@@ -0,0 +1,114 @@
+import signal
+import sys
+
+import click
+
+
+@click.command()
+@click.option(
+    "--pipeline",
+    "pipelines",
+    multiple=True,
+    required=True,
+    help="Name of a spacy pipeline to keep loaded. Can be given more than once",
+)  # ru_core_news_sm
+@click.option(
+    "--knownmorphs",
+    type=(str, click.File(mode="rb")),
+    multiple=True,
+    help="A pipeline and the Known Morphs csv from Ankimorphs to use with it",
+)
+@click.option(
+    "--frequencycsv",
+    type=(str, click.File(mode="rb")),
+    multiple=True,
+    help="A pipeline and the frequency file for its language",
+)
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=click.IntRange(0, 65535), default=8000, show_default=True)
+@click.option(
+    "--workers",
+    type=click.IntRange(1),
+    default=1,
+    show_default=True,
+    help="Number of processes to analyse texts in parallel, each with every pipeline",
+)
+@click.option(
+    "--maxqueue",
+    type=click.IntRange(0),
+    default=16,
+    show_default=True,
+    help="Number of requests that can wait for a worker before more are turned away",
+)
+@click.option(
+    "--timeout",
+    type=click.FloatRange(0, min_open=True),
+    default=None,
+    help="Seconds to wait for a result before giving up on a request",
+)
+@click.option(
+    "--maxbytes",
+    type=click.IntRange(1),
+    default=10 * 1024 * 1024,
+    show_default=True,
+    help="Largest request body accepted",
+)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    show_default=True,
+    help="Keep the parsed CSVs for next time (in $BOOK_COMPLEXITY_CACHE, "
+    "or book_complexity in the user's cache folder)",
+)
+@click.option("--verbose", is_flag=True, help="Log every request")
+def cli_complexity_server(
+    pipelines,
+    knownmorphs,
+    frequencycsv,
+    host,
+    port,
+    workers,
+    maxqueue,
+    timeout,
+    maxbytes,
+    cache,
+    verbose,
+):
+    """Keep spacy pipelines loaded and calculate the complexity of texts sent
+    over HTTP: POST {"pipeline": ..., "text": ...} as JSON to /complexity"""
+    # imported here so that --help doesn't have to wait for spacy
+    from .book_complexity import levels, load_morphs, load_vocab_level_table
+    from .complexity_server import ComplexityServer, ComplexityService
+    from .resource_cache import ResourceCache
+
+    resource_cache = ResourceCache() if cache else None
+    morphs = {
+        pipeline: load_morphs(file, resource_cache) for pipeline, file in knownmorphs
+    }
+    frequencies = {
+        pipeline: load_vocab_level_table(file, levels, resource_cache)
+        for pipeline, file in frequencycsv
+    }
+    for pipeline in set(morphs) | set(frequencies):
+        if pipeline not in pipelines:
+            raise click.BadParameter(f"{pipeline} isn't one of the --pipeline options")
+    resources = {
+        pipeline: (morphs.get(pipeline), frequencies.get(pipeline))
+        for pipeline in pipelines
+    }
+
+    with ComplexityService(
+        list(pipelines), resources, workers=workers, max_queue=maxqueue, timeout=timeout
+    ) as service:
+        server = ComplexityServer(
+            (host, port), service, max_request_bytes=maxbytes, verbose=verbose
+        )
+        click.echo(f"Serving {', '.join(pipelines)} on {host}:{server.server_port}")
+        # stop the same way for kill as for Ctrl-C, so the workers are shut down
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,207 @@
+"""Serve complexity results over HTTP, from a pool of worker processes that
+keep their spacy pipelines and vocabulary lists loaded between requests.
+
+POST /complexity with a JSON body {"pipeline": "ru_core_news_sm", "text": "..."}
+(pipeline can be left out if the server only has one) returns
+{"pipeline": ..., "results": {...}, "timing": {...}}, where the results are
+what get_book_complexity gives for the lines of the text.
+GET /health describes the server and how busy it is."""
+
+from __future__ import annotations
+
+import json
+import multiprocessing
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+from book_complexity.book_complexity import get_book_complexity, levels, make_nlp
+from book_complexity.ComplexityCalculators import VocabLevelTable
+
+# pipeline -> (known words, vocabulary level table), either of which can be None
+Resources = dict[str, tuple[Optional[set[str]], Optional[VocabLevelTable]]]
+
+# Each worker process loads every pipeline once, then keeps them here
+worker_state: dict[str, Any] = {}
+
+
+def init_worker(pipelines: list[str], resources: Resources):
+    worker_state["nlp"] = {pipeline: make_nlp(pipeline) for pipeline in pipelines}
+    worker_state["resources"] = resources
+
+
+def worker_complexity(pipeline: str, text: str) -> tuple[dict[str, Any], float]:
+    """The complexity of the text, and how many seconds it took to work out"""
+    start = time.perf_counter()
+    vocabulary, frequencies = worker_state["resources"].get(pipeline, (None, None))
+    nlp = worker_state["nlp"][pipeline]
+    results = get_book_complexity(
+        text.splitlines(), nlp, vocabulary, frequencies, levels
+    )
+    return dict(results), time.perf_counter() - start
+
+
+class RequestError(Exception):
+    """A request we can't or won't serve, and the HTTP status to say so with"""
+
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ComplexityService:
+    """A pool of warm worker processes, with a limit on how many requests can be
+    waiting for them. Requests beyond the limit are turned away straight away,
+    rather than queueing up behind each other."""
+
+    def __init__(
+        self,
+        pipelines: list[str],
+        resources: Resources | None = None,
+        workers: int = 1,
+        max_queue: int = 16,
+        timeout: float | None = None,
+    ):
+        self.pipelines = list(pipelines)
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        # the pool starts every worker, and so loads every pipeline, up front
+        self.pool = multiprocessing.Pool(
+            workers, initializer=init_worker, initargs=(self.pipelines, resources or {})
+        )
+        self.slots = threading.BoundedSemaphore(workers + max_queue)
+        self.lock = threading.Lock()
+        self.pending = 0
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __release(self, _=None):
+        with self.lock:
+            self.pending -= 1
+        self.slots.release()
+
+    def complexity(self, pipeline: str | None, text: str) -> dict[str, Any]:
+        """The results for this text, with how long it waited and was worked on"""
+        start = time.perf_counter()
+        if pipeline is None and len(self.pipelines) == 1:
+            pipeline = self.pipelines[0]
+        if pipeline not in self.pipelines:
+            raise RequestError(
+                HTTPStatus.BAD_REQUEST,
+                f"pipeline should be one of {', '.join(self.pipelines)}",
+            )
+        if not self.slots.acquire(blocking=False):
+            raise RequestError(HTTPStatus.SERVICE_UNAVAILABLE, "too many requests")
+        with self.lock:
+            self.pending += 1
+        # the slot is given back when the worker finishes, even if we give up waiting
+        result = self.pool.apply_async(
+            worker_complexity,
+            (pipeline, text),
+            callback=self.__release,
+            error_callback=self.__release,
+        )
+        try:
+            results, processing = result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            raise RequestError(HTTPStatus.GATEWAY_TIMEOUT, "timed out")
+        total = time.perf_counter() - start
+        return {
+            "pipeline": pipeline,
+            "results": results,
+            "timing": {
+                "total_ms": round(total * 1000, 1),
+                "processing_ms": round(processing * 1000, 1),
+                "queued_ms": round((total - processing) * 1000, 1),
+            },
+        }
+
+    def health(self) -> dict[str, Any]:
+        return {
+            "pipelines": self.pipelines,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": self.pending,
+        }
+
+
+class ComplexityRequestHandler(BaseHTTPRequestHandler):
+    server: ComplexityServer
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+            return
+        self.send_json(HTTPStatus.OK, self.server.service.health())
+
+    def do_POST(self):
+        try:
+            if self.path != "/complexity":
+                raise RequestError(HTTPStatus.NOT_FOUND, "not found")
+            request = self.read_request()
+            response = self.server.service.complexity(
+                request.get("pipeline"), request["text"]
+            )
+        except RequestError as e:
+            self.send_json(e.status, {"error": str(e)})
+            return
+        except Exception as e:  # noqa: BLE001 - whatever it is, the client gets a 500
+            self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": repr(e)})
+            return
+        self.send_json(HTTPStatus.OK, response)
+
+    def read_request(self) -> dict[str, Any]:
+        length = int(self.headers.get("Content-Length", 0))
+        if length > self.server.max_request_bytes:
+            raise RequestError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "text too long")
+        try:
+            request = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise RequestError(HTTPStatus.BAD_REQUEST, "body should be JSON")
+        if not isinstance(request, dict) or not isinstance(request.get("text"), str):
+            raise RequestError(HTTPStatus.BAD_REQUEST, 'body should have a "text"')
+        return request
+
+    def send_json(self, status: HTTPStatus, body: dict[str, Any]):
+        encoded = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(encoded)))
+        if status == HTTPStatus.SERVICE_UNAVAILABLE:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ComplexityServer(ThreadingHTTPServer):
+    """An HTTP server for a ComplexityService. Each connection gets a thread,
+    which waits for a worker process to do the actual work"""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        service: ComplexityService,
+        max_request_bytes: int = 10 * 1024 * 1024,
+        verbose: bool = False,
+    ):
+        super().__init__(address, ComplexityRequestHandler)
+        self.service = service
+        self.max_request_bytes = max_request_bytes
+        self.verbose = verbose
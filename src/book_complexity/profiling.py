@@ -0,0 +1,12 @@
+"""line_profiler takes a while to import, so only bring it in when someone is profiling"""
+
+import os
+import sys
+
+if os.environ.get("LINE_PROFILE") or "line_profiler" in sys.modules:
+    # LINE_PROFILE=1 to profile, and kernprof imports line_profiler before running us
+    from line_profiler import profile
+else:
+
+    def profile(func):  # type: ignore
+        return func
@@ -0,0 +1,124 @@
+"""Keep the parsed forms of the vocabulary and frequency CSVs between runs,
+so that each run doesn't have to parse hundreds of thousands of rows again"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import pickle
+from pathlib import Path
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+cache_version = 1
+
+
+def default_cache_folder() -> Path:
+    if "BOOK_COMPLEXITY_CACHE" in os.environ:
+        return Path(os.environ["BOOK_COMPLEXITY_CACHE"])
+    cache_home = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+    return Path(cache_home, "book_complexity")
+
+
+def file_sha256(filename) -> str:
+    digest = hashlib.sha256()
+    with open(filename, mode="rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_path(source) -> Path | None:
+    """The file behind a path or an open file, if there is one (stdin has none)"""
+    name = source
+    if not isinstance(source, (str, os.PathLike)):
+        name = getattr(source, "name", None)
+    if isinstance(name, (str, os.PathLike)) and Path(name).is_file():
+        return Path(name).resolve()
+    return None
+
+
+class ResourceCache:
+    """A folder of pickled resources, each made from a source file.
+    Each entry records the size, modification time and hash of the source it was
+    made from. If the size and time still match, the entry is used straight away.
+    If not, the source is hashed, and the entry is only made again if the hash
+    has changed too.
+    An entry is a pickled header followed by the pickled resource, so the header
+    can be checked without loading the resource."""
+
+    def __init__(self, folder=None):
+        self.folder = Path(folder) if folder is not None else default_cache_folder()
+
+    def entry_path(self, kind: str, source: Path) -> Path:
+        key = hashlib.sha256(f"{kind}\0{source}".encode()).hexdigest()[:32]
+        return self.folder / f"{kind}-{key}.pickle"
+
+    def get(self, kind: str, source, make: Callable[[], T]) -> T:
+        """The resource of this kind made from source, by make() if it isn't cached.
+        Sources that aren't files, like stdin, are never cached"""
+        path = source_path(source)
+        if path is None:
+            return make()
+
+        entry = self.entry_path(kind, path)
+        stat = path.stat()
+        stamp = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        sha256 = None
+        value: T | None = None
+        if entry.exists():
+            with open(entry, mode="rb") as file:
+                header = read_header(file)
+                if header is not None:
+                    if all(header.get(key) == value for key, value in stamp.items()):
+                        value = read_value(file)
+                        if value is not None:
+                            return value
+                    else:
+                        sha256 = file_sha256(path)
+                        if header.get("sha256") == sha256:
+                            # the file has been touched but not changed
+                            value = read_value(file)
+
+        if value is None:
+            value = make()
+        self.__write(entry, make_header(stamp, sha256 or file_sha256(path)), value)
+        return value
+
+    def __write(self, entry: Path, header: dict[str, Any], value):
+        """Write via a temporary file, so another run never sees half an entry"""
+        self.folder.mkdir(exist_ok=True, parents=True)
+        tmp = entry.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, mode="wb") as file:
+            pickle.dump(header, file, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, entry)
+
+
+def make_header(stamp: dict[str, int], sha256: str) -> dict[str, Any]:
+    return {"version": cache_version, **stamp, "sha256": sha256}
+
+
+# What loading a damaged entry, or one pickled from classes that have since changed,
+# can raise
+unusable_entry_errors = (EOFError, pickle.UnpicklingError, AttributeError, ImportError)
+
+
+def read_header(file) -> dict[str, Any] | None:
+    """The header of a cache entry, or None if it isn't one we can use"""
+    try:
+        header = pickle.load(file)
+    except unusable_entry_errors:
+        return None
+    if not isinstance(header, dict) or header.get("version") != cache_version:
+        return None
+    return header
+
+
+def read_value(file) -> Any | None:
+    """The resource that follows the header, or None if it can't be loaded"""
+    try:
+        return pickle.load(file)
+    except unusable_entry_errors:
+        return None
@@ -1,18 +1,117 @@
+from __future__ import annotations
+
+import sys
 from dataclasses import dataclass
+from typing import Any
 
 
-@dataclass
 class Card:
-    """Representing a chunk of text from a book"""
+    """Representing a chunk of text from a book.
+    There are millions of these, so they are kept small: no __dict__,
+    one shared copy of each title and author, and text that can be a slice of the
+    whole book's text (see from_book) rather than a string of its own"""
+
+    __slots__ = (
+        "__buffer",
+        "__length",
+        "__offset",
+        "author",
+        "end",
+        "start",
+        "title",
+        "translation",
+    )
+
+    def __init__(
+        self,
+        title: str,
+        author: str,
+        start: int,
+        end: int,
+        text: str,
+        translation: str = "",
+    ):
+        self.title = sys.intern(title)
+        self.author = sys.intern(author)
+        self.start = start
+        self.end = end
+        self.translation = translation
+        self.text = text
+
+    @classmethod
+    def from_book(
+        cls,
+        title: str,
+        author: str,
+        start: int,
+        end: int,
+        book_text: str,
+        offset: int,
+        length: int,
+        translation: str = "",
+    ) -> Card:
+        """A card whose text is book_text[offset : offset + length],
+        without copying it out of book_text until someone asks for it"""
+        card = cls(title, author, start, end, book_text, translation)
+        card.__offset = offset
+        card.__length = length
+        return card
+
+    @property
+    def text(self) -> str:
+        if self.__length is None:
+            return self.__buffer
+        return self.__buffer[self.__offset : self.__offset + self.__length]
+
+    @text.setter
+    def text(self, text: str):
+        self.__buffer = text
+        self.__offset = 0
+        self.__length: int | None = None
+
+    def replace(self, **changes) -> Card:
+        """A copy of this card with some fields changed, like dataclasses.replace.
+        If the text isn't changed, the copy shares the text of this card"""
+        card = Card.__new__(Card)
+        card.title = sys.intern(changes.pop("title", self.title))
+        card.author = sys.intern(changes.pop("author", self.author))
+        card.start = changes.pop("start", self.start)
+        card.end = changes.pop("end", self.end)
+        card.translation = changes.pop("translation", self.translation)
+        card.__buffer = self.__buffer
+        card.__offset = self.__offset
+        card.__length = self.__length
+        if "text" in changes:
+            card.text = changes.pop("text")
+        if changes:
+            raise TypeError(f"Card has no fields {', '.join(changes)}")
+        return card
+
+    def to_dict(self) -> dict[str, Any]:
+        """The fields of this card, as Card(**card.to_dict()) expects them.
+        Pass Card.to_dict as orjson's default to serialise cards"""
+        return {
+            "title": self.title,
+            "author": self.author,
+            "start": self.start,
+            "end": self.end,
+            "text": self.text,
+            "translation": self.translation,
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, Card):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={value!r}" for name, value in self.to_dict().items())
+        return f"Card({fields})"
 
-    title: str
-    author: str
-    start: int
-    end: int
-    text: str
-    translation: str = ""
 
 @dataclass
 class Translation:
     card: Card
-    translation: str
\ No newline at end of file
+    translation: str
@@ -1,6 +1,7 @@
 # ruff: noqa: F401
 from .translate_cards import ReverseTextTranslator, translate_cards
+from .translation_memory import TranslationMemory
 from book_to_flashcards.cards_jsonl import cards_to_jsonl, cards_from_jsonl
 from book_to_flashcards.Card import Card
-from book_to_flashcards.cards_to_anki import cards_to_anki
+from book_to_flashcards.cards_to_anki import cards_to_anki, ModelCache, make_model
 from book_to_flashcards.cards_untranslated_from_text import cards_untranslated_from_file, cards_untranslated_from_folder
@@ -0,0 +1,193 @@
+"""Write Anki packages a note at a time, so that memory use doesn't grow
+with the size of the library"""
+
+from __future__ import annotations
+
+import html
+import itertools
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+import genanki  # type: ignore
+from genanki.apkg_col import APKG_COL  # type: ignore
+from genanki.apkg_schema import APKG_SCHEMA  # type: ignore
+
+
+class AnkiPackageWriter:
+    """A replacement for genanki.Package that doesn't need every deck and note in memory.
+    The collection database is created up front, and notes are inserted as they
+    are added, committed every batch_size notes. The decks and models are recorded
+    and the database is zipped up into the .apkg file when the writer is closed."""
+
+    def __init__(
+        self, ankifile, batch_size: int = 1000, timestamp: float | None = None
+    ):
+        self.ankifile = ankifile
+        self.batch_size = batch_size
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.id_gen = itertools.count(int(self.timestamp * 1000))
+
+        dbfile, self.dbfilename = tempfile.mkstemp(suffix=".anki2")
+        os.close(dbfile)
+        self.connection = sqlite3.connect(self.dbfilename)
+        self.cursor = self.connection.cursor()
+        self.cursor.executescript(APKG_SCHEMA)
+        self.cursor.executescript(APKG_COL)
+
+        self.decks: dict[str, dict] = {}
+        # model id -> (model, id of a deck it is used in)
+        self.models: dict[int, tuple[genanki.Model, int]] = {}
+        self.uncommitted = 0
+        self.notes = 0
+        # roughly how big the package will be before compression
+        self.bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def add_deck(self, deck: genanki.Deck):
+        """Decks are small, so we keep them until the end. Their notes go through add_note"""
+        self.decks[str(deck.deck_id)] = deck.to_json()
+
+    def add_note(self, note: genanki.Note, deck: genanki.Deck):
+        self.models[note.model.model_id] = (note.model, deck.deck_id)
+        note.write_to_db(self.cursor, self.timestamp, deck.deck_id, self.id_gen)
+        self.notes += 1
+        self.bytes += sum(len(field.encode("utf-8")) for field in note.fields)
+        self.uncommitted += 1
+        if self.uncommitted >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        """Finish the collection database and write the .apkg file"""
+        (decks_json,) = self.cursor.execute("SELECT decks FROM col").fetchone()
+        decks = json.loads(decks_json)
+        decks.update(self.decks)
+        (models_json,) = self.cursor.execute("SELECT models FROM col").fetchone()
+        models = json.loads(models_json)
+        models.update(
+            {
+                model_id: model.to_json(self.timestamp, deck_id)
+                for model_id, (model, deck_id) in self.models.items()
+            }
+        )
+        self.cursor.execute(
+            "UPDATE col SET decks = ?, models = ?",
+            (json.dumps(decks), json.dumps(models)),
+        )
+        self.commit()
+        self.connection.close()
+
+        with zipfile.ZipFile(self.ankifile, "w") as outzip:
+            outzip.write(self.dbfilename, "collection.anki2")
+            outzip.writestr("media", json.dumps({}))
+        os.remove(self.dbfilename)
+
+    def discard(self):
+        """Give up without writing the .apkg file"""
+        self.connection.close()
+        os.remove(self.dbfilename)
+
+
+class ShardedPackageWriter:
+    """Write a library to several .apkg files, starting a new one at the first
+    book boundary after a package reaches max_notes notes or max_bytes bytes.
+    A book is never split between packages, so a package can go over the limit
+    by up to one book.
+    Each package is written as soon as it is full, along with an index of the
+    books in each package, so a crash only loses the package being written."""
+
+    def __init__(
+        self,
+        ankifile,
+        max_notes: int | None = None,
+        max_bytes: int | None = None,
+        batch_size: int = 1000,
+    ):
+        self.ankifile = Path(ankifile)
+        self.max_notes = max_notes
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.index: list[dict] = []
+        self.package: AnkiPackageWriter | None = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def shard_path(self, number: int) -> Path:
+        return self.ankifile.with_name(
+            f"{self.ankifile.stem}.{number:03}{self.ankifile.suffix}"
+        )
+
+    def index_path(self) -> Path:
+        return self.ankifile.with_name(f"{self.ankifile.stem}.index.json")
+
+    def __full(self) -> bool:
+        assert self.package
+        if self.max_notes is not None and self.package.notes >= self.max_notes:
+            return True
+        return self.max_bytes is not None and self.package.bytes >= self.max_bytes
+
+    def add_deck(self, deck: genanki.Deck):
+        """Each deck is a book, so this is where we can start a new package"""
+        if self.package and self.__full():
+            self.__close_package()
+        if self.package is None:
+            path = self.shard_path(len(self.index) + 1)
+            self.package = AnkiPackageWriter(path, batch_size=self.batch_size)
+            self.index.append({"file": path.name, "books": [], "notes": 0})
+        self.package.add_deck(deck)
+        self.index[-1]["books"].append(html.unescape(deck.name))
+
+    def add_note(self, note: genanki.Note, deck: genanki.Deck):
+        assert self.package
+        self.package.add_note(note, deck)
+
+    def __close_package(self):
+        assert self.package
+        self.package.close()
+        self.index[-1]["notes"] = self.package.notes
+        self.package = None
+        self.__save_index()
+
+    def __save_index(self):
+        """Write the index via a temporary file, so we never leave half an index behind"""
+        path = self.index_path()
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp, mode="w", encoding="utf-8") as file:
+            json.dump(self.index, file, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+
+    def close(self):
+        if self.package:
+            self.__close_package()
+
+    def discard(self):
+        """Throw away the package being written. The packages already written are kept,
+        and the index only lists those."""
+        if self.package:
+            self.package.discard()
+            self.package = None
+            self.index.pop()
+            self.__save_index()
@@ -0,0 +1,198 @@
+"""A binary archive of cards, stored a column at a time, which is much quicker
+to load than jsonl because nothing has to be parsed.
+
+The archive is a file header followed by blocks of up to block_size cards.
+Each block has a JSON header holding the block's authors and titles, then
+the columns, each 8 byte aligned:
+    author and title: int32 indices into the header's lists
+    start and end: int64
+    text and translation offsets: int64, count + 1 of each, in characters
+    text and translation: all the block's text, UTF-8 encoded
+Numbers are stored in the byte order of the machine that wrote the archive."""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Generator, Iterable
+from pathlib import Path
+from typing import Any
+
+from book_to_flashcards.Card import Card
+
+archive_magic = b"CARDARC1"
+length_field = struct.Struct("<Q")
+
+
+def padding(length: int) -> bytes:
+    return b"\0" * (-length % 8)
+
+
+def write_json(file, value):
+    """A length, the JSON, and padding to keep what follows 8 byte aligned"""
+    encoded = json.dumps(value, ensure_ascii=False).encode("utf-8")
+    encoded += b" " * (-len(encoded) % 8)
+    file.write(length_field.pack(len(encoded)))
+    file.write(encoded)
+
+
+def checked_end(archive, end: int, inputfile) -> int:
+    """end, if the archive is long enough to have something ending there.
+    Slicing past the end of the archive would quietly give fewer bytes"""
+    if end > len(archive):
+        raise ValueError(f"{inputfile} is truncated")
+    return end
+
+
+def read_json(archive, offset: int, inputfile) -> tuple[Any, int]:
+    """The JSON at offset, and the offset of whatever follows it"""
+    checked_end(archive, offset + length_field.size, inputfile)
+    (length,) = length_field.unpack_from(archive, offset)
+    offset += length_field.size
+    end = checked_end(archive, offset + length, inputfile)
+    return json.loads(bytes(archive[offset:end])), end
+
+
+def write_block(file, cards: list[Card]):
+    authors: dict[str, int] = {}
+    titles: dict[str, int] = {}
+    author_ids, title_ids = array("i"), array("i")
+    starts, ends = array("q"), array("q")
+    text_offsets, translation_offsets = array("q", [0]), array("q", [0])
+    texts, translations = [], []
+    for card in cards:
+        author_ids.append(authors.setdefault(card.author, len(authors)))
+        title_ids.append(titles.setdefault(card.title, len(titles)))
+        starts.append(card.start)
+        ends.append(card.end)
+        text = card.text
+        texts.append(text)
+        text_offsets.append(text_offsets[-1] + len(text))
+        translations.append(card.translation)
+        translation_offsets.append(translation_offsets[-1] + len(card.translation))
+    text_blob = "".join(texts).encode("utf-8")
+    translation_blob = "".join(translations).encode("utf-8")
+
+    write_json(
+        file,
+        {
+            "count": len(cards),
+            "authors": list(authors),
+            "titles": list(titles),
+            "text_bytes": len(text_blob),
+            "translation_bytes": len(translation_blob),
+        },
+    )
+    # the two int32 columns together keep the int64 columns 8 byte aligned
+    columns = [author_ids, title_ids, starts, ends, text_offsets, translation_offsets]
+    for column in columns:
+        column.tofile(file)
+    for blob in (text_blob, translation_blob):
+        file.write(blob)
+        file.write(padding(len(blob)))
+
+
+def cards_to_archive(
+    iterator: Iterable[Card], outputfile, block_size: int = 10000, progress=None
+):
+    """Write the cards to outputfile a block at a time, via a temporary file,
+    so a reader never sees half an archive. progress is called after each book"""
+    outputfile = Path(outputfile)
+    tmpfile = outputfile.with_suffix(outputfile.suffix + ".tmp")
+    book = None
+    with open(tmpfile, mode="wb") as file:
+        file.write(archive_magic)
+        write_json(file, {"byteorder": sys.byteorder})
+        block: list[Card] = []
+        for card in iterator:
+            if progress and book is not None and (card.author, card.title) != book:
+                progress()
+            book = (card.author, card.title)
+            block.append(card)
+            if len(block) >= block_size:
+                write_block(file, block)
+                block = []
+        if block:
+            write_block(file, block)
+    os.replace(tmpfile, outputfile)
+    if progress:
+        progress()
+
+
+def read_column(view: memoryview, offset: int, typecode: str, count: int, inputfile):
+    """count numbers from the archive without copying them, and where they end"""
+    size = struct.calcsize(typecode) * count
+    end = checked_end(view, offset + size + len(padding(size)), inputfile)
+    column = view[offset : offset + size].cast(typecode)  # type: ignore[call-overload]
+    return column, end
+
+
+def cards_from_archive(inputfile) -> Generator[Card, Any, Any]:
+    """The cards in an archive, in the order they were written.
+    The archive is read through mmap, and nothing is parsed: each block's numbers
+    are read straight out of the file, and its text is decoded once, with every
+    card's text being a slice of it (see Card.from_book)"""
+    with open(inputfile, mode="rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise ValueError(f"{inputfile} is empty, not a card archive")
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as archive:
+            if archive[: len(archive_magic)] != archive_magic:
+                raise ValueError(f"{inputfile} is not a card archive")
+            header, offset = read_json(archive, len(archive_magic), inputfile)
+            if header["byteorder"] != sys.byteorder:
+                raise ValueError(
+                    f"{inputfile} was written on a {header['byteorder']} endian "
+                    "machine, and can't be read on this one"
+                )
+            view = memoryview(archive)
+            try:
+                while offset < len(archive):
+                    offset = yield from cards_from_block(view, offset, inputfile)
+            finally:
+                view.release()
+
+
+def cards_from_block(
+    view: memoryview, offset: int, inputfile
+) -> Generator[Card, Any, int]:
+    """The cards in the block at offset. Returns where the next block starts"""
+    header, offset = read_json(view, offset, inputfile)
+    count = header["count"]
+    authors = [sys.intern(author) for author in header["authors"]]
+    titles = [sys.intern(title) for title in header["titles"]]
+    # Every number is going to be a python int in a Card, so turning each column
+    # into a list in one go is quicker than going through the memoryview card by card
+    ids, offset = read_column(view, offset, "i", 2 * count, inputfile)
+    author_ids, title_ids = ids[:count].tolist(), ids[count:].tolist()
+    ids.release()
+    columns = []
+    for length in [count, count, count + 1, count + 1]:
+        column, offset = read_column(view, offset, "q", length, inputfile)
+        columns.append(column.tolist())
+        column.release()
+    starts, ends, text_offsets, translation_offsets = columns
+
+    blobs = []
+    for length in [header["text_bytes"], header["translation_bytes"]]:
+        end = checked_end(view, offset + length + len(padding(length)), inputfile)
+        blobs.append(str(view[offset : offset + length], "utf-8"))
+        offset = end
+    text, translation = blobs
+
+    for i, (author_id, title_id, start, end) in enumerate(
+        zip(author_ids, title_ids, starts, ends)
+    ):
+        text_offset = text_offsets[i]
+        yield Card.from_book(
+            titles[title_id],
+            authors[author_id],
+            start,
+            end,
+            text,
+            text_offset,
+            text_offsets[i + 1] - text_offset,
+            translation[translation_offsets[i] : translation_offsets[i + 1]],
+        )
+    return offset
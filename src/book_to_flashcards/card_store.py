@@ -0,0 +1,224 @@
+"""Random access to the cards in a jsonl file, through a sidecar index of where
+each book's cards are in the file, so that one book, or part of one,
+can be read without parsing the rest of the file"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Generator
+from pathlib import Path
+from typing import Any
+
+import orjson
+
+from book_to_flashcards.Card import Card
+from book_to_flashcards.cards_jsonl import book_jsonl_path
+
+Book = tuple[str, str]  # (author, title)
+
+index_magic = b"CARDIDX1"
+index_header = struct.Struct("<8sQ")
+
+
+class BookNotFoundError(ValueError):
+    pass
+
+
+def index_path(jsonlfile) -> Path:
+    return Path(str(jsonlfile) + ".idx")
+
+
+def source_stamp(jsonlfile) -> dict[str, int]:
+    """Enough to tell if the jsonl file has changed since it was indexed"""
+    stat = os.stat(jsonlfile)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def read_index_header(index) -> tuple[bytes, dict, int]:
+    """The magic number, the header and where the columns start in a mapped index"""
+    magic, header_length = index_header.unpack_from(index)
+    columns_start = index_header.size + header_length
+    return magic, json.loads(bytes(index[index_header.size : columns_start])), columns_start
+
+
+def build_card_index(jsonlfile) -> Path:
+    """Read every card in jsonlfile once, and write an index of them next to it.
+    The index has a JSON header listing the books, then three columns of native
+    64 bit integers: the start of each card in its book, and the byte offset and
+    length of its line in the file. Each book's cards are together, ordered by start.
+    """
+    stamp = source_stamp(jsonlfile)
+    cards: dict[Book, list[tuple[int, int, int]]] = {}
+    offset = 0
+    with open(jsonlfile, mode="rb") as file:
+        for line in file:
+            if line.strip():
+                card = orjson.loads(line)
+                book = (card["author"], card["title"])
+                cards.setdefault(book, []).append((card["start"], offset, len(line)))
+            offset += len(line)
+
+    books = []
+    starts, offsets, lengths = array("q"), array("q"), array("q")
+    for (author, title), book_cards in cards.items():
+        book_cards.sort(key=lambda card: card[0])
+        books.append([author, title, len(starts), len(book_cards)])
+        for start, card_offset, length in book_cards:
+            starts.append(start)
+            offsets.append(card_offset)
+            lengths.append(length)
+
+    header = json.dumps({**stamp, "books": books}, ensure_ascii=False).encode("utf-8")
+    header += b" " * (-len(header) % 8)  # keep the columns 8 byte aligned
+
+    path = index_path(jsonlfile)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, mode="wb") as file:
+        file.write(index_header.pack(index_magic, len(header)))
+        file.write(header)
+        for column in (starts, offsets, lengths):
+            column.tofile(file)
+    os.replace(tmp, path)
+    return path
+
+
+class CardStore:
+    """A jsonl file of cards, with its index, both read through mmap.
+    Finding a book is a dictionary lookup, and finding a character position
+    within a book is a binary search, so only the cards asked for are parsed.
+    The index is (re)built if it is missing or older than the jsonl file."""
+
+    def __init__(self, jsonlfile):
+        self.jsonlfile = Path(jsonlfile)
+        self.books: dict[Book, tuple[int, int]] = {}
+        self.__files: list = []
+        self.__maps: list[mmap.mmap] = []
+        self.__views: list[memoryview] = []
+
+        index = self.__open_index()
+        self.jsonl = self.__map(self.jsonlfile)
+
+        _, header, columns_start = read_index_header(index)
+        for author, title, first, count in header["books"]:
+            self.books[(author, title)] = (first, count)
+        num_cards = sum(count for _, count in self.books.values())
+        view = memoryview(index)
+        columns = view[columns_start:].cast("q")
+        self.starts = columns[:num_cards]
+        self.offsets = columns[num_cards : 2 * num_cards]
+        self.lengths = columns[2 * num_cards : 3 * num_cards]
+        self.__views = [view, columns, self.starts, self.offsets, self.lengths]
+
+    def __open_index(self):
+        path = index_path(self.jsonlfile)
+        if path.exists():
+            index = self.__map(path)
+            magic, header, _ = read_index_header(index)
+            if magic == index_magic and all(
+                header.get(key) == value
+                for key, value in source_stamp(self.jsonlfile).items()
+            ):
+                return index
+            self.close()
+        return self.__map(build_card_index(self.jsonlfile))
+
+    def __map(self, path):
+        file = open(path, mode="rb")  # noqa: SIM115 - closed by close()
+        self.__files.append(file)
+        if os.fstat(file.fileno()).st_size == 0:
+            return b""  # can't mmap an empty file
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__maps.append(mapped)
+        return mapped
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        # the memoryviews into the index have to go before its mmap can be closed
+        for view in reversed(self.__views):
+            view.release()
+        for mapped in self.__maps:
+            mapped.close()
+        for file in self.__files:
+            file.close()
+        self.__views = []
+        self.__maps = []
+        self.__files = []
+
+    def __card(self, i: int) -> Card:
+        offset = self.offsets[i]
+        return Card(**orjson.loads(self.jsonl[offset : offset + self.lengths[i]]))
+
+    def __book_range(self, book: Book) -> tuple[int, int]:
+        first, count = self.books.get(book, (0, 0))
+        return first, first + count
+
+    def card_at(self, book: Book, position: int) -> Card | None:
+        """The card of this book that the character at position is in"""
+        first, last = self.__book_range(book)
+        i = bisect_right(self.starts, position, first, last) - 1
+        if i < first:
+            return None
+        card = self.__card(i)
+        return card if position < card.end else None
+
+    def cards(
+        self, book: Book, start: int | None = None, end: int | None = None
+    ) -> Generator[Card, Any, Any]:
+        """The cards of this book, in order, or just those starting in [start, end)"""
+        first, last = self.__book_range(book)
+        if start is not None:
+            first = bisect_left(self.starts, start, first, last)
+        if end is not None:
+            last = bisect_left(self.starts, end, first, last)
+        for i in range(first, last):
+            yield self.__card(i)
+
+    def find_books(self, name: str) -> list[Book]:
+        """Books called "author/title", or just "title" from any author"""
+        if "/" in name:
+            author, title = name.rsplit("/", 1)
+            return [(author, title)] if (author, title) in self.books else []
+        return [book for book in self.books if book[1] == name]
+
+
+def cards_from_store(
+    inputfileorfolder,
+    book: str | None = None,
+    start: int | None = None,
+    end: int | None = None,
+) -> Generator[Card, Any, Any]:
+    """The cards of the named book (see CardStore.find_books), or of every book,
+    starting in [start, end), from a jsonl file or a folder of them.
+    Raises BookNotFoundError if there is no book with that name"""
+    path = Path(inputfileorfolder)
+    if path.is_file():
+        jsonlfiles = [path]
+    elif book is not None and "/" in book:
+        # where cards_to_jsonl_folder would have put it. File names can't be trusted
+        # to be the title, e.g. "Vol. 1" is written to "Vol.jsonl"
+        jsonlfiles = [book_jsonl_path(path, *book.rsplit("/", 1))]
+        jsonlfiles = [file for file in jsonlfiles if file.is_file()]
+    else:
+        jsonlfiles = sorted(path.glob("**/*.jsonl"))
+
+    found_any = False
+    for jsonlfile in jsonlfiles:
+        with CardStore(jsonlfile) as store:
+            books = store.find_books(book) if book is not None else list(store.books)
+            found_any = found_any or bool(books)
+            for found in books:
+                yield from store.cards(found, start, end)
+    if book is not None and not found_any:
+        raise BookNotFoundError(
+            f"there is no book called {book} in {inputfileorfolder}"
+        )
@@ -1,79 +1,141 @@
+from __future__ import annotations
+
+import os
+from collections import deque
 from collections.abc import Generator
+from concurrent.futures import Future, ThreadPoolExecutor
 from glob import glob
-import os
-from typing import Any
 from pathlib import Path
+from typing import Any
+
+import orjson
 import orjsonl as jsonl
 
-from book_to_flashcards import Card
+from book_to_flashcards.Card import Card
+from book_to_flashcards.manifest import Manifest
+
+write_buffer_size = 1024 * 1024
 
 def cards_to_jsonl_file(
     iterator: Generator[Card, Any, Any], outputfile: str, progress=None
 ):
-    jsonl.save(outputfile, iterator)
+    jsonl.save(outputfile, iterator, default=Card.to_dict)
     if progress:
         progress()
 
 
+def book_jsonl_path(outputfolder, author: str, title: str) -> Path:
+    """Where cards_to_jsonl_folder puts the cards for one book"""
+    return Path(outputfolder, author, title).with_suffix(".jsonl")
+
+
 def cards_to_jsonl_folder(
-    iterator: Generator[Card, Any, Any], outputfolder, separator:str = "", progress=None
+    iterator: Generator[Card, Any, Any],
+    outputfolder,
+    separator: str = "",
+    progress=None,
+    manifest: Manifest | None = None,
 ):
-    cardTitle = None
-    cardAuthor = None
+    """Write each book's cards to its own jsonl file in outputfolder.
+    Each book goes through a single buffered file handle into a .tmp file,
+    which replaces the real file once the book is finished,
+    so a reader never sees half a book.
+    If the manifest of outputfolder is given, each book is recorded in it once
+    it's in place, and the manifest is saved when writing stops"""
+    if manifest is not None and not manifest.is_for(outputfolder):
+        raise ValueError(f"{manifest.path} is not the manifest of {outputfolder}")
+    book: tuple[str, str] = ("", "")
     file = None
-    outputfile: Path = Path()
+    tmpfile: Path = Path()
     try:
         for card in iterator:
-            if file is None or card.title != cardTitle or card.author != cardAuthor:
+            if file is None or (card.author, card.title) != book:
                 # We're in a different book and need to switch to a new file
                 if file:
                     if progress:
                         progress()
                     file.close()
-                    if outputfile.suffixes[-1] == ".tmp":
-                        os.replace(outputfile, Path(outputfile.parent, outputfile.stem))
-                outputfile = Path(outputfolder, card.author, card.title).with_suffix(".jsonl")
-                if Path.exists(outputfile):
-                    outputfile = outputfile.with_suffix(outputfile.suffix + ".tmp")
-                outputfile.parent.mkdir(exist_ok=True, parents=True)
-                file = open(outputfile, mode="wb")
-                cardTitle = card.title
-                cardAuthor = card.author
-
-            jsonl.append(outputfile, card)
+                    os.replace(tmpfile, tmpfile.with_suffix(""))
+                    if manifest is not None:
+                        manifest.written(*book)
+                if manifest is not None:
+                    manifest.check_expected(card.author, card.title)
+                outputfile = book_jsonl_path(outputfolder, card.author, card.title)
+                tmpfile = outputfile.with_suffix(outputfile.suffix + ".tmp")
+                tmpfile.parent.mkdir(exist_ok=True, parents=True)
+                file = open(tmpfile, mode="wb", buffering=write_buffer_size)
+                book = (card.author, card.title)
+
+            file.write(
+                orjson.dumps(
+                    card, default=Card.to_dict, option=orjson.OPT_APPEND_NEWLINE
+                )
+            )
         if file:
             file.close()
-            if outputfile.suffixes[-1] == ".tmp":
-                os.replace(outputfile, Path(outputfile.parent, outputfile.stem))
+            os.replace(tmpfile, tmpfile.with_suffix(""))
+            if manifest is not None:
+                manifest.written(*book)
     finally:
         if file:
             file.close()
+        if manifest is not None:
+            manifest.save()
     if progress:
         progress()
 
 
-def cards_to_jsonl(cards, outputfileorfolder, separator: str="", progress=None):
+def cards_to_jsonl(
+    cards, outputfileorfolder, separator: str = "", progress=None, manifest=None
+):
     path = Path(outputfileorfolder)
     if path.is_file():
+        if manifest is not None:
+            raise ValueError(f"{outputfileorfolder} is a file, not a jsonl folder")
         cards_to_jsonl_file(cards, outputfileorfolder, progress)
     else:
-        cards_to_jsonl_folder(cards, outputfileorfolder, separator, progress)
+        cards_to_jsonl_folder(cards, outputfileorfolder, separator, progress, manifest)
 
 
 def cards_from_jsonl_file(inputfile) -> Generator[Card, Any, Any]:
     for card in jsonl.stream(inputfile):
-        yield Card.Card(**card)  # type: ignore[arg-type]
+        yield Card(**card)  # type: ignore[arg-type]
+
 
+def read_jsonl_file(inputfile) -> list[Card]:
+    """All the cards in a file at once, for reading ahead in another thread"""
+    with open(inputfile, mode="rb") as file:
+        return [Card(**orjson.loads(line)) for line in file if line.strip()]
 
-def cards_from_jsonl_folder(inputfolder) -> Generator[Card, Any, Any]:
-    files = glob(str(Path(inputfolder) / "**/*.jsonl"), recursive=True)
-    for file in files:
-        yield from cards_from_jsonl_file(file)
+
+def cards_from_jsonl_folder(inputfolder, prefetch: int = 0) -> Generator[Card, Any, Any]:
+    """The cards in each jsonl file in the folder, a file at a time, in order of path.
+    With prefetch, up to that many files after the one being yielded are read
+    in a background thread, so reading overlaps with whatever is using the cards.
+    Each file is still yielded whole, in the same order."""
+    files = sorted(glob(str(Path(inputfolder) / "**/*.jsonl"), recursive=True))
+    if not prefetch:
+        for file in files:
+            yield from cards_from_jsonl_file(file)
+        return
+
+    # one thread, so the files are read in order and at most prefetch + 1 are in memory
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        pending: deque[Future] = deque()
+        for file in files:
+            pending.append(executor.submit(read_jsonl_file, file))
+            while len(pending) > prefetch:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
 
 
-def cards_from_jsonl(inputfileorfolder) -> Generator[Card, Any, Any]:
+def cards_from_jsonl(inputfileorfolder, prefetch: int = 0) -> Generator[Card, Any, Any]:
     path = Path(inputfileorfolder)
     if path.is_file():
         yield from cards_from_jsonl_file(inputfileorfolder)
     else:
-        yield from cards_from_jsonl_folder(inputfileorfolder)
+        yield from cards_from_jsonl_folder(inputfileorfolder, prefetch)
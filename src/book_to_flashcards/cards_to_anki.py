@@ -1,21 +1,31 @@
 """Turn text files containing human language into an Anki flashcard deck
 allowing the user to read the book in small chunks 
-and test their understanding of the translation"""
+and test their understanding of the translation.
+genanki and jinja2 are slow to import, so they are only imported when a package
+is made, and importing this module stays cheap"""
+
+from __future__ import annotations
 
-from collections.abc import Generator
-from dataclasses import dataclass
 import hashlib
 import html
-from typing import Any, Callable, Optional
+import sys
+from collections.abc import Generator
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable
 
 import click
-import genanki  # type: ignore
-import deepl
-import jinja2
 from importlib_resources import files
 
-from book_to_flashcards.Card import Card
 import book_to_flashcards.resources
+from book_to_flashcards.Card import Card
+
+if TYPE_CHECKING:
+    import genanki  # type: ignore
+
+    from book_to_flashcards.anki_package_writer import (
+        AnkiPackageWriter,
+        ShardedPackageWriter,
+    )
 
 
 @dataclass
@@ -32,57 +42,75 @@ class AnkiNote:
     translation: str
 
 
-class BookNote(genanki.Note):
-    """Anki will update notes on re-import based on a GUID.
-    Make sure the GUID we provide is a good stable representation
-    of the card. It should be invariant when the translation changes,
-    but it should change when we're looking at a different chunk of book.
-    e.g. if the book is reprocessed with a different chunk length."""
+class ModelCache:
+    """Make the Anki models that we use to represent these book cards.
+    The templates are read and compiled once, and there is one model per font size,
+    so a long-running process can make many packages without touching the resource files again.
+    """
 
-    @property
-    def guid(self):
-        # Hash the filename, the character index of the card text within the file, and the card text.
-        # It's possible for multiple cards from a file to have the same text
-        return genanki.guid_for(self.fields[0], self.fields[1], self.fields[3])
+    def __init__(self):
+        import jinja2
 
+        resources = files(book_to_flashcards.resources)
+        self.front_template = resources.joinpath("front_template.html").read_text()
+        self.back_template = resources.joinpath("back_template.html").read_text()
+        self.css_template = jinja2.Environment().from_string(
+            resources.joinpath("styling.css.jinja").read_text()
+        )
+        self.models: dict[int, genanki.Model] = {}
 
-def make_model(font_size: int) -> genanki.Model:
-    """Create the Anki model that we use to represent these book cards"""
+    def model(self, font_size: int) -> genanki.Model:
+        if font_size not in self.models:
+            self.models[font_size] = self.__make_model(font_size)
+        return self.models[font_size]
+
+    def clear(self):
+        self.models.clear()
+
+    def __make_model(self, font_size: int) -> genanki.Model:
+        import genanki  # type: ignore
+
+        # insert font size into CSS template to create actual CSS
+        css = self.css_template.render(font_size=font_size)
+
+        return genanki.Model(
+            1356306641,
+            "Book Snippet",
+            fields=[
+                {"name": "author"},
+                {"name": "title"},
+                {"name": "start"},
+                {"name": "end"},
+                {"name": "prev"},
+                {"name": "current"},
+                {"name": "next"},
+                {"name": "translation"},
+            ],
+            templates=[
+                {
+                    "name": "Card 1",
+                    "qfmt": self.front_template,
+                    "afmt": self.back_template,
+                },
+            ],
+            css=css,
+        )
 
-    # insert font size into CSS template to create actual CSS
-    environment = jinja2.Environment()
-    css_template_text = (
-        files(book_to_flashcards.resources).joinpath("styling.css.jinja").read_text()
-    )
-    css_template = environment.from_string(css_template_text)
-    css = css_template.render(font_size=font_size)
-
-    return genanki.Model(
-        1356306641,
-        "Book Snippet",
-        fields=[
-            {"name": "author"},
-            {"name": "title"},
-            {"name": "start"},
-            {"name": "end"},
-            {"name": "prev"},
-            {"name": "current"},
-            {"name": "next"},
-            {"name": "translation"},
-        ],
-        templates=[
-            {
-                "name": "Card 1",
-                "qfmt": files(book_to_flashcards.resources)
-                .joinpath("front_template.html")
-                .read_text(),
-                "afmt": files(book_to_flashcards.resources)
-                .joinpath("back_template.html")
-                .read_text(),
-            },
-        ],
-        css=css,
-    )
+
+__model_cache: ModelCache | None = None
+
+
+def model_cache() -> ModelCache:
+    """The ModelCache shared by everything in this process, made the first time it is asked for"""
+    global __model_cache
+    if __model_cache is None:
+        __model_cache = ModelCache()
+    return __model_cache
+
+
+def make_model(font_size: int) -> genanki.Model:
+    """Return the Anki model that we use to represent these book cards"""
+    return model_cache().model(font_size)
 
 
 def make_deckname(author, title, structure: bool):
@@ -95,8 +123,8 @@ def make_deckname(author, title, structure: bool):
 
 
 def add_prev_next(cards: Generator[Card, Any, Any]) -> Generator[AnkiNote, Any, Any]:
-    prev_card: Optional[Card] = None
-    current_card: Optional[Card] = None
+    prev_card: Card | None = None
+    current_card: Card | None = None
     for next_card in cards:
         if current_card:
             yield AnkiNote(
@@ -139,57 +167,95 @@ def cards_to_anki(
     ankifile: str,
     fontsize: int,
     on_file_complete: Callable[[], None] = do_nothing,
+    batch_size: int = 1000,
+    max_notes: int | None = None,
+    max_bytes: int | None = None,
 ):
     """Take a list of text files,
     and turn them all into a single Anki deck.
+    Notes are written to the package as they are made, batch_size at a time,
+    so the whole library never has to be in memory.
+    If max_notes or max_bytes is given, the library is split between several
+    numbered packages next to ankifile, with an index of the books in each.
     Supports use of dummy translator for testing"""
+    import genanki  # type: ignore
+
+    from book_to_flashcards.anki_package_writer import (
+        AnkiPackageWriter,
+        ShardedPackageWriter,
+    )
+
     model = make_model(fontsize)
 
-    decks: list[genanki.Deck] = []
-    deck = None
-    try:
-        for note in add_prev_next(cards):
-            # if we've hit a new filename after processing some cards, we need to close the deck
-            # and make a new one
-            deckname = make_deckname(note.author, note.title, structure)
-            if deck is None or deck.name != deckname:
-                if deck:
-                    decks.append(deck)
-                    on_file_complete()
-                deck = genanki.Deck(
-                    # a reasonably stable ID for this deck - hash the filename
-                    int(hashlib.sha1(deckname.encode("utf-8")).hexdigest(), 16)
-                    % (2**32),
-                    html.escape(deckname),
-                )
-
-            note = BookNote(
-                model=model,
-                fields=[
-                    html.escape(note.author),
-                    html.escape(note.title),
-                    str(note.start),
-                    str(note.end),
-                    html.escape(note.prev) if note.prev else "",  # type:ignore
-                    html.escape(note.current),
-                    html.escape(note.next) if note.next else "",  # type:ignore
-                    (
-                        html.escape(note.translation) if note.translation else ""
-                    ),  # type:ignore
-                ],
-            )
-            deck.add_note(note)
-        if deck:  # don't forget the last one
-            decks.append(deck)
-            on_file_complete()
-
-    except deepl.DeepLException as e:
-        # this takes a very long time, if it falls over we'd like to have some intermediate results!
-        # it can fall over because your DeepL key ran out.
-        genanki.Package(decks).write_to_file(ankifile)
-        click.echo("Problem with DeepL:")
-        click.echo(e)
-        if e.http_status_code == 413:
-            print("You may have reached the translation limits of your API key")
-
-    genanki.Package(decks).write_to_file(ankifile)
+    writer: AnkiPackageWriter | ShardedPackageWriter
+    if max_notes is None and max_bytes is None:
+        writer = AnkiPackageWriter(ankifile, batch_size=batch_size)
+    else:
+        writer = ShardedPackageWriter(
+            ankifile, max_notes=max_notes, max_bytes=max_bytes, batch_size=batch_size
+        )
+
+    with writer as package:
+        deck = None
+        deckname = None
+        try:
+            for note in add_prev_next(cards):
+                # if we've hit a new filename after processing some cards, we need to close the deck
+                # and make a new one
+                note_deckname = make_deckname(note.author, note.title, structure)
+                if deck is None or deckname != note_deckname:
+                    if deck:
+                        on_file_complete()
+                    deckname = note_deckname
+                    deck = genanki.Deck(
+                        # a reasonably stable ID for this deck - hash the filename
+                        int(hashlib.sha1(deckname.encode("utf-8")).hexdigest(), 16)
+                        % (2**32),
+                        html.escape(deckname),
+                    )
+                    package.add_deck(deck)
+
+                package.add_note(make_note(model, note), deck)
+            if deck:  # don't forget the last one
+                on_file_complete()
+
+        except Exception as e:
+            if not is_deepl_exception(e):
+                raise
+            # this takes a very long time, if it falls over we'd like to have some intermediate results!
+            # it can fall over because your DeepL key ran out.
+            click.echo("Problem with DeepL:")
+            click.echo(e)
+            if getattr(e, "http_status_code", None) == 413:
+                print("You may have reached the translation limits of your API key")
+
+
+def is_deepl_exception(e: Exception) -> bool:
+    """deepl is only imported by the translate command, and is slow to import,
+    so if it hasn't been imported it can't be what went wrong"""
+    deepl = sys.modules.get("deepl")
+    return deepl is not None and isinstance(e, deepl.DeepLException)
+
+
+def make_note(model: genanki.Model, note: AnkiNote) -> genanki.Note:
+    """Anki will update notes on re-import based on a GUID.
+    Make sure the GUID we provide is a good stable representation
+    of the card. It should be invariant when the translation changes,
+    but it should change when we're looking at a different chunk of book.
+    e.g. if the book is reprocessed with a different chunk length."""
+    import genanki  # type: ignore
+
+    fields = [
+        html.escape(note.author),
+        html.escape(note.title),
+        str(note.start),
+        str(note.end),
+        html.escape(note.prev) if note.prev else "",  # type:ignore
+        html.escape(note.current),
+        html.escape(note.next) if note.next else "",  # type:ignore
+        html.escape(note.translation) if note.translation else "",  # type:ignore
+    ]
+    # Hash the filename, the character index of the card text within the file, and the card text.
+    # It's possible for multiple cards from a file to have the same text
+    guid = genanki.guid_for(fields[0], fields[1], fields[3])
+    return genanki.Note(model=model, fields=fields, guid=guid)
@@ -1,23 +1,23 @@
+from __future__ import annotations
+
 import glob
+import io
+from collections import deque
+from collections.abc import Generator
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
+from typing import Any
+
 from book_to_flashcards.Card import Card
-from split_sentences import make_nlp, split_text
+from book_to_flashcards.cards_jsonl import book_jsonl_path, cards_from_jsonl_file
+from book_to_flashcards.manifest import Manifest, SourceRecord, file_sha256
 
-from collections.abc import Generator
-from typing import Any
 
 def trim_title(title:str, separator:str) -> str:
     return title if separator == "" else separator.join(title.split(separator)[:-1])
 
 def card_trim_title(card:Card, separator:str) -> Card:
-    return Card(
-        title = trim_title(card.title, separator),
-        author=card.author,
-        start = card.start,
-        end = card.end,
-        text = card.text,
-        translation = card.translation
-    )
+    return card.replace(title = trim_title(card.title, separator))
 
 # If the first card in a given book has the author name as the text, don't yield it
 def cards_skip_first_line_if_author(cards) -> Generator[Card, Any, Any]:
@@ -38,13 +38,9 @@ def cards_skip_first_line_if_author(cards) -> Generator[Card, Any, Any]:
             if len(lines) > 0:
                 if lines[0] == card.author: # we found the author on the first line, now to throw it away!
                     if len(lines) > 1:
-                        yield Card(
-                            title = card.title,
-                            author = card.author,
+                        yield card.replace(
                             start = card.start + len(card.author) + 1, # 1 for the newline
-                            end = card.end,
                             text = "\n".join(lines[1:]), # get rid of that first line
-                            translation = card.translation
                         )
                 else: # we didn't find it, just pass the card straight through
                     yield card
@@ -53,12 +49,14 @@ def cards_skip_first_line_if_author(cards) -> Generator[Card, Any, Any]:
         
 
 def cards_untranslated_from_folder(
-    inputfolder, pipeline, maxfieldlen
+    inputfolder, pipeline, maxfieldlen, workers: int = 1
 ) -> Generator[Card, Any, Any]:
-    for filename in glob.glob(inputfolder + "/**/*.txt", recursive=True):
-        yield from cards_untranslated_from_file(
-            inputfile=filename, pipeline=pipeline, maxfieldlen=maxfieldlen
-        )
+    yield from cards_untranslated_from_files(
+        glob.glob(inputfolder + "/**/*.txt", recursive=True),
+        pipeline=pipeline,
+        maxfieldlen=maxfieldlen,
+        workers=workers,
+    )
 
 def cards_untranslated_from_file(
     inputfile, pipeline, maxfieldlen
@@ -67,16 +65,101 @@ def cards_untranslated_from_file(
     containing chunks not longer than maxfieldlen, with no translations included
     (so, just the front)
     This is much quicker and avoids 'using up' a DeepL API key if you don't need it"""
-    nlp = make_nlp(pipeline)
+    # imported here so that commands that never parse text don't wait for spacy
+    from split_sentences import make_nlp, split_text
 
-    file = open(inputfile, mode="r", encoding="utf-8")
-    docs = nlp.pipe(file)
+    nlp = make_nlp(pipeline) # cached, so only loaded for the first file
 
+    with open(inputfile, mode="r", encoding="utf-8") as file:
+        book_text = file.read()
+    title = Path(inputfile).stem
+    author = Path(inputfile).parent.stem
+
+    # The spans cover the book in order, so each card's text can be a slice of book_text
+    # rather than a string of its own
+    offset = 0
+    docs = nlp.pipe(io.StringIO(book_text))
     for span in split_text(docs, max_span_length=maxfieldlen):
-        yield Card(
-            title = Path(inputfile).stem,
-            author = Path(inputfile).parent.stem,
-            start = span.start,
-            end = span.end,
-            text = span.text_with_ws,
-        )
\ No newline at end of file
+        text = span.text_with_ws
+        if book_text.startswith(text, offset):
+            yield Card.from_book(
+                title, author, span.start, span.end, book_text, offset, len(text)
+            )
+            offset += len(text)
+        else:
+            yield Card(title, author, span.start, span.end, text)
+
+
+def book_cards(inputfile, pipeline, maxfieldlen) -> list[Card]:
+    """All the cards for one book, so that a worker process can hand back a whole book"""
+    return list(
+        cards_untranslated_from_file(
+            inputfile=inputfile, pipeline=pipeline, maxfieldlen=maxfieldlen
+        )
+    )
+
+
+def cards_untranslated_from_files(
+    filenames,
+    pipeline,
+    maxfieldlen,
+    workers: int = 1,
+    manifest: Manifest | None = None,
+) -> Generator[Card, Any, Any]:
+    """cards_untranslated_from_file for each file in turn.
+    With more than one worker, books are parsed ahead in a pool of processes
+    (each with its own spacy model) and yielded whole, in their original order,
+    so each book's cards are still together.
+    With the manifest of a jsonl folder, books whose text, pipeline and maxfieldlen
+    haven't changed since they were last written there are read back from there
+    instead of being parsed again.
+    Every book is expected in the manifest, and only recorded in it once the same
+    manifest has been given to cards_to_jsonl_folder and it has written the book
+    to the folder, so the manifest never vouches for a file that wasn't.
+    Reuse relies on each book being written under its own author and title,
+    so nothing in between may change them"""
+    from spacy.util import get_package_version
+
+    pipeline_version = get_package_version(pipeline) or ""
+    executor = ProcessPoolExecutor(workers) if workers > 1 else None
+    # how many books to start on before the one we're yielding
+    lookahead = 2 * workers if executor else 0
+
+    def start(filename):
+        """Work out where this book's cards will come from, and start any parsing"""
+        if manifest is not None:
+            record = SourceRecord(
+                sha256=file_sha256(filename),
+                pipeline=pipeline,
+                pipeline_version=pipeline_version,
+                maxfieldlen=maxfieldlen,
+            )
+            author, title = Path(filename).parent.stem, Path(filename).stem
+            jsonlfile = book_jsonl_path(manifest.jsonlfolder, author, title)
+            # a leftover .tmp file means the last run didn't finish writing this book
+            unfinished = jsonlfile.with_suffix(jsonlfile.suffix + ".tmp").exists()
+            reuse = manifest.get(filename) == record and jsonlfile.exists()
+            manifest.expect(filename, author, title, record)
+            if reuse and not unfinished:
+                return cards_from_jsonl_file(jsonlfile)
+
+        if executor:
+            return executor.submit(book_cards, filename, pipeline, maxfieldlen)
+        return cards_untranslated_from_file(
+            inputfile=filename, pipeline=pipeline, maxfieldlen=maxfieldlen
+        )
+
+    def finish(cards):
+        yield from cards.result() if isinstance(cards, Future) else cards
+
+    try:
+        pending: deque = deque()
+        for filename in filenames:
+            pending.append(start(filename))
+            while len(pending) > lookahead:
+                yield from finish(pending.popleft())
+        while pending:
+            yield from finish(pending.popleft())
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
@@ -1,40 +1,60 @@
 """Take a text file containing human language and turn it into a flashcard data structure
-with translations in another language"""
+with translations in another language.
+spacy, deepl, genanki and alive_progress are slow to import, so they are only
+imported by the commands that use them"""
 
-from collections.abc import Generator
 import glob
 import os
 import sys
+from collections.abc import Generator
 from typing import Any
 
-import alive_progress  # type: ignore
 import click
-import deepl
-
-from book_to_flashcards.Progress import Progress
-from book_to_flashcards.cards_jsonl import cards_from_jsonl, cards_to_jsonl
 
 from .Card import Card
-from .cards_to_anki import cards_to_anki
-from .cards_untranslated_from_text import card_trim_title, cards_untranslated_from_file, cards_skip_first_line_if_author
-from .translate_cards import ReverseTextTranslator, translate_cards
-
+from .card_archive import cards_from_archive, cards_to_archive
+from .card_store import BookNotFoundError, cards_from_store
+from .cards_jsonl import cards_from_jsonl, cards_to_jsonl
+from .cards_untranslated_from_text import (
+    card_trim_title,
+    cards_skip_first_line_if_author,
+    cards_untranslated_from_files,
+)
+from .manifest import Manifest
+from .Progress import Progress
+from .translate_cards import (
+    BatchPolicy,
+    BatchStats,
+    RateLimiter,
+    ReverseTextTranslator,
+    translate_cards,
+)
+from .translation_memory import TranslationMemory
 
 __progress = Progress()
 
 
 def make_progress_bar(num_steps: int):
+    import alive_progress  # type: ignore
+
     return alive_progress.alive_bar(num_steps, bar="bubbles", spinner="classic")
 
 
 @click.group(chain=True)
-def cli_make_flashcards():
-    pass
+@click.pass_context
+def cli_make_flashcards(ctx):
+    # shared by the commands in the chain, e.g. pipeline --reuse hands its manifest to to-jsonl
+    ctx.obj = {}
 
 
 @cli_make_flashcards.result_callback()
-def process_pipeline(processors):
+@click.pass_context
+def process_pipeline(ctx, processors):
     """Chain generators for each command into a pipeline"""
+    if "manifest" in ctx.obj:
+        raise click.UsageError(
+            "pipeline --reuse needs a later to-jsonl writing to the same folder"
+        )
     iterator = None
     # Don't do progress bar if nobody can see it
     # Non tty outputs can't always handle UTF-8
@@ -62,13 +82,58 @@ def from_text(
     return processor
 
 
+def parse_range(ctx, param, value):
+    """START:END character positions, where either can be left out"""
+    if value is None:
+        return None
+    try:
+        start, end = value.split(":")
+        return (int(start) if start else None, int(end) if end else None)
+    except ValueError:
+        raise click.BadParameter("should be START:END, e.g. 1000:5000 or 1000:")
+
+
 @click.argument("inputpath", type=click.Path(exists=True))
+@click.option(
+    "--book",
+    help="Only read this book, as TITLE or AUTHOR/TITLE, using an index of the jsonl file",
+)
+@click.option(
+    "--range",
+    "charrange",
+    callback=parse_range,
+    help="Only read cards starting in this range of character positions, as START:END",
+)
+@click.option(
+    "--prefetch",
+    type=click.IntRange(0),
+    default=0,
+    show_default=True,
+    help="Number of files in a folder to read ahead in the background, when reading the whole folder (so not with --book or --range)",
+)
 @cli_make_flashcards.command()
-def from_jsonl(
-    inputpath,
-):
+def from_jsonl(inputpath, book, charrange, prefetch):
+    if prefetch and (book is not None or charrange is not None):
+        raise click.UsageError("--prefetch can't be used with --book or --range")
+
     def processor(iterator) -> Generator[Card, Any, Any]:
-        yield from cards_from_jsonl(inputpath)
+        if book is None and charrange is None:
+            yield from cards_from_jsonl(inputpath, prefetch)
+        else:
+            start, end = charrange or (None, None)
+            try:
+                yield from cards_from_store(inputpath, book, start, end)
+            except BookNotFoundError as e:
+                raise click.BadParameter(str(e), param_hint="'--book'") from e
+
+    return processor
+
+
+@click.argument("inputfile", type=click.Path(exists=True, dir_okay=False))
+@cli_make_flashcards.command()
+def from_archive(inputfile):
+    def processor(iterator) -> Generator[Card, Any, Any]:
+        yield from cards_from_archive(inputfile)
 
     return processor
 
@@ -104,7 +169,7 @@ def skip_first_line_if_author():
 def remove_title_crap_after(separator:str):
     def processor(iterator) -> Generator[Card, Any, Any]:
         for card in iterator:
-            yield card_trim_title(card.title, separator)
+            yield card_trim_title(card, separator)
 
     return processor
 
@@ -119,15 +184,32 @@ def remove_title_crap_after(separator:str):
     show_default=True,
     help="Font sized used for card text within Anki",
 )
+@click.option(
+    "--maxnotes",
+    type=click.IntRange(1),
+    default=None,
+    help="Split the output into several packages of about this many notes, breaking between books",
+)
+@click.option(
+    "--maxbytes",
+    type=click.IntRange(1),
+    default=None,
+    help="Split the output into several packages of about this many bytes, breaking between books",
+)
 @cli_make_flashcards.command()
-def to_anki(outputfile, fontsize):
+def to_anki(outputfile, fontsize, maxnotes, maxbytes):
     def processor(iterator):
+        # genanki and jinja2 are only needed here
+        from .cards_to_anki import cards_to_anki
+
         cards_to_anki(
             iterator,
             structure=True,
             fontsize=fontsize,
             ankifile=outputfile,
             on_file_complete=__progress,
+            max_notes=maxnotes,
+            max_bytes=maxbytes,
         )
 
     return processor
@@ -136,9 +218,26 @@ def to_anki(outputfile, fontsize):
 @click.argument("outputpath", type=click.Path(writable=True))
 @click.option("--trim", default="", help="Separator character in filename that will be used to discard unwanted trailing characters when generating jsonl filename")
 @cli_make_flashcards.command()
-def to_jsonl(outputpath, trim):
+@click.pass_obj
+def to_jsonl(obj, outputpath, trim):
+    # records the books made by pipeline --reuse, if they are being written to its folder
+    manifest = obj.get("manifest")
+    if manifest is not None and manifest.is_for(outputpath):
+        del obj["manifest"]
+    else:
+        manifest = None
+
+    def processor(iterator: Generator[Card]):
+        cards_to_jsonl(iterator, outputpath, trim, __progress, manifest)
+
+    return processor
+
+
+@click.argument("outputfile", type=click.Path(dir_okay=False, writable=True))
+@cli_make_flashcards.command()
+def to_archive(outputfile):
     def processor(iterator: Generator[Card]):
-        cards_to_jsonl(iterator, outputpath, trim, __progress)
+        cards_to_archive(iterator, outputfile, progress=__progress)
 
     return processor
 
@@ -150,13 +249,33 @@ def to_jsonl(outputpath, trim):
     default=70,
     help="The maximum desired length of a text field (translations may be longer)",
 )
+@click.option(
+    "--reuse",
+    type=click.Path(file_okay=False),
+    help="jsonl folder from an earlier to-jsonl run. Books that haven't changed since are read from there instead of being parsed again. Needs a to-jsonl to the same folder later in the chain, and titles left unchanged",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(1),
+    default=1,
+    show_default=True,
+    help="Number of processes to parse books in parallel, each with its own spacy pipeline",
+)
 @cli_make_flashcards.command()
-def pipeline(pipeline, maxfieldlen):
+@click.pass_obj
+def pipeline(obj, pipeline, maxfieldlen, reuse, workers):
+    manifest = None
+    if reuse:
+        manifest = obj["manifest"] = Manifest(reuse)
+
     def processor(iterator: Generator[str]) -> Generator[Card]:
-        for filename in iterator:
-            yield from cards_untranslated_from_file(
-                inputfile=filename, pipeline=pipeline, maxfieldlen=maxfieldlen
-            )
+        yield from cards_untranslated_from_files(
+            iterator,
+            pipeline=pipeline,
+            maxfieldlen=maxfieldlen,
+            workers=workers,
+            manifest=manifest,
+        )
 
     return processor
 
@@ -169,11 +288,87 @@ def pipeline(pipeline, maxfieldlen):
     envvar="DEEPL_KEY",
     help="API key for DeepL (required for translations)",
 )
+@click.option(
+    "--memory",
+    type=click.Path(dir_okay=False, writable=True),
+    help="SQLite file to remember translations in, so unchanged text isn't sent to DeepL again",
+)
+@click.option(
+    "--memorysize",
+    type=click.IntRange(1),
+    default=1_000_000,
+    show_default=True,
+    help="Maximum number of translations to remember (least recently used are forgotten first)",
+)
+@click.option(
+    "--inflight",
+    type=click.IntRange(1),
+    default=1,
+    show_default=True,
+    help="Number of batches of cards to send to DeepL at the same time",
+)
+@click.option(
+    "--rps",
+    type=click.FloatRange(0, min_open=True),
+    help="Maximum number of requests per second to send to DeepL",
+)
+@click.option(
+    "--cpm",
+    type=click.IntRange(1),
+    help="Maximum number of characters per minute to send to DeepL",
+)
+@click.option(
+    "--retries",
+    type=click.IntRange(0),
+    default=3,
+    show_default=True,
+    help="Number of times to retry a batch if DeepL is overloaded",
+)
+@click.option(
+    "--batchbytes",
+    type=click.IntRange(1),
+    default=100_000,
+    show_default=True,
+    help="Maximum bytes of card text to send to DeepL in one request",
+)
+@click.option(
+    "--batchsize",
+    type=click.IntRange(1),
+    default=200,
+    show_default=True,
+    help="Maximum number of cards to send to DeepL in one request",
+)
 @cli_make_flashcards.command()
-def translate(lang, deeplkey):
+def translate(
+    lang, deeplkey, memory, memorysize, inflight, rps, cpm, retries, batchbytes, batchsize
+):
     def processor(iterator) -> Generator[Card]:
+        import deepl
+
         translator = deepl.Translator(deeplkey)
-        yield from translate_cards(iterator, translator, lang)
+        stats = BatchStats(max_bytes=batchbytes)
+        options = {
+            "in_flight": inflight,
+            "rate_limiter": RateLimiter(rps, cpm) if rps or cpm else None,
+            "retries": retries,
+            "batch_policy": BatchPolicy(max_bytes=batchbytes, max_items=batchsize),
+            "stats": stats,
+        }
+        if memory is None:
+            yield from translate_cards(iterator, translator, lang, **options)
+        else:
+            with TranslationMemory(memory, max_entries=memorysize) as translation_memory:
+                yield from translate_cards(
+                    iterator, translator, lang, translation_memory, **options
+                )
+                memory_stats = translation_memory.stats()
+                click.echo(
+                    f"Translation memory: {memory_stats['hits']} hits, "
+                    f"{memory_stats['misses']} misses, "
+                    f"{memory_stats['entries']} remembered",
+                    err=True,
+                )
+        click.echo(f"Translation: {stats}", err=True)
 
     return processor
 
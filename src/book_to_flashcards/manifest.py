@@ -0,0 +1,102 @@
+"""Keep track of which source texts went into a folder of jsonl files,
+so that books that haven't changed don't have to be parsed again"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+
+@dataclass
+class SourceRecord:
+    """Everything that affects the cards we make from a source text"""
+
+    sha256: str
+    pipeline: str
+    pipeline_version: str
+    maxfieldlen: int
+
+
+def file_sha256(filename) -> str:
+    digest = hashlib.sha256()
+    with open(filename, mode="rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def manifest_path(jsonlfolder) -> Path:
+    """The manifest lives next to the jsonl folder, not in it"""
+    folder = Path(jsonlfolder).resolve()
+    return folder.with_name(folder.name + ".manifest.json")
+
+
+class Manifest:
+    """A record of the source text that each book in a jsonl folder was made from,
+    keyed by the path of the source text.
+    Books being made are expected first, and only recorded once they have
+    actually been written to the folder, under the author and title they
+    were expected with"""
+
+    def __init__(self, jsonlfolder):
+        self.jsonlfolder = Path(jsonlfolder)
+        self.path = manifest_path(jsonlfolder)
+        self.records: dict[str, SourceRecord] = {}
+        # (author, title) -> (source, record) for books that haven't been written yet
+        self.expected: dict[tuple[str, str], tuple[str, SourceRecord]] = {}
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as file:
+                self.records = {
+                    source: SourceRecord(**record)
+                    for source, record in json.load(file).items()
+                }
+
+    @staticmethod
+    def key(source) -> str:
+        return str(Path(source).resolve())
+
+    def get(self, source) -> SourceRecord | None:
+        return self.records.get(self.key(source))
+
+    def __setitem__(self, source, record: SourceRecord):
+        self.records[self.key(source)] = record
+
+    def is_for(self, folder) -> bool:
+        return Path(folder).resolve() == self.jsonlfolder.resolve()
+
+    def expect(self, source, author: str, title: str, record: SourceRecord):
+        """The book is being made from source, and will be written to the folder
+        as author/title"""
+        self.expected[(author, title)] = (self.key(source), record)
+
+    def check_expected(self, author: str, title: str):
+        """A book that isn't expected has had its author or title changed since
+        it was made, and could never be found again to be reused"""
+        if (author, title) not in self.expected:
+            raise ValueError(
+                f"{author}/{title} wasn't made from a source text with that author "
+                "and title, so it can't be reused. Books can only be reused if "
+                "their titles aren't changed"
+            )
+
+    def written(self, author: str, title: str):
+        """The book has been written to the folder, so record what it was made from"""
+        source, record = self.expected.pop((author, title))
+        self.records[source] = record
+
+    def save(self):
+        """Write the manifest via a temporary file, so we never leave half a manifest behind"""
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp, mode="w", encoding="utf-8") as file:
+            json.dump(
+                {source: asdict(record) for source, record in self.records.items()},
+                file,
+                ensure_ascii=False,
+                indent=1,
+            )
+        os.replace(tmp, self.path)
+
@@ -1,7 +1,15 @@
 """Provide a substitute for DeepL so that we can stub DeepL out in testing
 and therefore not require an API key"""
 
-from itertools import chain, islice
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+
+from .translation_memory import translator_id
 
 
 class ReverseTextTranslator:
@@ -17,31 +25,218 @@ class ReverseTextTranslator:
             return [s[::-1] for s in text]
 
 
-def chunks(iterable, size=10):
-    """Yield zero or more chunks of "size" items, consuming all the iterable items.
-    The last chunk may be shorter than "size" """
-    iterator = iter(iterable)
-    for first in iterator:
-        yield chain([first], islice(iterator, size - 1))
+def text_bytes(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+
+@dataclass
+class BatchPolicy:
+    """How many cards to put in each request to the translator.
+    Cards are packed into a batch until it would go over max_bytes of text,
+    or has max_items cards in it. A single card bigger than max_bytes gets
+    a batch to itself."""
+
+    max_bytes: int = 100_000
+    max_items: int = 200
+
+    def batches(self, cards):
+        """Yield lists of cards, consuming all the cards"""
+        batch: list = []
+        batch_bytes = 0
+        for card in cards:
+            card_bytes = text_bytes(card.text)
+            if batch and (
+                batch_bytes + card_bytes > self.max_bytes or len(batch) >= self.max_items
+            ):
+                yield batch
+                batch = []
+                batch_bytes = 0
+            batch.append(card)
+            batch_bytes += card_bytes
+        if batch:
+            yield batch
+
+
+@dataclass
+class BatchStats:
+    """Keep count of the requests sent to the translator, so the batch policy can be tuned"""
+
+    max_bytes: int
+    requests: int = 0
+    texts: int = 0
+    bytes: int = 0
+
+    def record(self, texts: list[str]):
+        self.requests += 1
+        self.texts += len(texts)
+        self.bytes += sum(text_bytes(text) for text in texts)
+
+    @property
+    def bytes_per_request(self) -> float:
+        return self.bytes / self.requests if self.requests else 0
+
+    @property
+    def average_fill(self) -> float:
+        """How full the requests were on average, as a fraction of max_bytes"""
+        return self.bytes_per_request / self.max_bytes
+
+    def __str__(self):
+        return (
+            f"{self.requests} requests, {self.texts} texts, "
+            f"{self.bytes_per_request:.0f} bytes per request, "
+            f"{self.average_fill:.0%} average fill"
+        )
+
 
+class RateLimiter:
+    """Hold back translation requests so that we stay within a budget of
+    requests per second and characters per minute. Safe to share between threads.
+    Up to a minute's worth of characters can be sent in a burst."""
 
-def translate_cards(cards, translator, lang):
+    def __init__(
+        self,
+        requests_per_second: float | None = None,
+        characters_per_minute: int | None = None,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.requests_per_second = requests_per_second
+        self.characters_per_minute = characters_per_minute
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.next_request = 0.0
+        self.characters_due = 0.0
+
+    def reserve(self, characters: int) -> float:
+        """Book a slot for a request, and return how long to wait before sending it"""
+        with self.lock:
+            now = self.clock()
+            start = max(now, self.next_request)
+            if self.characters_per_minute:
+                # characters_due is when the budget will be back to a full minute's worth
+                seconds_of_budget = characters * 60 / self.characters_per_minute
+                start = max(start, self.characters_due - 60 + min(seconds_of_budget, 60))
+                self.characters_due = max(self.characters_due, start) + seconds_of_budget
+            if self.requests_per_second:
+                self.next_request = start + 1 / self.requests_per_second
+            return start - now
+
+    def wait(self, characters: int):
+        delay = self.reserve(characters)
+        if delay > 0:
+            self.sleep(delay)
+
+
+def is_retryable(e: Exception) -> bool:
+    """Too many requests, or something went wrong at the server end.
+    DeepL exceptions carry the HTTP status code"""
+    status = getattr(e, "http_status_code", None)
+    return status is not None and (status == 429 or 500 <= status < 600)
+
+
+def translate_with_retries(
+    texts: list[str],
+    translator,
+    lang,
+    retries: int = 0,
+    backoff: float = 1.0,
+    sleep=time.sleep,
+) -> list[str]:
+    """Send one request to the translator, retrying with exponential backoff
+    if the translator is overloaded"""
+    attempt = 0
+    while True:
+        try:
+            # deepl translations are not strings
+            return [str(t) for t in translator.translate_text(texts, target_lang=lang)]
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            sleep(backoff * 2**attempt)
+            attempt += 1
+
+
+def run_now(fn, *args) -> Future:
+    """Run fn straight away, but hand back the result the same way a thread pool would"""
+    future: Future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:  # noqa: BLE001 - raised again by future.result()
+        future.set_exception(e)
+    return future
+
+
+def translate_cards(
+    cards,
+    translator,
+    lang,
+    memory=None,
+    in_flight: int = 1,
+    rate_limiter: RateLimiter | None = None,
+    retries: int = 0,
+    batch_policy: BatchPolicy | None = None,
+    stats: BatchStats | None = None,
+):
     """Yield all the incoming cards but with translations added.
-    We batch up the translations - we don't want a round trip per card.
-    But we still want to be able to report progress to the user every now and then
+    We batch up the translations (see BatchPolicy) - we don't want a round trip per card.
+    But we still want to be able to report progress to the user every now and then.
+    With in_flight > 1, that many batches are sent to the translator at once from
+    a pool of threads; cards still come out in their original order.
+    If there is a TranslationMemory, only the texts it doesn't already know
+    are sent to the translator, and the new translations are added to it.
     """
+    translator_name = translator_id(translator)
+    if batch_policy is None:
+        batch_policy = BatchPolicy()
+
+    def request(texts: list[str]) -> list[str]:
+        if rate_limiter:
+            rate_limiter.wait(sum(len(text) for text in texts))
+        return translate_with_retries(texts, translator, lang, retries)
 
-    for chunk in chunks(cards, 200):
-        # get all the translations
-        lchunk = list(chunk)
+    def start(batch):
         # If they all have translations already
-        if all(card.translation for card in lchunk):
-            yield from lchunk
+        if all(card.translation for card in batch):
+            return batch, None, [], None
 
-        translations = translator.translate_text(
-            [card.text for card in lchunk], target_lang=lang
+        texts = [card.text for card in batch]
+        remembered = (
+            memory.lookup(texts, lang, translator_name)
+            if memory is not None
+            else [None] * len(texts)
         )
+        # no need to send the same text twice
+        misses = list(dict.fromkeys(t for t, r in zip(texts, remembered) if r is None))
+        if stats and misses:
+            stats.record(misses)
+        return batch, remembered, misses, submit(request, misses) if misses else None
+
+    def finish(batch, remembered, misses, future):
+        if remembered is None:
+            yield from batch
+            return
+
+        translated = dict(zip(misses, future.result())) if future else {}
+        if memory is not None and misses:
+            memory.store(misses, [translated[t] for t in misses], lang, translator_name)
         # put the translations back in the cards and return
-        for card, translation in zip(lchunk, translations):
-            card.translation = str(translation)  # deepl translations are not strings
+        for card, translation in zip(batch, remembered):
+            card.translation = (
+                translation if translation is not None else translated[card.text]
+            )
             yield card
+
+    executor = ThreadPoolExecutor(max_workers=in_flight) if in_flight > 1 else None
+    submit = executor.submit if executor else run_now
+    try:
+        pending: deque = deque()
+        for batch in batch_policy.batches(cards):
+            pending.append(start(batch))
+            while len(pending) >= in_flight:
+                yield from finish(*pending.popleft())
+        while pending:
+            yield from finish(*pending.popleft())
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
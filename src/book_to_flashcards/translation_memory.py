@@ -0,0 +1,142 @@
+"""Remember translations between runs, so that rebuilding decks only sends
+the translator text that it hasn't seen before"""
+
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+
+
+def translator_id(translator) -> str:
+    """Identify a translator, so translations from different translators are kept apart"""
+    return getattr(
+        translator,
+        "translator_id",
+        f"{type(translator).__module__}.{type(translator).__qualname__}",
+    )
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class TranslationMemory:
+    """An on-disk store of translations in SQLite, keyed by a hash of the source text,
+    the target language and the translator that was used.
+    When there are more than max_entries translations, the least recently used
+    ones are thrown away."""
+
+    # SQLite has a limit on the number of parameters in one statement
+    max_query_params = 500
+
+    def __init__(self, path, max_entries: int = 1_000_000):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS translations (
+                text_hash TEXT NOT NULL,
+                lang TEXT NOT NULL,
+                translator TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (text_hash, lang, translator)
+            )"""
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)"
+        )
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # A counter rather than a timestamp, so that the order of use is exact
+        (self.clock,) = self.connection.execute(
+            "SELECT COALESCE(MAX(last_used), 0) FROM translations"
+        ).fetchone()
+        # Kept up to date by store, so it doesn't have to count the whole table
+        (self.entries,) = self.connection.execute(
+            "SELECT COUNT(*) FROM translations"
+        ).fetchone()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self) -> int:
+        return self.entries
+
+    def __tick(self) -> int:
+        self.clock += 1
+        return self.clock
+
+    def lookup(self, texts: list[str], lang: str, translator: str) -> list[str | None]:
+        """Return the remembered translation for each text, or None if there isn't one"""
+        hashes = [text_hash(text) for text in texts]
+        found: dict[str, str] = {}
+        for start in range(0, len(hashes), self.max_query_params):
+            batch = hashes[start : start + self.max_query_params]
+            placeholders = ",".join("?" * len(batch))
+            found.update(
+                self.connection.execute(
+                    f"""SELECT text_hash, translation FROM translations
+                    WHERE lang = ? AND translator = ? AND text_hash IN ({placeholders})""",
+                    [lang, translator, *batch],
+                ).fetchall()
+            )
+
+        if found:
+            now = self.__tick()
+            with self.connection:
+                self.connection.executemany(
+                    """UPDATE translations SET last_used = ?
+                    WHERE text_hash = ? AND lang = ? AND translator = ?""",
+                    [(now, h, lang, translator) for h in found],
+                )
+
+        translations = [found.get(h) for h in hashes]
+        hits = sum(1 for t in translations if t is not None)
+        self.hits += hits
+        self.misses += len(translations) - hits
+        return translations
+
+    def store(
+        self, texts: list[str], translations: list[str], lang: str, translator: str
+    ):
+        """Remember these translations, then throw away the least recently used
+        translations if we have too many"""
+        now = self.__tick()
+        hashes = [text_hash(text) for text in texts]
+        with self.connection:
+            # Inserting only new translations, then updating the rest, means rowcount
+            # is how many entries were added, which INSERT OR REPLACE wouldn't tell us
+            inserted = self.connection.executemany(
+                "INSERT OR IGNORE INTO translations VALUES (?, ?, ?, ?, ?)",
+                [
+                    (h, lang, translator, translation, now)
+                    for h, translation in zip(hashes, translations)
+                ],
+            ).rowcount
+            self.connection.executemany(
+                """UPDATE translations SET translation = ?, last_used = ?
+                WHERE text_hash = ? AND lang = ? AND translator = ?""",
+                [
+                    (translation, now, h, lang, translator)
+                    for h, translation in zip(hashes, translations)
+                ],
+            )
+            entries = self.entries + inserted
+            if entries > self.max_entries:
+                entries -= self.connection.execute(
+                    """DELETE FROM translations WHERE rowid IN (
+                        SELECT rowid FROM translations ORDER BY last_used DESC
+                        LIMIT -1 OFFSET ?
+                    )""",
+                    [self.max_entries],
+                ).rowcount
+        self.entries = entries
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self)}
@@ -1,3 +1,3 @@
 # ruff: noqa: F401
-from .spacy_wrapper import make_nlp
+from .spacy_wrapper import make_nlp, load_nlp, clear_nlp_cache
 from .split_sentences import split_sentences, split_sentence, consolidate_spans, split_text
@@ -22,9 +22,28 @@ def tidy_doc_punctuation(doc: Doc) -> Doc:
             retokenizer.merge(span, attrs=attrs)
     return doc
 
+DEFAULT_EXCLUDE = ("lemmatizer", "ner", "attribute_ruler")
+
+# Loading a pipeline takes seconds, so we only do it once per process for each
+# combination of pipeline name, excluded components and extra components
+__nlp_cache: dict[tuple[str, tuple[str, ...], tuple[str, ...]], Language] = {}
+
+def load_nlp(pipeline: str, exclude=DEFAULT_EXCLUDE, add_pipes=()) -> Language:
+    '''Return a shared spacy pipeline, loading it the first time it is asked for'''
+    key = (pipeline, tuple(exclude), tuple(add_pipes))
+    if key not in __nlp_cache:
+        nlp = spacy.load(pipeline, exclude=list(exclude))
+        for name in add_pipes:
+            if name not in nlp.pipe_names:
+                nlp.add_pipe(name)
+        __nlp_cache[key] = nlp
+    return __nlp_cache[key]
+
+def clear_nlp_cache():
+    __nlp_cache.clear()
+
 def make_nlp(pipeline: str):
-    nlp = spacy.load(pipeline, exclude=["lemmatizer", "ner", "attribute_ruler"]) 
-    nlp.add_pipe("tidy_punctuation")
+    nlp = load_nlp(pipeline, add_pipes=("tidy_punctuation",))
     assert isinstance(nlp.tokenizer, Tokenizer)
 
     return nlp
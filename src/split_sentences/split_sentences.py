@@ -7,6 +7,8 @@ from collections.abc import Generator
 from dataclasses import dataclass
 from typing import Any, Iterable
 
+import numpy as np
+from spacy.attrs import HEAD, IDX, LENGTH, SPACY  # type: ignore
 from spacy.tokens import Doc, Span, Token
 
 
@@ -51,21 +53,119 @@ def consolidated_spans_in_tree(
 ) -> Generator[Span, Any, Any]:
     """Return all the text with a dependency on root_token,
     broken into spans no longer than max_span_length.
-    Does a depth first search of the grammar tree, consolidating
-    siblings (respecting max_span_length) as it goes.
-    This attempts to keep chunks of syntax tree together as much as possible."""
-    all_spans_in_tree: list[Span] = []
+    Works up the grammar tree from the leaves, consolidating each token with
+    the spans of its children (respecting max_span_length) as it goes.
+    This attempts to keep chunks of syntax tree together as much as possible.
 
-    # accumulate sorted consolidated spans of all children
-    for child in root_token.children:
-        for span in consolidated_spans_in_tree(
-            doc, root_token=child, max_span_length=max_span_length
-        ):
-            bisect.insort(all_spans_in_tree, span)
+    Consolidated spans can only merge with their neighbours where they meet spans
+    from another part of the tree, so each token's spans are kept as a linked list
+    and only those seams are looked at. Usually a token's children cover separate
+    stretches of text and the lists can just be joined up, making this linear in
+    the length of the sentence; if they overlap (a non-projective tree) the spans
+    for that token are sorted and consolidated in full."""
+    first = root_token.left_edge.i
+    last = root_token.right_edge.i + 1
+    # Span.to_array is missing from spacy's type stubs. Converting just this subtree,
+    # rather than slicing doc.to_array, keeps long documents linear
+    subtree = doc[first:last]
+    columns = subtree.to_array([HEAD, IDX, LENGTH, SPACY])  # type: ignore[attr-defined]
+    columns = columns.astype("int64")
+    heads = (columns[:, 0] + np.arange(last - first)).tolist()
+    char_start = columns[:, 1].tolist()
+    char_end = (columns[:, 1] + columns[:, 2] + columns[:, 3]).tolist()
+    root = root_token.i - first
 
-    # insert root span in sorted order and reconsolidate across root and children
-    bisect.insort(all_spans_in_tree, Span(doc, root_token.i, root_token.i + 1))
-    yield from consolidate_spans(all_spans_in_tree, max_span_length)
+    children: list[list[int]] = [[] for _ in heads]
+    for i, head in enumerate(heads):
+        if head != i and 0 <= head < len(heads):
+            children[head].append(i)
+
+    # the spans are token ranges [start, span_end[start]), linked in order by next_span.
+    # Each token starts off as a span of its own.
+    span_end = list(range(1, len(heads) + 1))
+    next_span = [-1] * len(heads)
+    # the first and last span for each token's subtree, and the tokens it covers
+    first_span = list(range(len(heads)))
+    last_span = list(range(len(heads)))
+    left_edge = list(range(len(heads)))
+    right_edge = list(range(len(heads)))
+
+    def can_merge(a: int, b: int) -> bool:
+        if span_end[a] != b:
+            return False
+        if not max_span_length:
+            return True
+        length = char_end[span_end[b] - 1] - char_start[a]
+        return length <= max_span_length
+
+    # a token's children have to be consolidated before the token itself
+    postorder = []
+    stack = [root]
+    while stack:
+        token = stack.pop()
+        postorder.append(token)
+        stack.extend(children[token])
+
+    for token in reversed(postorder):
+        if not children[token]:
+            continue  # a leaf is already a span of its own
+        # children are in token order, so this puts the parts in order of their text
+        # unless the tree is non-projective here
+        parts = children[token][:]
+        bisect.insort(parts, token)
+        separate = True
+        for a, b in zip(parts, parts[1:]):
+            if right_edge[a] >= left_edge[b]:
+                separate = False
+                break
+        if separate:
+            left_edge[token] = left_edge[parts[0]]
+            right_edge[token] = right_edge[parts[-1]]
+        else:
+            left_edge[token] = min(left_edge[part] for part in parts)
+            right_edge[token] = max(right_edge[part] for part in parts)
+
+        if separate:
+            # join the lists up in order, only consolidating where they meet
+            accumulating = -1
+            for part in parts:
+                head = first_span[part]
+                tail = last_span[part]
+                if accumulating >= 0 and can_merge(accumulating, head):
+                    span_end[accumulating] = span_end[head]
+                    next_span[accumulating] = next_span[head]
+                    if tail != head:
+                        accumulating = tail
+                else:
+                    if accumulating >= 0:
+                        next_span[accumulating] = head
+                    accumulating = tail
+            first_span[token] = first_span[parts[0]]
+            last_span[token] = accumulating
+        else:
+            # the children are tangled up, so sort all their spans and start again
+            spans = []
+            for part in parts:
+                span = first_span[part]
+                while span >= 0:
+                    spans.append(span)
+                    span = next_span[span]
+            spans.sort()
+            accumulating = spans[0]
+            first_span[token] = accumulating
+            for span in spans[1:]:
+                if can_merge(accumulating, span):
+                    span_end[accumulating] = span_end[span]
+                else:
+                    next_span[accumulating] = span
+                    accumulating = span
+            next_span[accumulating] = -1
+            last_span[token] = accumulating
+
+    span = first_span[root]
+    while span >= 0:
+        yield Span(doc, first + span, first + span_end[span])
+        span = next_span[span]
 
 
 def split_sentence(doc: Doc, sentence: Span, max_span_length: int) -> Generator[Span, Any, Any]:
@@ -108,4 +208,52 @@ def split_from_text(docs: Iterable[Doc], max_span_length: int) -> Generator[Cros
         doc_base = doc_base + doc_len
 
 def split_text(docs: Iterable[Doc], max_span_length: int) -> Generator[CrossDocSpan, Any, Any]:
-    yield from consolidate_spans(split_from_text(docs, max_span_length), max_span_length)
\ No newline at end of file
+    """split_from_text, consolidated across the Docs.
+    This is consolidate_spans on the CrossDocSpans from split_from_text, but it only
+    keeps track of where the text of the span being built up lies in the Docs,
+    and slices it out once the span is finished, rather than joining strings
+    together every time two spans are merged."""
+    # The span being built up: its start, end and text length, and the pieces of
+    # Doc text (text, start, stop) that make up its text
+    start = end = length = 0
+    pieces: list[list] = []
+
+    doc_base = 0
+    for doc in docs:
+        doc_text = doc.text
+        for span in split_sentences(doc, max_span_length=max_span_length):
+            doc_len = span.end_char
+            span_start = doc_base + span.start_char
+            span_end = doc_base + span.end_char
+            text_stop = span.end_char + len(span[-1].whitespace_)
+            span_length = text_stop - span.start_char
+
+            too_long_to_merge = max_span_length and (
+                length + span_length > max_span_length
+            )
+            consecutive = start < span_start and end == span_start
+            if pieces and not too_long_to_merge and consecutive:
+                end = span_end
+                length += span_length
+                last_piece = pieces[-1]
+                if last_piece[0] is doc_text and last_piece[2] == span.start_char:
+                    last_piece[2] = text_stop
+                else:
+                    pieces.append([doc_text, span.start_char, text_stop])
+            else:
+                if pieces:
+                    yield CrossDocSpan(start, end, __join_pieces(pieces))
+                start, end, length = span_start, span_end, span_length
+                pieces = [[doc_text, span.start_char, text_stop]]
+        doc_base = doc_base + doc_len
+
+    # Anything left?
+    if pieces:
+        yield CrossDocSpan(start, end, __join_pieces(pieces))
+
+
+def __join_pieces(pieces: list[list]) -> str:
+    if len(pieces) == 1:
+        text, start, stop = pieces[0]
+        return text[start:stop]
+    return "".join(text[start:stop] for text, start, stop in pieces)
@@ -0,0 +1,54 @@
+"""Compare the size of a card archive, and how quickly it loads, against jsonl.
+Run from the repo root: python test/src/benchmark_card_archive.py [number of cards]"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from book_to_flashcards import Card
+from book_to_flashcards.card_archive import cards_from_archive, cards_to_archive
+from book_to_flashcards.cards_jsonl import cards_from_jsonl, cards_to_jsonl_file
+
+
+def make_cards(num_cards: int, cards_per_book: int = 2000):
+    for i in range(num_cards):
+        book = i // cards_per_book
+        yield Card(
+            title=f"book {book}",
+            author=f"author {book % 50}",
+            start=i * 70,
+            end=(i + 1) * 70,
+            text="Дедушка поцеловал Лидиньку, а она опрометью побежала к Даше, ",
+            translation="Grandfather kissed Lidinka, and she rushed to Dasha, ",
+        )
+
+
+def cards_per_second(read, inputfile, num_cards: int, text_length: int) -> float:
+    start = time.perf_counter()
+    # make sure the text is really there
+    length = sum(len(card.text) for card in read(inputfile))
+    seconds = time.perf_counter() - start
+    assert length == text_length
+    return num_cards / seconds
+
+
+if __name__ == "__main__":
+    num_cards = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"{num_cards} cards")
+    with tempfile.TemporaryDirectory() as folder:
+        jsonlfile = Path(folder, "cards.jsonl")
+        archivefile = Path(folder, "cards.cards")
+        cards_to_jsonl_file(make_cards(num_cards), str(jsonlfile))
+        cards_to_archive(make_cards(num_cards), archivefile)
+        text_length = sum(len(card.text) for card in make_cards(num_cards))
+        for name, read, inputfile in [
+            ("jsonl", cards_from_jsonl, jsonlfile),
+            ("archive", cards_from_archive, archivefile),
+        ]:
+            speed = cards_per_second(read, inputfile, num_cards, text_length)
+            print(
+                f"{name}: {os.path.getsize(inputfile) / num_cards:.0f} bytes/card, "
+                f"{speed:.0f} cards/s"
+            )
@@ -0,0 +1,96 @@
+"""Compare the memory used by Card against the plain dataclass it used to be.
+Run from the repo root: python test/src/benchmark_card_memory.py [number of cards]"""
+
+import sys
+import tracemalloc
+from dataclasses import dataclass
+
+import orjson
+
+from book_to_flashcards.Card import Card
+
+
+@dataclass
+class DataclassCard:
+    """What Card used to be"""
+
+    title: str
+    author: str
+    start: int
+    end: int
+    text: str
+    translation: str = ""
+
+
+TEXT = "Дедушка поцеловал Лидиньку, а она опрометью побежала к Даше, "
+
+
+def jsonl_lines(num_cards: int, cards_per_book: int = 2000):
+    """Cards as cards_from_jsonl_file sees them, so every field is a new string"""
+    for i in range(num_cards):
+        book = i // cards_per_book
+        yield orjson.dumps(
+            {
+                "title": f"book {book}",
+                "author": f"author {book % 50}",
+                "start": i * len(TEXT),
+                "end": (i + 1) * len(TEXT),
+                "text": TEXT,
+                "translation": "",
+            }
+        )
+
+
+def from_jsonl(card_type, num_cards: int):
+    return [card_type(**orjson.loads(line)) for line in jsonl_lines(num_cards)]
+
+
+def from_book(card_type, num_cards: int, cards_per_book: int = 2000):
+    """Cards as cards_untranslated_from_file makes them, from one string per book"""
+    cards = []
+    for first in range(0, num_cards, cards_per_book):
+        book = first // cards_per_book
+        count = min(cards_per_book, num_cards - first)
+        book_text = TEXT * count
+        for i in range(count):
+            offset = i * len(TEXT)
+            if card_type is Card:
+                card = Card.from_book(
+                    f"book {book}",
+                    f"author {book % 50}",
+                    offset,
+                    offset + len(TEXT),
+                    book_text,
+                    offset,
+                    len(TEXT),
+                )
+            else:
+                card = card_type(
+                    f"book {book}",
+                    f"author {book % 50}",
+                    offset,
+                    offset + len(TEXT),
+                    book_text[offset : offset + len(TEXT)],
+                )
+            cards.append(card)
+    return cards
+
+
+def bytes_per_card(make, card_type, num_cards: int) -> float:
+    tracemalloc.start()
+    cards = make(card_type, num_cards)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del cards
+    return current / num_cards
+
+
+if __name__ == "__main__":
+    num_cards = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"{num_cards} cards")
+    for make in [from_jsonl, from_book]:
+        for card_type in [DataclassCard, Card]:
+            print(
+                f"{make.__name__}, {card_type.__name__}: "
+                f"{bytes_per_card(make, card_type, num_cards):.0f} bytes per card"
+            )
@@ -0,0 +1,54 @@
+"""Compare cards per second written by cards_to_jsonl_folder against the old
+approach of appending each card to its book's file separately.
+Run from the repo root: python test/src/benchmark_cards_to_jsonl.py [number of cards]"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import orjsonl as jsonl
+
+from book_to_flashcards import Card
+from book_to_flashcards.cards_jsonl import book_jsonl_path, cards_to_jsonl_folder
+
+
+def cards_to_jsonl_folder_per_card(cards, outputfolder):
+    """What cards_to_jsonl_folder used to do: reopen the book's file for every card"""
+    outputfile = None
+    for card in cards:
+        bookfile = book_jsonl_path(outputfolder, card.author, card.title)
+        if bookfile != outputfile:
+            outputfile = bookfile
+            outputfile.parent.mkdir(exist_ok=True, parents=True)
+        jsonl.append(outputfile, card, default=Card.to_dict)
+
+
+def make_cards(num_cards: int, cards_per_book: int = 2000):
+    for i in range(num_cards):
+        book = i // cards_per_book
+        yield Card(
+            title=f"book {book}",
+            author=f"author {book % 50}",
+            start=i * 70,
+            end=(i + 1) * 70,
+            text="Дедушка поцеловал Лидиньку, а она опрометью побежала к Даше, ",
+            translation="Grandfather kissed Lidinka, and she rushed to Dasha, ",
+        )
+
+
+def cards_per_second(write, num_cards: int) -> float:
+    with tempfile.TemporaryDirectory() as outputfolder:
+        start = time.perf_counter()
+        write(make_cards(num_cards), Path(outputfolder))
+        return num_cards / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    num_cards = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"{num_cards} cards")
+    for name, write in [
+        ("per card append", cards_to_jsonl_folder_per_card),
+        ("buffered writer", cards_to_jsonl_folder),
+    ]:
+        print(f"{name}: {cards_per_second(write, num_cards):.0f} cards/s")
@@ -0,0 +1,77 @@
+"""Compare consolidated_spans_in_tree against the recursive bisect.insort version
+it replaced, on made up sentences of 10 to 2000 tokens.
+Run from the repo root: python test/src/benchmark_consolidated_spans.py"""
+
+import bisect
+import random
+import sys
+import time
+
+import spacy
+from spacy.tokens import Doc, Span
+
+from split_sentences.split_sentences import (
+    consolidate_spans,
+    consolidated_spans_in_tree,
+)
+
+
+def recursive_spans_in_tree(doc, root_token, max_span_length=None):
+    """What consolidated_spans_in_tree used to do"""
+    all_spans_in_tree: list[Span] = []
+    for child in root_token.children:
+        for span in recursive_spans_in_tree(doc, child, max_span_length):
+            bisect.insort(all_spans_in_tree, span)
+    bisect.insort(all_spans_in_tree, Span(doc, root_token.i, root_token.i + 1))
+    yield from consolidate_spans(all_spans_in_tree, max_span_length)
+
+
+def random_tree(rng: random.Random, lo: int, hi: int, head: int, heads: list[int]):
+    """A random projective tree over tokens lo to hi-1, hanging from head"""
+    stack = [(lo, hi, head)]
+    while stack:
+        lo, hi, head = stack.pop()
+        if lo < hi:
+            token = rng.randrange(lo, hi)
+            heads[token] = head
+            stack.append((lo, token, token))
+            stack.append((token + 1, hi, token))
+
+
+def make_sentence(vocab, num_tokens: int, shape: str, seed: int = 0) -> Doc:
+    rng = random.Random(seed)
+    words = [rng.choice(["и", "он", "сказал", "что", "дом", ","]) for _ in range(num_tokens)]
+    if shape == "chain":
+        # a run-on sentence, each word hanging off the one before
+        heads = [max(i - 1, 0) for i in range(num_tokens)]
+    else:
+        heads = [0] * num_tokens
+        random_tree(rng, 1, num_tokens, 0, heads)
+    deps = ["ROOT"] + ["dep"] * (num_tokens - 1)
+    return Doc(vocab, words=words, heads=heads, deps=deps)
+
+
+def seconds_per_sentence(split, doc: Doc, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for _ in split(doc, doc[0], 70):
+            pass
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == "__main__":
+    sys.setrecursionlimit(10_000)  # the recursive version needs this for long chains
+    vocab = spacy.blank("ru").vocab
+    for shape in ["random", "chain"]:
+        for num_tokens in [10, 30, 100, 300, 1000, 2000]:
+            doc = make_sentence(vocab, num_tokens, shape)
+            assert [span.text for span in consolidated_spans_in_tree(doc, doc[0], 70)] == [
+                span.text for span in recursive_spans_in_tree(doc, doc[0], 70)
+            ]
+            repeats = max(1, 2000 // num_tokens)
+            recursive = seconds_per_sentence(recursive_spans_in_tree, doc, repeats)
+            linear = seconds_per_sentence(consolidated_spans_in_tree, doc, repeats)
+            print(
+                f"{shape} {num_tokens} tokens: recursive {recursive * 1000:.2f}ms, "
+                f"linear {linear * 1000:.2f}ms ({recursive / linear:.1f}x)"
+            )
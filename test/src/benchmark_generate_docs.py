@@ -0,0 +1,32 @@
+"""Compare docs per second from generate_docs against the old approach
+of calling nlp.pipe once for every line.
+Run from the repo root: python test/src/benchmark_generate_docs.py"""
+
+import time
+
+from book_complexity import make_nlp
+from book_complexity.book_complexity import generate_docs
+
+
+def generate_docs_per_line(nlp, inputfile):
+    """What generate_docs used to do"""
+    for line in inputfile:
+        yield from nlp.pipe([line.strip()])
+
+
+def docs_per_second(docs) -> float:
+    start = time.perf_counter()
+    count = sum(1 for _ in docs)
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    nlp = make_nlp("ru_core_news_sm")
+    with open("test/data/subset.txt", encoding="utf-8") as f:
+        lines = f.readlines() * 20
+
+    print(f"{len(lines)} lines")
+    print(f"per line:    {docs_per_second(generate_docs_per_line(nlp, lines)):.0f} docs/s")
+    for batch_size in [50, 1000]:
+        rate = docs_per_second(generate_docs(nlp, lines, batch_size=batch_size))
+        print(f"batch {batch_size:>5}: {rate:.0f} docs/s")
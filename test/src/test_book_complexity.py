@@ -1,14 +1,27 @@
 """Tests for book_complexity module"""
 
+import pickle
 from glob import glob
+from typing import ClassVar
 
-from book_complexity import get_book_complexity, make_nlp
-from book_complexity import ComplexityCalculators
+import numpy as np
+import pytest
+from spacy.tokens import Doc
+
+from book_complexity import ComplexityCalculators, get_book_complexity, make_nlp
 from book_complexity.book_complexity import (
+    Sampling,
     VocabLevelCalculator,
+    generate_docs,
+    get_book_complexity_profile,
     get_complexities,
+    get_complexities_parallel,
+    get_sampled_book_complexity,
+    levels,
+    make_calculators,
+    sample_chunks,
 )
-import pytest
+from book_complexity.ComplexityCalculators import VocabLevelTable, frequency_level
 
 
 @pytest.fixture()
@@ -21,15 +34,17 @@ def en_nlp():
     yield make_nlp("en_core_web_sm")
 
 
-@pytest.fixture()
-def complexity(ru_nlp):
-    long_strings = [
-        """Дедушка поцеловал Лидиньку, а она опрометью побежала к Даше, отдала ей рубль 
+long_strings = [
+    """Дедушка поцеловал Лидиньку, а она опрометью побежала к Даше, отдала ей рубль 
             и попросила разменять другой, чтобы снести два гривенника бедному хромому.""",
-        """Дедушка Ириней очень любил маленьких детей, т.е. таких детей, которые умны, 
+    """Дедушка Ириней очень любил маленьких детей, т.е. таких детей, которые умны, 
             слушают, когда им что говорят, не зевают по сторонам и не глядят в окошко, 
             когда маменька им показывает книжку""",
-    ]
+]
+
+
+@pytest.fixture()
+def complexity(ru_nlp):
     yield get_book_complexity(long_strings, ru_nlp)
 
 
@@ -101,3 +116,269 @@ class TestBookComplexityOnMultipleLongerStrings:
 
         doc = next(ru_nlp.pipe([short_string]))
         assert ComplexityCalculators.sentence_grammar_depth(next(doc.sents)) == 2
+
+    def test_complexities_parallel(self, en_nlp):
+        files = sorted(glob("test/data/dummy_books/**/*.txt", recursive=True))
+        serial = list(get_complexities(files, nlp=en_nlp))
+        parallel = list(
+            get_complexities_parallel(
+                files, pipeline="en_core_web_sm", workers=2, ordered=True
+            )
+        )
+        assert parallel == serial
+
+    def test_generate_docs_matches_per_line(self, ru_nlp):
+        lines = ["Дедушка поцеловал Лидиньку.\n", "\n", "  А она побежала к Даше.  \n"]
+        batched = list(generate_docs(ru_nlp, iter(lines), batch_size=2))
+        per_line = [next(ru_nlp.pipe([line.strip()])) for line in lines]
+        assert [doc.to_json() for doc in batched] == [
+            doc.to_json() for doc in per_line
+        ]
+
+    @pytest.mark.parametrize(
+        "vocabulary,frequency",
+        [
+            [None, None],
+            [{"Дедушка", "детей", "любил"}, {"дедушка": 1500, "детей": 300}],
+        ],
+    )
+    def test_vectorised_matches_token_by_token(self, ru_nlp, vocabulary, frequency):
+        lines = long_strings + ["", "12 книг, 3 тетради!!"]
+        vectorised = get_book_complexity(
+            lines, ru_nlp, vocabulary, frequency, levels, vectorised=True
+        )
+        token_by_token = get_book_complexity(
+            lines, ru_nlp, vocabulary, frequency, levels, vectorised=False
+        )
+        assert list(vectorised.items()) == list(token_by_token.items())
+
+
+@pytest.fixture()
+def blank_nlp():
+    """Just a tokenizer and sentencizer, for tests that don't need a trained model"""
+    import spacy
+
+    nlp = spacy.blank("ru")
+    nlp.add_pipe("sentencizer")
+    yield nlp
+
+
+class TestSentences:
+    """Without a parser (just a sentencizer) there are sentences but no
+    grammatical tree, so every token is its own head"""
+
+    @pytest.mark.parametrize(
+        "vocabulary,frequency",
+        [
+            [None, None],
+            [{"Дедушка", "детей", "любил"}, {"дедушка": 1500, "детей": 300}],
+        ],
+    )
+    def test_vectorised_matches_token_by_token(self, blank_nlp, vocabulary, frequency):
+        lines = long_strings + ["", "12 книг, 3 тетради!!"]
+        vectorised = get_book_complexity(
+            lines, blank_nlp, vocabulary, frequency, levels, vectorised=True
+        )
+        token_by_token = get_book_complexity(
+            lines, blank_nlp, vocabulary, frequency, levels, vectorised=False
+        )
+        assert list(vectorised.items()) == list(token_by_token.items())
+
+    def test_sentence_count(self, blank_nlp):
+        text = "Дедушка поцеловал Лидиньку. А она побежала к Даше."
+        results = get_book_complexity([text], blank_nlp)
+        assert results["Sentence Count"] == 2
+        assert results["Word Count"] == 8
+        assert results["Mean Words Per Sentence"] == 4.0
+        assert results["Mean Grammar Depth"] == 0
+
+    def test_parsed(self, blank_nlp):
+        words = ["Дедушка", "поцеловал", "Лидиньку", ".", "А", "она", "побежала", "."]
+        heads = [1, 1, 1, 1, 6, 6, 6, 6]
+        deps = ["nsubj", "ROOT", "obj", "punct", "cc", "nsubj", "ROOT", "punct"]
+        doc = Doc(blank_nlp.vocab, words=words, heads=heads, deps=deps)
+        for vectorised in [True, False]:
+            results = make_calculators(vectorised=vectorised).get_results([doc])
+            assert results["Sentence Count"] == 2
+            assert results["Cumulative Grammar Depth"] == 4
+
+
+class TestVocabLevelTable:
+    frequency: ClassVar = {"дедушка": 1500, "детей": 300, "Даше": 3000, "любил": 20000}
+    levels: ClassVar = [
+        range(1000),
+        range(1000, 2000),
+        range(2000, 5000),
+        range(5000, 99999),
+    ]
+
+    def test_same_levels_as_frequency_list(self, blank_nlp):
+        table = VocabLevelTable(self.frequency, self.levels)
+        doc = blank_nlp(long_strings[1] + " Даше даше ДЕДУШКА")
+        expected = [
+            frequency_level(self.frequency.get(token.text.lower(), 0), self.levels)
+            for token in doc
+        ]
+        assert table.levels(doc.to_array("LOWER")).tolist() == expected
+        assert list(table.histogram(doc.to_array("LOWER"))) == [
+            expected.count(level) for level in range(len(self.levels))
+        ]
+
+    def test_vectorised_matches_token_by_token(self, blank_nlp):
+        table = VocabLevelTable(self.frequency, self.levels)
+        results = []
+        for vectorised in [True, False]:
+            calculators = ComplexityCalculators.ComplexityCalculators(vectorised)
+            calculators.add("Vocab Level", VocabLevelCalculator(table))
+            results.append(calculators.get_results(blank_nlp.pipe(long_strings)))
+        assert results[0] == results[1]
+
+    def test_empty(self, blank_nlp):
+        table = VocabLevelTable({}, self.levels)
+        assert not table
+        assert table.histogram(blank_nlp("Дедушка").to_array("LOWER")).tolist() == [
+            1,
+            0,
+            0,
+            0,
+        ]
+
+    def test_pickle(self, blank_nlp):
+        table = pickle.loads(pickle.dumps(VocabLevelTable(self.frequency, self.levels)))
+        lower = blank_nlp("Дедушка любил детей").to_array("LOWER")
+        assert table.levels(lower).tolist() == [1, 3, 0]
+
+    def test_percentile(self):
+        calculator = VocabLevelCalculator(self.frequency, self.levels)
+        assert calculator.percentile(np.array([90, 9, 0, 1]), 95) == 1
+        assert calculator.percentile(np.array([0, 0, 0, 0]), 95) == 0
+
+
+class TestComplexityProfile:
+    lines: ClassVar = [
+        "Глава 1",
+        "Дедушка поцеловал Лидиньку. А она побежала к Даше.",
+        "Она отдала ей рубль.",
+        "Глава 2",
+        "Дедушка Ириней очень любил маленьких детей. Они умны. Они слушают.",
+    ]
+
+    def test_total_same_as_whole_book(self, blank_nlp):
+        rows = list(get_book_complexity_profile(self.lines, blank_nlp, sentences=2))
+        assert rows[-1] == {
+            "window": "total",
+            **get_book_complexity(self.lines, blank_nlp),
+        }
+        assert sum(row["Word Count"] for row in rows[:-1]) == rows[-1]["Word Count"]
+
+    def test_sentence_windows(self, blank_nlp):
+        # The lines have 1, 2, 1, 1 and 3 sentences, and a window ends
+        # with the line that takes it to 2
+        rows = list(get_book_complexity_profile(self.lines, blank_nlp, sentences=2))
+        assert [row["first_line"] for row in rows[:-1]] == [0, 2, 4]
+        assert [row["window"] for row in rows[:-1]] == [0, 1, 2]
+        assert [row["Sentence Count"] for row in rows] == [3, 2, 3, 8]
+
+    def test_character_windows(self, blank_nlp):
+        rows = list(get_book_complexity_profile(self.lines, blank_nlp, characters=60))
+        assert [row["first_line"] for row in rows[:-1]] == [0, 3]
+
+    def test_chapters(self, blank_nlp):
+        rows = list(
+            get_book_complexity_profile(self.lines, blank_nlp, chapter="^Глава")
+        )
+        assert [(row["first_line"], row["chapter"]) for row in rows[:-1]] == [
+            (0, "Глава 1"),
+            (3, "Глава 2"),
+        ]
+        chapter = get_book_complexity(self.lines[3:], blank_nlp)
+        assert rows[1]["Word Count"] == chapter["Word Count"]
+
+    def test_chapters_split_into_windows(self, blank_nlp):
+        rows = list(
+            get_book_complexity_profile(
+                self.lines, blank_nlp, characters=50, chapter="^Глава"
+            )
+        )
+        assert [(row["first_line"], row["chapter"]) for row in rows[:-1]] == [
+            (0, "Глава 1"),
+            (2, "Глава 1"),
+            (3, "Глава 2"),
+        ]
+
+    def test_empty(self, blank_nlp):
+        rows = list(get_book_complexity_profile([], blank_nlp, sentences=2))
+        assert [row["window"] for row in rows] == ["total"]
+
+
+class TestSampling:
+    # 500 lines of 2 sentences and 8 words, then 500 of 1 sentence and 8 words
+    lines: ClassVar = [
+        f"Дедушка поцеловал Лидиньку {n}. А она побежала к Даше." for n in range(500)
+    ]
+    lines += ["Она отдала ей рубль и попросила разменять другой."] * 500
+
+    @pytest.fixture()
+    def book(self, tmp_path):
+        book = tmp_path / "book.txt"
+        book.write_text("\n".join(self.lines) + "\n", encoding="utf-8")
+        yield book
+
+    def test_chunks_cover_every_line_once(self, book):
+        chunks = list(sample_chunks(book, chunks=37, chunk_lines=1000))
+        sampled = [line for _, lines in chunks for line in lines]
+        assert sorted(sampled) == sorted(line.strip() for line in self.lines)
+        assert sum(chunk["bytes"] for chunk, _ in chunks) == book.stat().st_size
+
+    def test_chunks_spread_through_file(self, book):
+        offsets = [chunk["offset"] for chunk, _ in sample_chunks(book, chunks=4)]
+        size = book.stat().st_size
+        assert offsets[0] == 0
+        assert size / 2 <= offsets[1] < size * 3 / 4
+        assert size / 4 <= offsets[2] < size / 2
+
+    def test_whole_file(self, book, blank_nlp):
+        # too few chunks to converge, and each big enough to read all its part
+        sampling = Sampling(chunks=5, chunk_lines=1000, min_chunks=10)
+        results = get_sampled_book_complexity(book, blank_nlp, sampling=sampling)
+        assert results.pop("Lines Sampled") == len(self.lines)
+        assert results.pop("Percent Sampled") == 100
+        assert results.pop("Converged") is False
+        assert results == get_book_complexity(self.lines, blank_nlp)
+        assert results["Sentence Count"] == 1500
+        assert results["Word Count"] == 8000
+        assert results["Mean Words Per Sentence"] == 5.3
+
+    def test_estimate(self, book, blank_nlp):
+        sampling = Sampling(chunks=100, chunk_lines=5, tolerance=0.05)
+        results = get_sampled_book_complexity(book, blank_nlp, sampling=sampling)
+        assert results["Converged"] is True
+        assert results["Lines Sampled"] < len(self.lines) / 2
+        assert results["Mean Words Per Sentence"] == pytest.approx(5.3, abs=0.3)
+        assert results["Sentence Count"] == pytest.approx(1500, rel=0.1)
+
+    def test_stops_once_converged(self, tmp_path, blank_nlp):
+        book = tmp_path / "book.txt"
+        line = "Дедушка поцеловал Лидиньку. А она побежала к Даше."
+        book.write_text((line + "\n") * 1000, encoding="utf-8")
+        sampling = Sampling(chunks=100, chunk_lines=2, tolerance=0, min_chunks=5)
+        results = get_sampled_book_complexity(book, blank_nlp, sampling=sampling)
+        assert results["Converged"] is True
+        assert results["Lines Sampled"] == 10
+        assert results["Percent Sampled"] == 1
+        # the counts are scaled up to the whole book
+        assert results["Sentence Count"] == 2000
+        assert results["Word Count"] == 8000
+        assert results["Mean Words Per Sentence"] == 4.0
+
+    def test_empty(self, tmp_path, blank_nlp):
+        book = tmp_path / "book.txt"
+        book.write_text("", encoding="utf-8")
+        results = get_sampled_book_complexity(book, blank_nlp)
+        assert results["Word Count"] == 0
+        assert results["Lines Sampled"] == 0
+
+    def test_get_complexities(self, book, blank_nlp):
+        [row] = get_complexities([str(book)], blank_nlp, sampling=Sampling())
+        assert row["title"] == "book"
+        assert row["Lines Sampled"] < len(self.lines)
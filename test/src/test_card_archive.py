@@ -0,0 +1,66 @@
+"""Test writing cards to a columnar archive and reading them back"""
+
+import pytest
+
+from book_to_flashcards.Card import Card
+from book_to_flashcards.card_archive import cards_from_archive, cards_to_archive
+from book_to_flashcards.cards_jsonl import cards_from_jsonl
+
+
+def make_cards(count):
+    return [
+        Card(
+            title=f"книга {i // 7}",
+            author=f"author {i // 21}",
+            start=i * 10,
+            end=i * 10 + 9,
+            text=f"текст {i}" if i % 5 else "",
+            translation=f"text {i}" if i % 3 else "",
+        )
+        for i in range(count)
+    ]
+
+
+class TestCardArchive:
+    def test_round_trip(self, tmp_path):
+        cards = list(cards_from_jsonl("test/data/test.jsonl"))
+        cards_to_archive(cards, tmp_path / "cards.cards")
+        assert list(cards_from_archive(tmp_path / "cards.cards")) == cards
+
+    @pytest.mark.parametrize("block_size", [1, 3, 8, 1000])
+    def test_blocks(self, tmp_path, block_size):
+        cards = make_cards(45)
+        cards_to_archive(cards, tmp_path / "cards.cards", block_size=block_size)
+        assert list(cards_from_archive(tmp_path / "cards.cards")) == cards
+
+    def test_no_cards(self, tmp_path):
+        cards_to_archive([], tmp_path / "cards.cards")
+        assert list(cards_from_archive(tmp_path / "cards.cards")) == []
+
+    def test_progress_per_book(self, tmp_path):
+        books = []
+        cards_to_archive(
+            make_cards(45), tmp_path / "cards.cards", progress=lambda: books.append(1)
+        )
+        assert len(books) == 7
+
+    def test_stop_early(self, tmp_path):
+        cards_to_archive(make_cards(45), tmp_path / "cards.cards", block_size=10)
+        cards = cards_from_archive(tmp_path / "cards.cards")
+        assert next(cards).start == 0
+        cards.close()  # releases the mapped file
+
+    def test_not_an_archive(self, tmp_path):
+        with pytest.raises(ValueError):
+            list(cards_from_archive("test/data/test.jsonl"))
+        (tmp_path / "empty").touch()
+        with pytest.raises(ValueError):
+            list(cards_from_archive(tmp_path / "empty"))
+
+    def test_truncated(self, tmp_path):
+        cards_to_archive(make_cards(50), tmp_path / "cards.cards")
+        archive = (tmp_path / "cards.cards").read_bytes()
+        for truncated in [archive[:-1], archive[:-8], archive[:-40], archive[:200]]:
+            (tmp_path / "truncated.cards").write_bytes(truncated)
+            with pytest.raises(ValueError, match="truncated"):
+                list(cards_from_archive(tmp_path / "truncated.cards"))
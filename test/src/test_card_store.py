@@ -0,0 +1,96 @@
+"""Test random access to jsonl cards through card_store"""
+
+import os
+import shutil
+
+import pytest
+
+from book_to_flashcards.Card import Card
+from book_to_flashcards.card_store import (
+    BookNotFoundError,
+    CardStore,
+    cards_from_store,
+    index_path,
+)
+from book_to_flashcards.cards_jsonl import cards_from_jsonl, cards_to_jsonl
+
+BOOK = ("dummy_books", "dummy_book")
+
+
+@pytest.fixture
+def jsonlfile(tmp_path):
+    path = tmp_path / "cards.jsonl"
+    shutil.copy("test/data/test.jsonl", path)
+    return path
+
+
+class TestCardStore:
+    def test_whole_book(self, jsonlfile):
+        with CardStore(jsonlfile) as store:
+            assert list(store.books) == [BOOK]
+            assert list(store.cards(BOOK)) == list(cards_from_jsonl(jsonlfile))
+        assert index_path(jsonlfile).exists()
+
+    def test_range(self, jsonlfile):
+        with CardStore(jsonlfile) as store:
+            assert [card.start for card in store.cards(BOOK, 60, 200)] == [65, 116, 165]
+            assert list(store.cards(("nobody", "nothing"))) == []
+
+    def test_card_at(self, jsonlfile):
+        with CardStore(jsonlfile) as store:
+            assert store.card_at(BOOK, 0).text == "This is a text file"
+            assert store.card_at(BOOK, 70).start == 65
+            assert store.card_at(BOOK, 10**9) is None
+
+    def test_only_reads_cards_asked_for(self, jsonlfile):
+        CardStore(jsonlfile).close()
+        stat = os.stat(jsonlfile)
+        lines = jsonlfile.read_bytes().splitlines(keepends=True)
+        # spoil every other card without changing the size or time of the file,
+        # so the index still matches it
+        jsonlfile.write_bytes(
+            b"".join(
+                line if b'"start":65,' in line else b"x" * (len(line) - 1) + b"\n"
+                for line in lines
+            )
+        )
+        os.utime(jsonlfile, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        with CardStore(jsonlfile) as store:
+            assert [card.start for card in store.cards(BOOK, 65, 66)] == [65]
+
+    def test_index_rebuilt_when_file_changes(self, jsonlfile):
+        CardStore(jsonlfile).close()
+        with open(jsonlfile, mode="ab") as file:
+            file.write(
+                b'{"author":"a","title":"b","start":0,"end":1,'
+                b'"text":"x","translation":""}\n'
+            )
+        with CardStore(jsonlfile) as store:
+            assert list(store.books) == [BOOK, ("a", "b")]
+            assert [card.text for card in store.cards(("a", "b"))] == ["x"]
+
+    def test_empty_file(self, tmp_path):
+        (tmp_path / "empty.jsonl").touch()
+        assert list(cards_from_store(tmp_path / "empty.jsonl")) == []
+
+    def test_folder(self, jsonlfile, tmp_path):
+        cards = list(cards_from_jsonl(jsonlfile))
+        cards_to_jsonl(cards, tmp_path / "folder")
+        folder = tmp_path / "folder"
+        assert list(cards_from_store(folder, "dummy_book", 60, 200)) == cards[2:5]
+        assert list(cards_from_store(folder, "dummy_books/dummy_book")) == cards
+        with pytest.raises(BookNotFoundError):
+            list(cards_from_store(folder, "other_book"))
+        with pytest.raises(BookNotFoundError):
+            list(cards_from_store(folder, "other_author/dummy_book"))
+
+    def test_title_with_dot(self, tmp_path):
+        """The folder writer names "Vol. 1" Vol.jsonl, so the file name isn't the title"""
+        cards = [
+            Card(title="Vol. 1", author="author", start=i, end=i + 1, text=f"{i}")
+            for i in range(3)
+        ]
+        cards_to_jsonl(cards, tmp_path / "folder")
+        folder = tmp_path / "folder"
+        assert list(cards_from_store(folder, "author/Vol. 1")) == cards
+        assert list(cards_from_store(folder, "Vol. 1", 1)) == cards[1:]
@@ -15,6 +15,7 @@ class TestClis:
             ["text", "dummy", "jsonfile"],
             ["folder", "dummy", "jsonfile"],
             ["jsonfile", "dummy", "jsonfile"],
+            ["jsonfile", "", "archive"],
         ],
     )
     def test_book_to_flashcard(self, source: str, translate: str, sink: str, tmp_path):
@@ -42,6 +43,8 @@ class TestClis:
             params.extend(["to-anki", "--fontsize", "12", tmp_path / "anki.apkg"])
         elif sink == "jsonfile":
             params.extend(["to-jsonl", tmp_path / "output.jsonl"])
+        elif sink == "archive":
+            params.extend(["to-archive", tmp_path / "output.cards"])
         else:
             pytest.fail(f"Unknown sink: {sink}")
 
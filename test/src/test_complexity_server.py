@@ -0,0 +1,100 @@
+"""Test serving complexity results over HTTP with complexity_server"""
+
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+import spacy
+
+from book_complexity import get_book_complexity, make_nlp
+from book_complexity.complexity_server import ComplexityServer, ComplexityService
+
+TEXT = "Дедушка поцеловал Лидиньку.\nА она опрометью побежала к Даше!\n"
+
+
+@pytest.fixture(scope="module")
+def pipeline(tmp_path_factory):
+    """A pipeline that loads quickly, and doesn't need a trained model"""
+    path = tmp_path_factory.mktemp("pipeline") / "blank_ru"
+    nlp = spacy.blank("ru")
+    nlp.add_pipe("sentencizer")
+    nlp.to_disk(path)
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def service(pipeline):
+    with ComplexityService([pipeline], workers=2, max_queue=1) as service:
+        yield service
+
+
+@pytest.fixture(scope="module")
+def url(service):
+    server = ComplexityServer(("127.0.0.1", 0), service)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def post(url, body) -> tuple[int, dict]:
+    data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+    request = urllib.request.Request(f"{url}/complexity", data=data, method="POST")
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+class TestComplexityServer:
+    def test_complexity(self, url, pipeline):
+        status, response = post(url, {"pipeline": pipeline, "text": TEXT})
+        assert status == 200
+        expected = get_book_complexity(TEXT.splitlines(), make_nlp(pipeline))
+        assert response["results"] == dict(expected)
+        # two sentences of 3 and 6 words
+        assert response["results"]["Sentence Count"] == 2
+        assert response["results"]["Word Count"] == 9
+        assert response["results"]["Mean Words Per Sentence"] == 4.5
+        assert response["pipeline"] == pipeline
+        timing = response["timing"]
+        assert timing["total_ms"] >= timing["processing_ms"] > 0
+
+    def test_only_pipeline_by_default(self, url, pipeline):
+        status, response = post(url, {"text": TEXT})
+        assert status == 200
+        assert response["pipeline"] == pipeline
+
+    def test_bad_requests(self, url):
+        assert post(url, b"not json")[0] == 400
+        assert post(url, {"pipeline": "nonsense", "text": TEXT})[0] == 400
+        assert post(url, {"words": TEXT})[0] == 400
+
+    def test_health(self, url, pipeline):
+        with urllib.request.urlopen(f"{url}/health") as response:
+            health = json.load(response)
+        assert health["pipelines"] == [pipeline]
+        assert health["pending"] == 0
+
+    def test_queue_full(self, url, service):
+        # take every slot, as if the workers and the queue were all busy
+        for _ in range(service.workers + service.max_queue):
+            service.slots.acquire()
+        try:
+            assert post(url, {"text": TEXT})[0] == 503
+        finally:
+            for _ in range(service.workers + service.max_queue):
+                service.slots.release()
+        assert post(url, {"text": TEXT})[0] == 200
+
+    def test_timeout(self, service):
+        service.timeout = 1e-6
+        try:
+            with pytest.raises(Exception, match="timed out"):
+                service.complexity(None, TEXT * 1000)
+        finally:
+            service.timeout = None
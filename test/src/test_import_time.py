@@ -0,0 +1,54 @@
+"""Check that the command line tools start quickly, by importing only what they need"""
+
+import subprocess
+import sys
+
+import pytest  # type: ignore
+
+# Generous, so a slow machine doesn't fail the test, but far below the seconds
+# it takes to import spacy
+IMPORT_BUDGET_SECONDS = 0.5
+
+HEAVY_MODULES = ["spacy", "deepl", "genanki", "jinja2", "alive_progress", "line_profiler"]
+
+
+def import_times(module: str) -> dict[str, float]:
+    """Cumulative import time in seconds of every module imported by importing module,
+    from python -X importtime"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative) / 1_000_000
+    return times
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "book_to_flashcards.cli_make_flashcards",
+        "book_complexity.cli_book_complexity",
+        "book_complexity.cli_books_complexity",
+        "book_complexity.cli_complexity_server",
+    ],
+)
+class TestImportTime:
+    def test_no_heavy_imports(self, module):
+        times = import_times(module)
+        assert [heavy for heavy in HEAVY_MODULES if heavy in times] == []
+
+    def test_import_budget(self, module):
+        times = import_times(module)
+        assert times[module] < IMPORT_BUDGET_SECONDS
+
+
+def test_anki_package_without_deepl():
+    """to-anki needs genanki and jinja2, but not deepl"""
+    assert "deepl" not in import_times("book_to_flashcards.cards_to_anki")
@@ -1,16 +1,32 @@
 """Test book_to_flashcards module"""
 
 import glob
+import html
+import json
 import os
 from pathlib import Path
+import pickle
+import sqlite3
+import sys
+import zipfile
+
+import genanki  # type: ignore
+import orjson
 import pytest  # type: ignore
 
 
 from book_to_flashcards import (
+    Card,
     ReverseTextTranslator,
     cards_untranslated_from_file,
 )
-from book_to_flashcards.cards_to_anki import cards_to_anki
+from book_to_flashcards import cards_untranslated_from_text
+from book_to_flashcards.cards_untranslated_from_text import (
+    card_trim_title,
+    cards_untranslated_from_files,
+)
+from book_to_flashcards.manifest import Manifest
+from book_to_flashcards.cards_to_anki import ModelCache, cards_to_anki, make_model
 from book_to_flashcards.cli_make_flashcards import translate_cards
 from book_to_flashcards.cards_jsonl import cards_from_jsonl, cards_to_jsonl  # type: ignore
 
@@ -109,6 +125,20 @@ class TestMakingCardsFromFile:
         cardsout = list(cards_from_jsonl(outputfolder / "jsonl"))
         assert test_cards_translated == cardsout
 
+    def test_parallel_matches_sequential(self, inputfolder):
+        inputfiles = glob.glob(str(inputfolder / "**/*.txt"), recursive=True)
+        sequential = list(
+            cards_untranslated_from_files(
+                inputfiles, pipeline="en_core_web_sm", maxfieldlen=30
+            )
+        )
+        parallel = list(
+            cards_untranslated_from_files(
+                inputfiles, pipeline="en_core_web_sm", maxfieldlen=30, workers=2
+            )
+        )
+        assert parallel == sequential
+
     def test_book_to_flashcard_roundtrip_overwrite_jsonls(
         self, test_cards_translated, inputfolder
     ):
@@ -124,3 +154,328 @@ class TestMakingCardsFromFile:
             [f for f in glob.glob(str(inputfolder / "**/*.txt"), recursive=True)]
         )
         assert inputfiles == outputfiles == 2
+
+
+class FakePipeline:
+    """Stands in for cards_untranslated_from_file, making one card per line
+    and remembering which files it was asked to parse"""
+
+    def __init__(self):
+        self.parsed = []
+
+    def __call__(self, inputfile, pipeline, maxfieldlen):
+        self.parsed.append(Path(inputfile).name)
+        with open(inputfile, encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                yield Card(
+                    title=Path(inputfile).stem,
+                    author=Path(inputfile).parent.stem,
+                    start=i,
+                    end=i + 1,
+                    text=line,
+                )
+
+
+class TestIncrementalRebuild:
+    @pytest.fixture
+    def books(self, tmp_path):
+        folder = tmp_path / "books" / "author"
+        folder.mkdir(parents=True)
+        (folder / "one.txt").write_text("first line\nsecond line\n", encoding="utf-8")
+        (folder / "two.txt").write_text("another book\n", encoding="utf-8")
+        yield sorted(str(f) for f in folder.glob("*.txt"))
+
+    @pytest.fixture
+    def fake_pipeline(self, monkeypatch):
+        fake = FakePipeline()
+        monkeypatch.setattr(
+            cards_untranslated_from_text, "cards_untranslated_from_file", fake
+        )
+        yield fake
+
+    def rebuild(self, books, jsonlfolder, maxfieldlen=70):
+        manifest = Manifest(jsonlfolder)
+        cards = cards_untranslated_from_files(
+            books,
+            pipeline="en_core_web_sm",
+            maxfieldlen=maxfieldlen,
+            manifest=manifest,
+        )
+        cards_to_jsonl(cards, jsonlfolder, manifest=manifest)
+        return sorted(cards_from_jsonl(jsonlfolder), key=lambda c: (c.title, c.start))
+
+    def test_unchanged_books_reused(self, books, fake_pipeline, tmp_path):
+        first = self.rebuild(books, tmp_path / "jsonl")
+        second = self.rebuild(books, tmp_path / "jsonl")
+        assert fake_pipeline.parsed == ["one.txt", "two.txt"]
+        assert first == second
+        assert (tmp_path / "jsonl.manifest.json").exists()
+
+    def test_changed_book_parsed_again(self, books, fake_pipeline, tmp_path):
+        self.rebuild(books, tmp_path / "jsonl")
+        Path(books[1]).write_text("a new edition\n", encoding="utf-8")
+        cards = self.rebuild(books, tmp_path / "jsonl")
+        assert fake_pipeline.parsed == ["one.txt", "two.txt", "two.txt"]
+        assert [card.text for card in cards if card.title == "two"] == ["a new edition\n"]
+
+    def test_changed_settings_parsed_again(self, books, fake_pipeline, tmp_path):
+        self.rebuild(books, tmp_path / "jsonl")
+        self.rebuild(books, tmp_path / "jsonl", maxfieldlen=30)
+        assert fake_pipeline.parsed == ["one.txt", "two.txt"] * 2
+
+    def test_only_written_books_recorded(self, books, fake_pipeline, tmp_path):
+        self.rebuild(books, tmp_path / "jsonl")
+        Path(books[1]).write_text("a new edition\n", encoding="utf-8")
+        # the changed book is parsed, but its cards go somewhere else (to-anki, say)
+        list(
+            cards_untranslated_from_files(
+                books,
+                pipeline="en_core_web_sm",
+                maxfieldlen=70,
+                manifest=Manifest(tmp_path / "jsonl"),
+            )
+        )
+        cards = self.rebuild(books, tmp_path / "jsonl")
+        assert fake_pipeline.parsed == ["one.txt", "two.txt", "two.txt", "two.txt"]
+        assert [card.text for card in cards if card.title == "two"] == ["a new edition\n"]
+
+    def test_other_folder_not_recorded(self, books, fake_pipeline, tmp_path):
+        manifest = Manifest(tmp_path / "jsonl")
+        cards = cards_untranslated_from_files(
+            books, pipeline="en_core_web_sm", maxfieldlen=70, manifest=manifest
+        )
+        with pytest.raises(ValueError):
+            cards_to_jsonl(cards, tmp_path / "elsewhere", manifest=manifest)
+        cards_to_jsonl(cards, tmp_path / "elsewhere")
+        assert not (tmp_path / "jsonl.manifest.json").exists()
+        self.rebuild(books, tmp_path / "jsonl")
+        assert fake_pipeline.parsed == ["one.txt", "two.txt"] * 2
+
+    def test_changed_titles_not_reused(self, books, fake_pipeline, tmp_path):
+        """Reuse finds books by their title, so it can't cope with titles changing"""
+        manifest = Manifest(tmp_path / "jsonl")
+        cards = cards_untranslated_from_files(
+            books, pipeline="en_core_web_sm", maxfieldlen=70, manifest=manifest
+        )
+        renamed = (card_trim_title(card, "e") for card in cards)
+        with pytest.raises(ValueError, match="titles"):
+            cards_to_jsonl(renamed, tmp_path / "jsonl", manifest=manifest)
+        assert list((tmp_path / "jsonl").glob("**/*.jsonl")) == []
+        assert Manifest(tmp_path / "jsonl").records == {}
+
+
+class TestCard:
+    book = "Once upon a time\nthere was a book\n"
+
+    def test_from_book(self):
+        card = Card.from_book("title", "author", 5, 9, self.book, 5, 5)
+        assert card.text == "upon "
+        assert card == Card(title="title", author="author", start=5, end=9, text="upon ")
+
+    def test_from_dict(self):
+        card = Card.from_book("title", "author", 0, 4, self.book, 0, 5)
+        assert Card(**card.to_dict()) == card
+
+    def test_shared_title_and_author(self):
+        line = b'{"title": "t", "author": "a", "start": 0, "end": 1, "text": "x"}'
+        cards = [Card(**orjson.loads(line)) for _ in range(2)]
+        assert cards[0].title is cards[1].title
+        assert cards[0].author is cards[1].author
+
+    def test_replace(self):
+        card = Card.from_book("title", "author", 0, 4, self.book, 0, 5)
+        assert card.replace(title="other").title == "other"
+        assert card.replace(title="other").text == "Once "
+        assert card.replace(text="Twice").text == "Twice"
+        assert card.text == "Once "
+        with pytest.raises(TypeError):
+            card.replace(colour="red")
+
+    def test_no_dict(self):
+        card = Card(title="title", author="author", start=0, end=1, text="x")
+        with pytest.raises(AttributeError):
+            card.colour = "red"  # type: ignore[attr-defined]
+
+    def test_pickle(self):
+        cards = [
+            Card.from_book("title", "author", 0, 4, self.book, 0, 5),
+            Card.from_book("title", "author", 5, 9, self.book, 5, 5),
+        ]
+        assert pickle.loads(pickle.dumps(cards)) == cards
+
+
+class TestJsonlFolder:
+    def test_write_jsonl_folder(self, tmp_path):
+        cards = list(cards_from_jsonl("test/data/test.jsonl"))
+        cards_to_jsonl(cards, tmp_path)
+        cards_to_jsonl(cards, tmp_path)  # overwrite the files we just wrote
+
+        assert list(cards_from_jsonl(tmp_path)) == cards
+        assert list(tmp_path.glob("**/*.tmp")) == []
+        assert (tmp_path / "dummy_books" / "dummy_book.jsonl").exists()
+
+    @pytest.fixture
+    def library(self, tmp_path):
+        cards = [
+            Card(
+                title=f"book {i // 3}",
+                author=f"author {i // 9}",
+                start=i,
+                end=i + 1,
+                text=f"card {i}",
+            )
+            for i in range(40)
+        ]
+        cards_to_jsonl(cards, tmp_path)
+        return cards
+
+    @pytest.mark.parametrize("prefetch", [1, 2, 100])
+    def test_prefetch(self, tmp_path, library, prefetch):
+        sequential = list(cards_from_jsonl(tmp_path))
+        assert sorted(card.start for card in sequential) == list(range(40))
+        assert list(cards_from_jsonl(tmp_path, prefetch=prefetch)) == sequential
+
+    def test_prefetch_stop_early(self, tmp_path, library):
+        cards = cards_from_jsonl(tmp_path, prefetch=2)
+        first = next(cards)
+        cards.close()
+        assert first == next(iter(cards_from_jsonl(tmp_path)))
+
+
+class TestAnkiPackage:
+    def read_package(self, ankifile, tmp_path):
+        with zipfile.ZipFile(ankifile) as package:
+            package.extract("collection.anki2", tmp_path)
+        connection = sqlite3.connect(tmp_path / "collection.anki2")
+        notes = connection.execute("SELECT guid, flds FROM notes ORDER BY id").fetchall()
+        (decks,) = connection.execute("SELECT decks FROM col").fetchone()
+        (cards,) = connection.execute("SELECT COUNT(*) FROM cards").fetchone()
+        connection.close()
+        return notes, json.loads(decks), cards
+
+    def test_streamed_package(self, tmp_path):
+        cards = list(cards_from_jsonl("test/data/test.jsonl"))
+        ankifile = tmp_path / "streamed.apkg"
+        cards_to_anki(iter(cards), True, str(ankifile), 12, batch_size=7)
+        notes, decks, anki_cards = self.read_package(ankifile, tmp_path)
+
+        assert len(notes) == len(cards)
+        assert anki_cards == len(cards)
+        assert [note[1].split("\x1f")[5] for note in notes] == [
+            html.escape(card.text) for card in cards
+        ]
+        assert "books::dummy_books::dummy_book" in [
+            deck["name"] for deck in decks.values()
+        ]
+
+    def test_same_notes_as_genanki(self, tmp_path, monkeypatch):
+        """The streaming writer should agree with a package built in memory by genanki"""
+        cards = list(cards_from_jsonl("test/data/test.jsonl"))
+        cards_to_anki(iter(cards), False, str(tmp_path / "streamed.apkg"), 12)
+        streamed, _, _ = self.read_package(tmp_path / "streamed.apkg", tmp_path)
+
+        decks = []
+
+        class InMemoryWriter:
+            def __init__(self, ankifile, batch_size):
+                self.ankifile = ankifile
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                genanki.Package(decks).write_to_file(self.ankifile)
+
+            def add_deck(self, deck):
+                decks.append(deck)
+
+            def add_note(self, note, deck):
+                deck.add_note(note)
+
+        monkeypatch.setattr(
+            "book_to_flashcards.anki_package_writer.AnkiPackageWriter", InMemoryWriter
+        )
+        cards_to_anki(iter(cards), False, str(tmp_path / "genanki.apkg"), 12)
+        in_memory, _, _ = self.read_package(tmp_path / "genanki.apkg", tmp_path)
+
+        assert streamed == in_memory
+        assert make_model(12).model_id == 1356306641
+
+    def make_library(self):
+        """Three books, with 3, 5 and 2 cards"""
+        return [
+            Card(title=title, author="author", start=i, end=i + 1, text=f"{title} {i}")
+            for title, count in [("one", 3), ("two", 5), ("three", 2)]
+            for i in range(count)
+        ]
+
+    def test_sharded_by_notes(self, tmp_path):
+        ankifile = tmp_path / "library.apkg"
+        cards_to_anki(iter(self.make_library()), True, str(ankifile), 12, max_notes=4)
+
+        assert not ankifile.exists()
+        index = json.loads((tmp_path / "library.index.json").read_text("utf-8"))
+        assert index == [
+            {
+                "file": "library.001.apkg",
+                "books": ["books::author::one", "books::author::two"],
+                "notes": 8,
+            },
+            {"file": "library.002.apkg", "books": ["books::author::three"], "notes": 2},
+        ]
+        for shard in index:
+            notes, decks, _ = self.read_package(tmp_path / shard["file"], tmp_path)
+            assert len(notes) == shard["notes"]
+            assert set(shard["books"]) <= {deck["name"] for deck in decks.values()}
+
+    def test_sharded_by_bytes(self, tmp_path):
+        ankifile = tmp_path / "library.apkg"
+        cards_to_anki(iter(self.make_library()), True, str(ankifile), 12, max_bytes=1)
+
+        index = json.loads((tmp_path / "library.index.json").read_text("utf-8"))
+        assert [shard["notes"] for shard in index] == [3, 5, 2]
+
+    def test_shards_survive_a_crash(self, tmp_path):
+        def crash_in_third_book():
+            yield from self.make_library()
+            raise RuntimeError("crash")
+
+        ankifile = tmp_path / "library.apkg"
+        with pytest.raises(RuntimeError):
+            cards_to_anki(crash_in_third_book(), True, str(ankifile), 12, max_notes=1)
+
+        index = json.loads((tmp_path / "library.index.json").read_text("utf-8"))
+        assert [shard["file"] for shard in index] == [
+            "library.001.apkg",
+            "library.002.apkg",
+        ]
+        assert (tmp_path / "library.002.apkg").exists()
+        assert not (tmp_path / "library.003.apkg").exists()
+
+
+class TestModelCache:
+    def test_package_exports_function(self):
+        """Importing the cards_to_anki module mustn't hide the function of the same name"""
+        import book_to_flashcards
+
+        assert book_to_flashcards.cards_to_anki is cards_to_anki
+        assert book_to_flashcards.ModelCache is ModelCache
+
+    def test_one_model_per_font_size(self):
+        cache = ModelCache()
+        assert cache.model(12) is cache.model(12)
+        assert cache.model(12) is not cache.model(20)
+        assert "12" in cache.model(12).css
+        assert "20" in cache.model(20).css
+
+    def test_shared_cache(self):
+        assert make_model(12) is make_model(12)
+        assert make_model(12).to_json(0, 1) == ModelCache().model(12).to_json(0, 1)
+
+    def test_resources_read_once(self, monkeypatch):
+        cache = ModelCache()
+        monkeypatch.setattr(
+            sys.modules[ModelCache.__module__], "files", lambda package: pytest.fail("resources read again")
+        )
+        cache.model(14)
+        cache.model(16)
@@ -0,0 +1,136 @@
+"""Test keeping parsed CSVs between runs with resource_cache"""
+
+import io
+import os
+import pickle
+import sys
+
+from book_complexity.book_complexity import (
+    frequencies_from_csv,
+    levels,
+    load_morphs,
+    load_vocab_level_table,
+    morphs_from_csv,
+)
+from book_complexity.resource_cache import ResourceCache
+
+
+class Maker:
+    """Make a resource, counting how many times it has been made"""
+
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+class TestResourceCache:
+    def test_cached(self, tmp_path):
+        source = tmp_path / "source.csv"
+        source.write_text("a,b\n", encoding="utf-8")
+        make = Maker({"a": 1})
+        for _ in range(3):
+            assert ResourceCache(tmp_path / "cache").get("test", source, make) == {"a": 1}
+        assert make.calls == 1
+
+    def test_changed_source(self, tmp_path):
+        source = tmp_path / "source.csv"
+        source.write_text("a,b\n", encoding="utf-8")
+        cache = ResourceCache(tmp_path / "cache")
+        cache.get("test", source, Maker(1))
+        source.write_text("a,b,c\n", encoding="utf-8")
+        assert cache.get("test", source, Maker(2)) == 2
+        assert cache.get("test", source, Maker(3)) == 2
+
+    def test_touched_source(self, tmp_path):
+        source = tmp_path / "source.csv"
+        source.write_text("a,b\n", encoding="utf-8")
+        cache = ResourceCache(tmp_path / "cache")
+        cache.get("test", source, Maker(1))
+        stat = source.stat()
+        os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        make = Maker(2)
+        assert cache.get("test", source, make) == 1
+        assert make.calls == 0
+
+    def test_kinds_kept_apart(self, tmp_path):
+        source = tmp_path / "source.csv"
+        source.write_text("a,b\n", encoding="utf-8")
+        cache = ResourceCache(tmp_path / "cache")
+        cache.get("one", source, Maker(1))
+        assert cache.get("two", source, Maker(2)) == 2
+        assert cache.get("one", source, Maker(3)) == 1
+
+    def test_not_a_file(self, tmp_path):
+        cache = ResourceCache(tmp_path / "cache")
+        make = Maker(1)
+        cache.get("test", io.BytesIO(b"a,b\n"), make)
+        cache.get("test", io.BytesIO(b"a,b\n"), make)
+        assert make.calls == 2
+        assert not (tmp_path / "cache").exists()
+
+    def test_corrupt_entry(self, tmp_path):
+        source = tmp_path / "source.csv"
+        source.write_text("a,b\n", encoding="utf-8")
+        cache = ResourceCache(tmp_path / "cache")
+        cache.get("test", source, Maker(1))
+        entry = cache.entry_path("test", source.resolve())
+        entry.write_bytes(b"not a pickle")
+        assert cache.get("test", source, Maker(2)) == 2
+
+    def test_corrupt_resource(self, tmp_path):
+        """A good header, but the resource after it can't be loaded"""
+        source = tmp_path / "source.csv"
+        source.write_text("a,b\n", encoding="utf-8")
+        cache = ResourceCache(tmp_path / "cache")
+        cache.get("test", source, Maker(1))
+        entry = cache.entry_path("test", source.resolve())
+        header = pickle.dumps(pickle.loads(entry.read_bytes()))
+        for resource in [b"", b"not a pickle", pickle.dumps(Maker)[:-8]]:
+            entry.write_bytes(header + resource)
+            make = Maker(2)
+            assert cache.get("test", source, make) == 2
+            assert make.calls == 1
+            assert cache.get("test", source, Maker(3)) == 2
+
+    def test_resource_class_gone(self, tmp_path, monkeypatch):
+        source = tmp_path / "source.csv"
+        source.write_text("a,b\n", encoding="utf-8")
+        cache = ResourceCache(tmp_path / "cache")
+        cache.get("test", source, Maker(Maker(1)))
+        monkeypatch.delattr(sys.modules[__name__], "Maker")
+        assert cache.get("test", source, lambda: 2) == 2
+
+
+class TestCachedCsvs:
+    def test_morphs(self, tmp_path):
+        source = tmp_path / "morphs.csv"
+        source.write_text("lemma,inflection\nдом,дома\nкот,кота\n", encoding="utf-8")
+        cache = ResourceCache(tmp_path / "cache")
+        with open(source, mode="rb") as file:
+            expected = morphs_from_csv(file)
+        for _ in range(2):
+            with open(source, mode="rb") as file:
+                assert load_morphs(file, cache) == expected
+
+    def test_vocab_level_table(self, tmp_path):
+        source = tmp_path / "frequency.csv"
+        rows = [f"lemma{i},слово{i}" for i in range(3000)]
+        source.write_text("\n".join(["lemma,inflection", *rows]), encoding="utf-8")
+        cache = ResourceCache(tmp_path / "cache")
+        with open(source, mode="rb") as file:
+            expected = load_vocab_level_table(file, levels)
+            file.seek(0)
+            assert len(expected) == len(frequencies_from_csv(file))
+        for _ in range(2):
+            with open(source, mode="rb") as file:
+                table = load_vocab_level_table(file, levels, cache)
+            assert (table.hashes == expected.hashes).all()
+            assert (table.word_levels == expected.word_levels).all()
+        # different levels are a different resource
+        with open(source, mode="rb") as file:
+            table = load_vocab_level_table(file, levels[:2], cache)
+        assert table.num_levels == 2
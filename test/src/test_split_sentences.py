@@ -1,8 +1,15 @@
 """Test split sentences module"""
 
+import bisect
+import random
+
 import pytest
+import spacy
+from spacy.tokens import Doc, Span
+
 from book_to_flashcards.cards_untranslated_from_text import trim_title
-from split_sentences import consolidate_spans, make_nlp, split_sentence, split_sentences, split_text
+from split_sentences import consolidate_spans, load_nlp, make_nlp, split_sentence, split_sentences, split_text
+from split_sentences.split_sentences import consolidated_spans_in_tree, split_from_text
 
 
 @pytest.fixture()
@@ -93,6 +100,12 @@ class TestSentenceSplitting:
         spans = list(consolidate_spans(spans, None))
         assert "".join([doc.text_with_ws for doc in docs]) == "".join([s.text_with_ws for s in spans ])
 
+    def test_make_nlp_is_cached(self, nlp_ru):
+        assert make_nlp("ru_core_news_sm") is nlp_ru
+        assert nlp_ru.pipe_names.count("tidy_punctuation") == 1
+        # complexity analysis doesn't want punctuation merged, so gets its own pipeline
+        assert "tidy_punctuation" not in load_nlp("ru_core_news_sm").pipe_names
+
     def test_trim_filename(self):
         filename = "bumledydum_2000"
         trimmed = trim_title(filename, '_')
@@ -102,4 +115,96 @@ class TestSentenceSplitting:
         filename = "bumledydum_2000_foo"
         trimmed = trim_title(filename, '_')
         assert trimmed == "bumledydum_2000"
-        
\ No newline at end of file
+        
+
+def recursive_spans_in_tree(doc, root_token, max_span_length=None):
+    """The original recursive version of consolidated_spans_in_tree"""
+    all_spans_in_tree = []
+    for child in root_token.children:
+        for span in recursive_spans_in_tree(doc, child, max_span_length):
+            bisect.insort(all_spans_in_tree, span)
+    bisect.insort(all_spans_in_tree, Span(doc, root_token.i, root_token.i + 1))
+    yield from consolidate_spans(all_spans_in_tree, max_span_length)
+
+
+class TestConsolidatedSpansInTree:
+    """Runs on made up parse trees, so doesn't need a spacy model"""
+
+    @pytest.fixture()
+    def vocab(self):
+        yield spacy.blank("ru").vocab
+
+    def random_doc(self, vocab, rng, projective: bool) -> Doc:
+        num_tokens = rng.randint(1, 40)
+        words = [rng.choice(["и", "он", "сказал", "что", "дом", ","]) for _ in range(num_tokens)]
+        heads = [0] * num_tokens
+        if projective:
+            stack = [(1, num_tokens, 0)]
+            while stack:
+                lo, hi, head = stack.pop()
+                if lo < hi:
+                    token = rng.randrange(lo, hi)
+                    heads[token] = head
+                    stack.extend([(lo, token, token), (token + 1, hi, token)])
+        else:
+            # each token hangs off a random earlier one, so arcs cross
+            heads = [rng.randrange(i) if i else 0 for i in range(num_tokens)]
+        deps = ["ROOT"] + ["dep"] * (num_tokens - 1)
+        return Doc(vocab, words=words, heads=heads, deps=deps)
+
+    @pytest.mark.parametrize("projective", [True, False])
+    def test_same_as_recursive(self, vocab, projective):
+        rng = random.Random(1)
+        for _ in range(300):
+            doc = self.random_doc(vocab, rng, projective)
+            token = doc[rng.randrange(len(doc))]
+            for max_span_length in [None, 5, 12, 30]:
+                expected = list(recursive_spans_in_tree(doc, doc[0], max_span_length))
+                assert list(consolidated_spans_in_tree(doc, doc[0], max_span_length)) == expected
+                # and starting part way down the tree
+                expected = list(recursive_spans_in_tree(doc, token, max_span_length))
+                assert list(consolidated_spans_in_tree(doc, token, max_span_length)) == expected
+
+    def test_run_on_sentence(self, vocab):
+        """A chain of words each hanging off the last one is too deep to recurse through"""
+        num_tokens = 5000
+        doc = Doc(
+            vocab,
+            words=["и"] * num_tokens,
+            heads=[max(i - 1, 0) for i in range(num_tokens)],
+            deps=["ROOT"] + ["dep"] * (num_tokens - 1),
+        )
+        spans = list(consolidated_spans_in_tree(doc, doc[0], 70))
+        assert "".join(span.text_with_ws for span in spans) == doc.text
+        assert all(len(span.text_with_ws) <= 70 for span in spans)
+
+
+class TestSplitText:
+    """split_text should give exactly what consolidating split_from_text's spans gives"""
+
+    @pytest.mark.parametrize("max_span_length", [None, 30, 70, 200])
+    def test_same_as_consolidate_spans(self, nlp_ru, max_span_length):
+        with open("test/data/subset.txt", encoding="utf-8") as file:
+            docs = list(nlp_ru.pipe(file))
+        expected = list(consolidate_spans(split_from_text(docs, max_span_length), max_span_length))
+        assert list(split_text(docs, max_span_length)) == expected
+
+    @pytest.mark.parametrize("max_span_length", [None, 12, 30])
+    def test_made_up_lines(self, max_span_length):
+        vocab = spacy.blank("ru").vocab
+        rng = random.Random(2)
+        docs = []
+        for _ in range(200):
+            doc = TestConsolidatedSpansInTree().random_doc(vocab, rng, projective=True)
+            # end each line with a newline, as when we read a book a line at a time
+            docs.append(
+                Doc(
+                    vocab,
+                    words=[token.text for token in doc] + ["\n"],
+                    spaces=[True] * len(doc) + [False],
+                    heads=[token.head.i for token in doc] + [0],
+                    deps=[token.dep_ for token in doc] + ["dep"],
+                )
+            )
+        expected = list(consolidate_spans(split_from_text(docs, max_span_length), max_span_length))
+        assert list(split_text(docs, max_span_length)) == expected
@@ -0,0 +1,159 @@
+"""Test concurrent, rate limited translation in translate_cards"""
+
+import threading
+import time
+
+import pytest
+
+from book_to_flashcards import Card, ReverseTextTranslator, translate_cards
+from book_to_flashcards.translate_cards import (
+    BatchPolicy,
+    BatchStats,
+    RateLimiter,
+    translate_with_retries,
+)
+
+
+class LatencyTranslator(ReverseTextTranslator):
+    """Pretend to be a translator at the other end of a slow network"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.active = 0
+        self.most_active = 0
+
+    def translate_text(self, text, target_lang):
+        with self.lock:
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        time.sleep(self.latency)
+        with self.lock:
+            self.active -= 1
+        return super().translate_text(text, target_lang)
+
+
+class HttpError(Exception):
+    def __init__(self, http_status_code):
+        self.http_status_code = http_status_code
+
+
+class FlakyTranslator(ReverseTextTranslator):
+    """Fail with the given status codes before translating successfully"""
+
+    def __init__(self, *failures):
+        self.failures = list(failures)
+
+    def translate_text(self, text, target_lang):
+        if self.failures:
+            raise HttpError(self.failures.pop(0))
+        return super().translate_text(text, target_lang)
+
+
+def make_cards(count):
+    return [
+        Card(title="book", author="author", start=i, end=i + 1, text=f"card {i}")
+        for i in range(count)
+    ]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestConcurrentTranslation:
+    def test_order_preserved(self):
+        translator = LatencyTranslator(0.05)
+        cards = list(translate_cards(make_cards(1000), translator, "dummy", in_flight=4))
+
+        assert [card.start for card in cards] == list(range(1000))
+        assert all(card.translation == card.text[::-1] for card in cards)
+        assert translator.most_active == 4
+
+    def test_sequential_by_default(self):
+        translator = LatencyTranslator(0.01)
+        list(translate_cards(make_cards(1000), translator, "dummy"))
+        assert translator.most_active == 1
+
+    def test_retries_overloaded_translator(self):
+        translator = FlakyTranslator(429, 503)
+        translations = translate_with_retries(
+            ["abc"], translator, "dummy", retries=2, sleep=lambda s: None
+        )
+        assert translations == ["cba"]
+
+    def test_gives_up_after_retries(self):
+        translator = FlakyTranslator(429, 429)
+        with pytest.raises(HttpError):
+            translate_with_retries(
+                ["abc"], translator, "dummy", retries=1, sleep=lambda s: None
+            )
+
+    def test_does_not_retry_client_errors(self):
+        translator = FlakyTranslator(456)  # DeepL quota exceeded
+        with pytest.raises(HttpError):
+            translate_with_retries(
+                ["abc"], translator, "dummy", retries=3, sleep=lambda s: None
+            )
+
+    def test_requests_per_second(self):
+        clock = FakeClock()
+        limiter = RateLimiter(requests_per_second=2, clock=clock, sleep=clock.sleep)
+        for _ in range(5):
+            limiter.wait(10)
+        assert clock.now == 2.0
+
+    def test_characters_per_minute(self):
+        clock = FakeClock()
+        limiter = RateLimiter(characters_per_minute=600, clock=clock, sleep=clock.sleep)
+        limiter.wait(600)  # a full minute's budget can go straight away
+        assert clock.now == 0.0
+        limiter.wait(300)  # but then we have to wait for the budget to refill
+        assert clock.now == 30.0
+
+
+class TestBatchPolicy:
+    def test_packs_to_byte_budget(self):
+        cards = make_cards(10)  # "card 0" ... "card 9", 6 bytes each
+        batches = list(BatchPolicy(max_bytes=20, max_items=200).batches(cards))
+        assert [len(batch) for batch in batches] == [3, 3, 3, 1]
+
+    def test_max_items(self):
+        batches = list(BatchPolicy(max_bytes=1000, max_items=4).batches(make_cards(10)))
+        assert [len(batch) for batch in batches] == [4, 4, 2]
+
+    def test_oversized_card_gets_own_batch(self):
+        cards = make_cards(2)
+        cards[0].text = "x" * 50
+        batches = list(BatchPolicy(max_bytes=20).batches(cards))
+        assert [len(batch) for batch in batches] == [1, 1]
+
+    def test_counts_bytes_not_characters(self):
+        cards = make_cards(2)
+        for card in cards:
+            card.text = "ёж"  # 2 characters, 4 bytes
+        batches = list(BatchPolicy(max_bytes=6).batches(cards))
+        assert [len(batch) for batch in batches] == [1, 1]
+
+    def test_stats(self):
+        stats = BatchStats(max_bytes=70)
+        list(
+            translate_cards(
+                make_cards(20),
+                ReverseTextTranslator(),
+                "dummy",
+                batch_policy=BatchPolicy(max_bytes=70),
+                stats=stats,
+            )
+        )
+        assert stats.requests == 2
+        assert stats.texts == 20
+        assert stats.bytes == 6 * 10 + 7 * 10
+        assert stats.bytes_per_request == 65
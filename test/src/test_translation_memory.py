@@ -0,0 +1,91 @@
+"""Test the on-disk translation memory used by translate_cards"""
+
+import pytest
+
+from book_to_flashcards import (
+    Card,
+    ReverseTextTranslator,
+    TranslationMemory,
+    translate_cards,
+)
+from book_to_flashcards.translation_memory import translator_id
+
+
+class CountingTranslator(ReverseTextTranslator):
+    """Keep track of every text we were asked to translate"""
+
+    def __init__(self):
+        self.requested: list[str] = []
+
+    def translate_text(self, text, target_lang):
+        self.requested.extend(text)
+        return super().translate_text(text, target_lang)
+
+
+def make_cards(texts):
+    return [
+        Card(title="book", author="author", start=i, end=i + 1, text=text)
+        for i, text in enumerate(texts)
+    ]
+
+
+@pytest.fixture
+def memory(tmp_path):
+    with TranslationMemory(tmp_path / "memory.sqlite") as memory:
+        yield memory
+
+
+class TestTranslationMemory:
+    def test_only_misses_are_translated(self, memory):
+        translator = CountingTranslator()
+        list(translate_cards(make_cards(["one", "two"]), translator, "dummy", memory))
+        cards = list(
+            translate_cards(
+                make_cards(["one", "two", "three", "three"]), translator, "dummy", memory
+            )
+        )
+
+        assert [card.translation for card in cards] == ["eno", "owt", "eerht", "eerht"]
+        assert translator.requested == ["one", "two", "three"]
+        assert memory.stats() == {"hits": 2, "misses": 4, "entries": 3}
+
+    def test_persists_between_runs(self, tmp_path):
+        with TranslationMemory(tmp_path / "memory.sqlite") as memory:
+            memory.store(["hello"], ["olleh"], "dummy", "reverse")
+        with TranslationMemory(tmp_path / "memory.sqlite") as memory:
+            assert memory.lookup(["hello"], "dummy", "reverse") == ["olleh"]
+
+    def test_keyed_by_lang_and_translator(self, memory):
+        memory.store(["hello"], ["olleh"], "dummy", "reverse")
+        assert memory.lookup(["hello"], "EN-GB", "reverse") == [None]
+        assert memory.lookup(["hello"], "dummy", "deepl") == [None]
+
+    def test_least_recently_used_evicted(self, tmp_path):
+        with TranslationMemory(tmp_path / "memory.sqlite", max_entries=2) as memory:
+            memory.store(["a"], ["A"], "dummy", "reverse")
+            memory.store(["b"], ["B"], "dummy", "reverse")
+            memory.lookup(["a"], "dummy", "reverse")  # now b is the oldest
+            memory.store(["c"], ["C"], "dummy", "reverse")
+
+            assert len(memory) == 2
+            assert memory.lookup(["a", "b", "c"], "dummy", "reverse") == ["A", None, "C"]
+
+    def test_entry_count(self, tmp_path):
+        """The running count agrees with the table, through updates and eviction"""
+
+        def count(memory):
+            query = "SELECT COUNT(*) FROM translations"
+            return memory.connection.execute(query).fetchone()[0]
+
+        with TranslationMemory(tmp_path / "memory.sqlite", max_entries=4) as memory:
+            memory.store(["a", "b", "a"], ["A", "B", "A"], "dummy", "reverse")
+            memory.store(["a", "c"], ["new A", "C"], "dummy", "reverse")
+            assert len(memory) == count(memory) == 3
+            assert memory.lookup(["a"], "dummy", "reverse") == ["new A"]
+        with TranslationMemory(tmp_path / "memory.sqlite", max_entries=4) as memory:
+            assert len(memory) == 3
+            memory.store(["d", "e", "f"], ["D", "E", "F"], "dummy", "reverse")
+            assert len(memory) == count(memory) == 4
+
+    def test_translator_id(self):
+        assert translator_id(ReverseTextTranslator()).endswith("ReverseTextTranslator")